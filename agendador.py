@@ -0,0 +1,119 @@
+"""
+Política de agendamento das solicitações pendentes.
+
+As etapas de solicitação e de download não consomem mais a fila por ordem de
+criação: a cada ciclo pegam um lote limitado escolhido nesta ordem:
+
+1. dias recentes (últimos AGENDADOR_JANELA_RECENTE dias) antes do histórico;
+2. maior prioridade (solicitacoes.prioridade + empresas.prioridade);
+3. rodízio entre IEs: a n-ésima solicitação de cada empresa vem antes da
+   (n+1)-ésima de qualquer outra, dias mais novos primeiro.
+
+Como o lote é reavaliado a cada ciclo, as solicitações diárias do startList
+esperam no máximo um lote mesmo durante uma carga histórica do atualizacaoManual,
+que usa apenas a capacidade que sobra.
+
+Uso:
+    python agendador.py --ie IE --prioridade 10    # prioriza uma empresa (0 remove)
+    python agendador.py --mostrar solicitar|baixar  # mostra o próximo lote
+"""
+import os, sys, argparse
+from dotenv import load_dotenv
+from loggingConfig import get_logger
+from utils import conectar_postgres
+
+load_dotenv()
+logger = get_logger(__name__)
+
+AGENDADOR_JANELA_RECENTE = int(os.environ.get("AGENDADOR_JANELA_RECENTE", 7))
+AGENDADOR_LOTE = int(os.environ.get("AGENDADOR_LOTE", 50))
+
+# Filtros das etapas que passam pelo agendador
+CONDICAO_SOLICITAR = ("s.solicitado = 0 AND s.tipo = 'NFCE' AND NOT s.finalizado AND NOT s.esgotado "
+                      "AND (s.proxima_tentativa IS NULL OR s.proxima_tentativa <= CURRENT_TIMESTAMP)")
+CONDICAO_BAIXAR = "s.link IS NOT NULL AND s.link != '' AND s.baixado = 0 AND s.tipo = 'NFCE' AND s.anexo = true AND NOT s.finalizado"
+
+def consulta_priorizada(colunas, condicao):
+    """
+    Monta a consulta que devolve, na ordem da política, até %(limite)s solicitações
+    que atendem `condicao` (colunas de nfce.solicitacoes com o alias s).
+    """
+    return f"""
+        SELECT {", ".join(colunas)}
+        FROM (
+            SELECT s.*, c.dia, c.recente, c.prioridade_efetiva,
+                   ROW_NUMBER() OVER (PARTITION BY s.inscricao_estadual, c.recente ORDER BY c.dia DESC, s.id) AS rodada
+            FROM nfce.solicitacoes s
+            LEFT JOIN nfce.empresas e ON e.inscricao_estadual = s.inscricao_estadual
+            CROSS JOIN LATERAL (
+                SELECT to_date(s.data_ini, 'DD/MM/YYYY') AS dia,
+                       to_date(s.data_ini, 'DD/MM/YYYY') >= CURRENT_DATE - %(janela)s AS recente,
+                       COALESCE(s.prioridade, 0) + COALESCE(e.prioridade, 0) AS prioridade_efetiva
+            ) c
+            WHERE {condicao}
+        ) candidatas
+        ORDER BY recente DESC, prioridade_efetiva DESC, rodada, dia DESC, inscricao_estadual
+        LIMIT %(limite)s
+    """
+
+def parametros(limite=None):
+    return {"janela": AGENDADOR_JANELA_RECENTE, "limite": limite or AGENDADOR_LOTE}
+
+def definir_prioridade_empresa(inscricao_estadual, prioridade):
+    """Define a prioridade de uma empresa, somada à de cada solicitação dela"""
+    conexao = conectar_postgres()
+    if not conexao: return False
+    cursor = conexao.cursor()
+    try:
+        cursor.execute("UPDATE nfce.empresas SET prioridade = %s WHERE inscricao_estadual = %s", (prioridade, inscricao_estadual))
+        if cursor.rowcount == 0:
+            logger.error(f"Empresa com inscrição estadual {inscricao_estadual} não encontrada")
+            return False
+        conexao.commit()
+        logger.info(f"Prioridade da empresa {inscricao_estadual} definida para {prioridade}")
+        return True
+    except Exception as erro:
+        conexao.rollback()
+        logger.error(f"Erro ao definir prioridade da empresa: {erro}")
+        return False
+    finally:
+        cursor.close()
+        conexao.close()
+
+def mostrar_proximo_lote(etapa, limite=None):
+    """Lista o próximo lote que a etapa receberia"""
+    condicao = CONDICAO_SOLICITAR if etapa == "solicitar" else CONDICAO_BAIXAR
+    conexao = conectar_postgres()
+    if not conexao: return False
+    cursor = conexao.cursor()
+    try:
+        cursor.execute(consulta_priorizada(["id", "inscricao_estadual", "data_ini", "prioridade_efetiva", "rodada"], condicao), parametros(limite))
+        for id, inscricao_estadual, data_ini, prioridade, rodada in cursor.fetchall():
+            print(f"{id:>10}  {inscricao_estadual:<15} {data_ini}  prioridade={prioridade}  rodada={rodada}")
+        return True
+    except Exception as erro:
+        logger.error(f"Erro ao consultar o próximo lote: {erro}")
+        return False
+    finally:
+        cursor.close()
+        conexao.close()
+
+def main():
+    argumentos = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    argumentos.add_argument("--ie", help="inscrição estadual da empresa a priorizar")
+    argumentos.add_argument("--prioridade", type=int, help="prioridade da empresa (maior vem primeiro; 0 é o padrão)")
+    argumentos.add_argument("--mostrar", choices=("solicitar", "baixar"), help="mostrar o próximo lote da etapa")
+    argumentos.add_argument("--limite", type=int, help=f"tamanho do lote mostrado (padrão {AGENDADOR_LOTE})")
+    opcoes = argumentos.parse_args()
+
+    if opcoes.ie and opcoes.prioridade is not None:
+        if not definir_prioridade_empresa(opcoes.ie, opcoes.prioridade):
+            sys.exit(1)
+    elif opcoes.mostrar:
+        if not mostrar_proximo_lote(opcoes.mostrar, opcoes.limite):
+            sys.exit(1)
+    else:
+        argumentos.print_help()
+
+if __name__ == "__main__":
+    main()
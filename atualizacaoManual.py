@@ -1,5 +1,5 @@
 import os
-from loggingConfig import get_logger
+from loggingConfig import get_logger, log_amostrado, resumir_amostras
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 from utils import conectar_postgres
@@ -114,18 +114,20 @@ def criar_solicitacoes_periodo(data_periodo_inicio, data_periodo_fim, inscricao_
                     id_solicitacao = cursor_pg.fetchone()[0]
                     solicitacoes_criadas += 1
                     ids_criados.append(id_solicitacao)
-                    print(f"Solicitação criada: ID {id_solicitacao} - IE: {inscricao_estadual} - Data: {data_formatada}")
+                    log_amostrado(logger, "solicitacao_criada", "Solicitação criada: ID %s - IE: %s - Data: %s",
+                                  id_solicitacao, inscricao_estadual, data_formatada)
 
-                # Fazer commit a cada 100 solicitações
-                if solicitacoes_criadas % 100 == 0 and solicitacoes_criadas > 0:
-                    conexao_pg.commit()
-                    logger.info(f"Commit intermediário: {solicitacoes_criadas} solicitações criadas até o momento")
+                    # Fazer commit a cada 100 solicitações
+                    if solicitacoes_criadas % 100 == 0:
+                        conexao_pg.commit()
+                        log_amostrado(logger, "commit_intermediario", "Commit intermediário: %s solicitações criadas até o momento", solicitacoes_criadas)
 
             # Avançar para o próximo dia
             dia_atual += timedelta(days=1)
             conexao_pg.commit()  # Commit ao final de cada dia
 
         conexao_pg.commit()
+        resumir_amostras()
         logger.info(f"Processo finalizado: {solicitacoes_criadas} novas solicitações criadas")
 
     except Exception as erro:
@@ -1,16 +1,22 @@
-import time, os, signal, sys
+import time, os, signal, sys, shutil, hashlib, zipfile
+from collections import deque
 from selenium.common.exceptions import TimeoutException
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support import expected_conditions as EC
 from dotenv import load_dotenv
-from loggingConfig import get_logger
+import disjuntor
+import agendador
+import controleFluxo
+import metricas
+import perfilNavegador
+import perfilProcesso
+from loggingConfig import get_logger, log_amostrado, resumir_amostras
 from utils import (
     conectar_postgres,
     iniciar_navegador_selenoid,
     autenticar_sefaz,
     acessar_pagina,
-    verificar_downloads_em_progresso,
     clicar_elemento
 )
 
@@ -22,6 +28,15 @@ DIRETORIO_DOWNLOADS = "/home/desenvolvimento/DownloadATF/NFCE_XML_TEMP/incoming"
 os.makedirs(DIRETORIO_DOWNLOADS, exist_ok=True)
 os.chmod(DIRETORIO_DOWNLOADS, 0o777)
 
+# Cada sessão do navegador baixa em um diretório próprio, o que permite
+# associar o arquivo recebido à solicitação despachada naquela sessão
+DIRETORIO_SESSOES = os.path.join(os.path.dirname(DIRETORIO_DOWNLOADS), "sessoes")
+DOWNLOADS_SIMULTANEOS = int(os.environ.get("DOWNLOADS_SIMULTANEOS", 1))
+TIMEOUT_DOWNLOAD = int(os.environ.get("TIMEOUT_DOWNLOAD", 120))
+# Downloads inválidos do mesmo link antes de devolver a solicitação para re-solicitação
+MAX_FALHAS_DOWNLOAD = int(os.environ.get("MAX_FALHAS_DOWNLOAD", 3))
+RESULTADO_ZIP_INVALIDO = "ZIP_INVALIDO"
+
 # Controle de execução
 RUNNING = True
 
@@ -38,19 +53,23 @@ def configurar_tratamento_sinais():
     signal.signal(signal.SIGTERM, handler_signal)
 
 def obter_solicitacoes_com_link():
-    """Busca solicitações que têm link, anexo=true e ainda não foram baixadas"""
+    """Busca o próximo lote de solicitações com link e anexo=true ainda não baixadas, na ordem do agendador"""
+    # Com o gerenciarArquivos atrasado, não adianta baixar mais ZIPs
+    limite = controleFluxo.limite_lote("baixar", agendador.AGENDADOR_LOTE)
+    if limite == 0:
+        return []
+
     conexao = conectar_postgres()
     if not conexao:
         return []
 
     try:
         cursor = conexao.cursor()
-        cursor.execute("""
-            SELECT id, inscricao_estadual, link
-            FROM nfce.solicitacoes
-            WHERE link IS NOT NULL AND link != '' AND baixado = 0 AND tipo = 'NFCE' AND anexo = true
-            ORDER BY criado_em
-        """)
+        with metricas.cronometrar(metricas.POSTGRES_SEGUNDOS, operacao="obter_solicitacoes_com_link"):
+            cursor.execute(
+                agendador.consulta_priorizada(["id", "inscricao_estadual", "link"], agendador.CONDICAO_BAIXAR),
+                agendador.parametros(limite)
+            )
 
         solicitacoes = []
         for id, inscricao_estadual, link in cursor.fetchall():
@@ -73,8 +92,33 @@ def obter_solicitacoes_com_link():
             conexao.close()
         return []
 
-def marcar_como_baixado(id_solicitacao):
-    """Marca a solicitação como baixada no banco de dados"""
+def buscar_solicitacao_por_hash(hash_arquivo, id_solicitacao):
+    """Retorna (ID, arquivo) de outra solicitação que já recebeu um arquivo com o mesmo hash"""
+    conexao = conectar_postgres()
+    if not conexao:
+        return None
+
+    try:
+        cursor = conexao.cursor()
+        cursor.execute("""
+            SELECT id, arquivo
+            FROM nfce.solicitacoes
+            WHERE hash_arquivo = %s AND id != %s
+            LIMIT 1
+        """, (hash_arquivo, id_solicitacao))
+        resultado = cursor.fetchone()
+        cursor.close()
+        conexao.close()
+        return tuple(resultado) if resultado else None
+
+    except Exception as erro:
+        logger.error(f"Erro ao buscar hash de arquivo: {erro}")
+        if conexao:
+            conexao.close()
+        return None
+
+def marcar_como_baixado(id_solicitacao, arquivo=None, tamanho=None, hash_arquivo=None):
+    """Registra o arquivo recebido e marca a solicitação como baixada no banco de dados"""
     conexao = conectar_postgres()
     if not conexao:
         logger.error(f"Falha ao conectar ao PostgreSQL para marcar solicitação {id_solicitacao}")
@@ -85,15 +129,18 @@ def marcar_como_baixado(id_solicitacao):
         cursor.execute("""
             UPDATE nfce.solicitacoes
             SET baixado = baixado + 1,
+                arquivo = %s,
+                tamanho_arquivo = %s,
+                hash_arquivo = %s,
                 atualizado_em = CURRENT_TIMESTAMP
             WHERE id = %s
-        """, (id_solicitacao,))
+        """, (arquivo, tamanho, hash_arquivo, id_solicitacao))
 
         conexao.commit()
         cursor.close()
         conexao.close()
 
-        logger.info(f"Solicitação {id_solicitacao} marcada como baixada com sucesso")
+        log_amostrado(logger, "download_marcado", "Solicitação %s marcada como baixada com sucesso", id_solicitacao)
         return True
 
     except Exception as erro:
@@ -103,10 +150,81 @@ def marcar_como_baixado(id_solicitacao):
             conexao.close()
         return False
 
+def registrar_falha_download(id_solicitacao, motivo, tamanho=None):
+    """
+    Registra no histórico um download descartado. Na MAX_FALHAS_DOWNLOAD-ésima falha com o
+    mesmo link, a solicitação sai da fila de download (anexo = false, resultado ZIP_INVALIDO)
+    e passa a ser re-solicitada, o que gera um novo arquivo na SEFAZ.
+
+    Retorna:
+        bool: True se a solicitação foi devolvida para re-solicitação.
+    """
+    conexao = conectar_postgres()
+    if not conexao:
+        logger.error(f"Falha ao conectar ao PostgreSQL para registrar falha de download da solicitação {id_solicitacao}")
+        return False
+
+    try:
+        cursor = conexao.cursor()
+        cursor.execute("""
+            UPDATE nfce.solicitacoes
+            SET historico_tentativas = COALESCE(historico_tentativas, '[]'::jsonb)
+                    || jsonb_build_array(jsonb_build_object('horario', %s::text, 'etapa', 'baixar', 'sucesso', false,
+                                                            'motivo', %s, 'link', link, 'tamanho', %s)),
+                atualizado_em = CURRENT_TIMESTAMP
+            WHERE id = %s
+            RETURNING (SELECT COUNT(*) FROM jsonb_array_elements(historico_tentativas) tentativa
+                       WHERE tentativa->>'etapa' = 'baixar' AND tentativa->>'link' = link)
+        """, (time.strftime('%Y-%m-%dT%H:%M:%S'), motivo, tamanho, id_solicitacao))
+        linha = cursor.fetchone()
+        falhas = linha[0] if linha else 0
+
+        devolvida = falhas >= MAX_FALHAS_DOWNLOAD
+        if devolvida:
+            cursor.execute("""
+                UPDATE nfce.solicitacoes
+                SET anexo = false, resultado = %s, proxima_tentativa = CURRENT_TIMESTAMP
+                WHERE id = %s
+            """, (RESULTADO_ZIP_INVALIDO, id_solicitacao))
+
+        conexao.commit()
+        cursor.close()
+        conexao.close()
+
+        if devolvida:
+            logger.warning(f"Solicitação {id_solicitacao}: {falhas} downloads inválidos do mesmo link. Devolvida para re-solicitação")
+        return devolvida
+
+    except Exception as erro:
+        logger.error(f"Erro ao registrar falha de download da solicitação {id_solicitacao}: {erro}")
+        if conexao:
+            conexao.rollback()
+            conexao.close()
+        return False
+
+def calcular_hash_arquivo(caminho_arquivo, tamanho_bloco=1024 * 1024):
+    """Lê o arquivo em blocos e retorna o tamanho em bytes e o SHA-256"""
+    sha256 = hashlib.sha256()
+    tamanho = 0
+    with open(caminho_arquivo, 'rb') as f:
+        for bloco in iter(lambda: f.read(tamanho_bloco), b''):
+            sha256.update(bloco)
+            tamanho += len(bloco)
+    return tamanho, sha256.hexdigest()
+
+def validar_zip(caminho_arquivo):
+    """Verifica se o diretório central do ZIP é legível e contém ao menos um XML"""
+    try:
+        with zipfile.ZipFile(caminho_arquivo, 'r') as zip_ref:
+            return any(item.filename.endswith('.xml') for item in zip_ref.infolist())
+    except (zipfile.BadZipFile, OSError) as e:
+        logger.error(f"ZIP inválido {os.path.basename(caminho_arquivo)}: {str(e)}")
+        return False
+
 def realizar_download(navegador, solicitacao):
     """Acessa o link e inicia o download do arquivo"""
     try:
-        logger.info(f"Iniciando download para IE {solicitacao['inscricao_estadual']} (ID: {solicitacao['id']})")
+        log_amostrado(logger, "download_iniciando", "Iniciando download para IE %s (ID: %s)", solicitacao['inscricao_estadual'], solicitacao['id'])
 
         # Acessa o link para download
         acessar_pagina(navegador, solicitacao["link"])
@@ -115,18 +233,170 @@ def realizar_download(navegador, solicitacao):
         espera_curta = int(os.environ.get("ESPERA_CURTA", 2))
         if clicar_elemento(navegador, os.environ.get("XPATH_IMAGEM_ANEXO"), espera_curta) and \
            clicar_elemento(navegador, os.environ.get("XPATH_LINK_DOWNLOAD"), espera_curta):
-            logger.info(f"Download iniciado para IE {solicitacao['inscricao_estadual']} (ID: {solicitacao['id']})")
-            time.sleep(10)
+            log_amostrado(logger, "download_iniciado", "Download iniciado para IE %s (ID: %s)", solicitacao['inscricao_estadual'], solicitacao['id'])
             return True
         else:
             logger.error(f"Falha ao clicar nos elementos para download - IE {solicitacao['inscricao_estadual']} (ID: {solicitacao['id']})")
             return False
+    except disjuntor.DisjuntorAberto:
+        # Não há tentativa real com o disjuntor aberto: o laço de despacho encerra o ciclo
+        raise
     except Exception as e:
         logger.error(f"Erro ao realizar download para IE {solicitacao['inscricao_estadual']} (ID: {solicitacao['id']}): {str(e)}")
         return False
 
+def preparar_diretorio_sessao(diretorio_sessao):
+    """Cria o diretório da sessão e descarta sobras de execuções anteriores"""
+    os.makedirs(diretorio_sessao, exist_ok=True)
+    os.chmod(diretorio_sessao, 0o777)
+
+    for arquivo in os.listdir(diretorio_sessao):
+        caminho = os.path.join(diretorio_sessao, arquivo)
+        if arquivo.endswith('.zip'):
+            # ZIP completo sem dono conhecido: entrega para o gerenciador como antes
+            destino = mover_para_incoming(caminho)
+            logger.warning(f"Arquivo órfão {arquivo} encontrado na sessão e movido para {destino}")
+        elif os.path.isfile(caminho):
+            os.remove(caminho)
+
+def iniciar_sessao_download(indice):
+    """Inicia e autentica uma sessão do navegador com diretório de download próprio"""
+    diretorio_sessao = os.path.join(DIRETORIO_SESSOES, f"sessao_{indice}")
+    preparar_diretorio_sessao(diretorio_sessao)
+
+    navegador = iniciar_navegador_selenoid(diretorio_sessao)
+    if not navegador:
+        logger.error(f"Falha ao iniciar navegador da sessão {indice}")
+        return None
+
+    if not autenticar_sefaz(navegador):
+        logger.error(f"Falha ao autenticar sessão {indice}")
+        try:
+            navegador.quit()
+        except Exception:
+            pass
+        return None
+
+    logger.info(f"Sessão de download {indice} inicializada e autenticada")
+    return {
+        "indice": indice,
+        "diretorio": diretorio_sessao,
+        "navegador": navegador,
+        "solicitacao": None,
+        "inicio": None
+    }
+
+def fechar_sessao_download(sessao):
+    """Fecha o navegador de uma sessão de download"""
+    if sessao["navegador"]:
+        try:
+            sessao["navegador"].quit()
+        except Exception as e:
+            logger.warning(f"Erro ao fechar navegador da sessão {sessao['indice']}: {str(e)}")
+        sessao["navegador"] = None
+
+def localizar_download_concluido(diretorio_sessao):
+    """Retorna o caminho do ZIP concluído na sessão, ou None se ainda estiver em andamento"""
+    arquivos = os.listdir(diretorio_sessao)
+    if any(arquivo.endswith('.part') or arquivo.endswith('.crdownload') for arquivo in arquivos):
+        return None
+
+    for arquivo in arquivos:
+        if arquivo.endswith('.zip'):
+            return os.path.join(diretorio_sessao, arquivo)
+    return None
+
+def mover_para_incoming(caminho_arquivo, sufixo=None):
+    """Move um download concluído para a pasta incoming sem sobrescrever arquivos existentes"""
+    nome_base, extensao = os.path.splitext(os.path.basename(caminho_arquivo))
+    destino = os.path.join(DIRETORIO_DOWNLOADS, f"{nome_base}{extensao}")
+
+    if os.path.exists(destino):
+        sufixo = sufixo or int(time.time())
+        destino = os.path.join(DIRETORIO_DOWNLOADS, f"{nome_base}_{sufixo}{extensao}")
+
+    # Renomeação atômica quando no mesmo sistema de arquivos
+    shutil.move(caminho_arquivo, destino)
+    return destino
+
+def verificar_sessao(sessao):
+    """Verifica o download em andamento na sessão e o associa à solicitação despachada"""
+    solicitacao = sessao["solicitacao"]
+    caminho_zip = localizar_download_concluido(sessao["diretorio"])
+
+    if caminho_zip:
+        tempo_download = time.time() - sessao["inicio"]
+        sessao["solicitacao"] = None
+        sessao["inicio"] = None
+
+        tamanho, hash_arquivo = calcular_hash_arquivo(caminho_zip)
+        metricas.DOWNLOAD_SEGUNDOS.observar(tempo_download)
+        metricas.DOWNLOAD_BYTES.incrementar(tamanho)
+        if not validar_zip(caminho_zip):
+            # Download truncado ou corrompido: registra a falha; a solicitação continua pendente
+            # até MAX_FALHAS_DOWNLOAD falhas com o mesmo link
+            logger.error(f"Download da solicitação {solicitacao['id']} descartado por falha de integridade ({tamanho} bytes)")
+            os.remove(caminho_zip)
+            registrar_falha_download(solicitacao["id"], RESULTADO_ZIP_INVALIDO, tamanho)
+            return False
+
+        duplicada = buscar_solicitacao_por_hash(hash_arquivo, solicitacao["id"])
+        if duplicada:
+            # Conteúdo idêntico já recebido por outra solicitação: não reprocessa e aponta para o arquivo dela
+            id_duplicada, arquivo = duplicada
+            logger.warning(f"Arquivo da solicitação {solicitacao['id']} idêntico ao da solicitação {id_duplicada} (SHA-256 {hash_arquivo[:12]}). Ignorando cópia")
+            os.remove(caminho_zip)
+        else:
+            destino = mover_para_incoming(caminho_zip, solicitacao["id"])
+            arquivo = os.path.basename(destino)
+            log_amostrado(logger, "download_concluido", "Download da solicitação %s concluído em %.1fs: %s (%s bytes)",
+                          solicitacao['id'], tempo_download, arquivo, tamanho)
+
+        return marcar_como_baixado(solicitacao["id"], arquivo, tamanho, hash_arquivo)
+
+    if time.time() - sessao["inicio"] > TIMEOUT_DOWNLOAD:
+        logger.error(f"Tempo esgotado ({TIMEOUT_DOWNLOAD}s) aguardando download da solicitação {solicitacao['id']} na sessão {sessao['indice']}")
+        # Descarta a sessão para que um download tardio não seja atribuído à próxima solicitação
+        fechar_sessao_download(sessao)
+        preparar_diretorio_sessao(sessao["diretorio"])
+        sessao["solicitacao"] = None
+        sessao["inicio"] = None
+
+    return False
+
+def aguardar_downloads_em_andamento(sessoes):
+    """
+    Aguarda os downloads ainda em andamento (até TIMEOUT_DOWNLOAD desde o início de cada um)
+    antes de fechar as sessões: um ZIP que chegasse depois ficaria sem dono e seria baixado de novo.
+    Retorna quantos foram concluídos.
+    """
+    concluidos = 0
+    pendentes = [sessao for sessao in sessoes if sessao["solicitacao"] is not None and sessao["navegador"]]
+    if pendentes:
+        logger.info(f"Aguardando {len(pendentes)} downloads em andamento antes de fechar as sessões")
+
+    while pendentes:
+        for sessao in pendentes:
+            try:
+                if verificar_sessao(sessao):
+                    concluidos += 1
+            except Exception as e:
+                logger.error(f"Erro ao aguardar download da sessão {sessao['indice']}: {str(e)}")
+                sessao["solicitacao"] = None
+        pendentes = [sessao for sessao in pendentes if sessao["solicitacao"] is not None]
+        if pendentes:
+            time.sleep(1)
+    return concluidos
+
 def processar_downloads():
-    """Processa todos os downloads pendentes"""
+    """
+    Processa todos os downloads pendentes.
+
+    Abre DOWNLOADS_SIMULTANEOS sessões do navegador, cada uma com diretório de
+    download próprio e no máximo um download em andamento. As solicitações são
+    distribuídas entre as sessões livres e só são marcadas como baixadas quando
+    o arquivo correspondente aparece no diretório da sessão.
+    """
     # Verificar permissões do diretório
     try:
         test_file_path = os.path.join(DIRETORIO_DOWNLOADS, "test_write_permission.tmp")
@@ -143,55 +413,79 @@ def processar_downloads():
     if not solicitacoes:
         return 0
 
-    navegador = None
+    fila = deque(solicitacoes)
+    sessoes = []
     downloads_realizados = 0
+    despachadas = 0
     total_solicitacoes = len(solicitacoes)
+    quantidade_sessoes = max(1, min(DOWNLOADS_SIMULTANEOS, total_solicitacoes))
 
     try:
-        # Inicia o navegador com Selenoid
-        logger.info(f"Iniciando navegador para processar {total_solicitacoes} downloads...")
-        navegador = iniciar_navegador_selenoid(DIRETORIO_DOWNLOADS)
+        # Inicia as sessões do navegador com Selenoid
+        logger.info(f"Iniciando {quantidade_sessoes} sessões do navegador para processar {total_solicitacoes} downloads...")
+        for indice in range(quantidade_sessoes):
+            sessao = iniciar_sessao_download(indice)
+            if sessao:
+                sessoes.append(sessao)
+
+        if not sessoes:
+            logger.error("Falha na autenticação ou inicialização do navegador")
+            return 0
 
-        if navegador and autenticar_sefaz(navegador):
-            logger.info("Navegador inicializado e autenticado com sucesso")
+        disjuntor_aberto = False
+        while RUNNING and not disjuntor_aberto and sessoes and (fila or any(sessao["solicitacao"] for sessao in sessoes)):
+            for sessao in sessoes[:]:
+                if sessao["solicitacao"] is not None:
+                    if verificar_sessao(sessao):
+                        downloads_realizados += 1
 
-            # Processa cada solicitação com link disponível
-            for i, solicitacao in enumerate(solicitacoes, 1):
-                # Log de progresso menos frequente
-                if i == 1 or i == total_solicitacoes or i % 10 == 0:
-                    logger.info(f"Processando solicitação {i}/{total_solicitacoes}")
+                if sessao["solicitacao"] is not None or not fila:
+                    continue
 
-                if realizar_download(navegador, solicitacao):
-                    if marcar_como_baixado(solicitacao["id"]):
-                        downloads_realizados += 1
-                    else:
-                        logger.warning(f"Download realizado mas falha ao marcar como baixado: ID {solicitacao['id']}")
+                # Sessão descartada por timeout: reabre antes de despachar
+                if sessao["navegador"] is None:
+                    nova_sessao = iniciar_sessao_download(sessao["indice"])
+                    if not nova_sessao:
+                        sessoes.remove(sessao)
+                        continue
+                    sessao.update(nova_sessao)
 
-                # Espera entre os downloads
-                time.sleep(5)
+                solicitacao = fila.popleft()
+                despachadas += 1
 
-            logger.info(f"Downloads concluídos: {downloads_realizados}/{total_solicitacoes}")
-        else:
-            logger.error("Falha na autenticação ou inicialização do navegador")
+                # Log de progresso menos frequente
+                if despachadas == 1 or despachadas == total_solicitacoes or despachadas % 10 == 0:
+                    logger.info(f"Processando solicitação {despachadas}/{total_solicitacoes}")
+
+                try:
+                    iniciado = realizar_download(sessao["navegador"], solicitacao)
+                except disjuntor.DisjuntorAberto as e:
+                    # Devolve a solicitação e deixa o restante da fila para o próximo ciclo
+                    logger.warning(f"Despacho de downloads interrompido: {str(e)}")
+                    fila.appendleft(solicitacao)
+                    despachadas -= 1
+                    disjuntor_aberto = True
+                    break
+                if iniciado:
+                    sessao["solicitacao"] = solicitacao
+                    sessao["inicio"] = time.time()
+
+            time.sleep(1)
+
+        if fila:
+            logger.warning(f"{len(fila)} solicitações não foram despachadas neste ciclo")
+        resumir_amostras("download_")
+        logger.info(f"Downloads concluídos: {downloads_realizados}/{total_solicitacoes}")
 
     except Exception as e:
         logger.error(f"Erro durante a execução dos downloads: {str(e)}")
     finally:
-        # Aguarda downloads em andamento concluírem
-        max_tentativas = int(os.environ.get("MAX_TENTATIVAS", 10))
-        tentativa = 0
-
-        while verificar_downloads_em_progresso(DIRETORIO_DOWNLOADS) and tentativa < max_tentativas:
-            logger.debug(f"Aguardando conclusão de downloads em progresso... (tentativa {tentativa+1}/{max_tentativas})")
-            time.sleep(2)
-            tentativa += 1
-
-        if navegador:
-            try:
-                navegador.quit()
-                logger.info("Navegador fechado com sucesso")
-            except Exception as e:
-                logger.warning(f"Erro ao fechar navegador: {str(e)}")
+        downloads_realizados += aguardar_downloads_em_andamento(sessoes)
+        for sessao in sessoes:
+            fechar_sessao_download(sessao)
+        if sessoes:
+            logger.info("Navegadores fechados com sucesso")
+        perfilNavegador.relatorio_ciclo("baixar")
 
         try:
             arquivos = os.listdir(DIRETORIO_DOWNLOADS)
@@ -211,12 +505,15 @@ def monitorar_downloads_continuamente():
     logger.info(f"=" * 50)
 
     configurar_tratamento_sinais()
+    metricas.iniciar_servidor_metricas("baixarArquivos")
+    perfilProcesso.instalar("baixarArquivos")
 
     intervalo_verificacao = int(os.environ.get("INTERVALO_VERIFICACAO", 60))
     ultimo_log_sem_downloads = 0
     intervalo_min_log_sem_downloads = 300  # 5 minutos
 
     while RUNNING:
+        perfilProcesso.marcar_ciclo()
         try:
             # Verifica se há solicitações com links para baixar
             solicitacoes = obter_solicitacoes_com_link()
@@ -232,6 +529,10 @@ def monitorar_downloads_continuamente():
                 time.sleep(intervalo_verificacao)
                 continue
 
+            # SEFAZ fora do ar: aguarda o disjuntor fechar antes de abrir as sessões
+            if not disjuntor.aguardar_liberacao():
+                continue
+
             # Se há solicitações, processa os downloads
             downloads_realizados = processar_downloads()
 
@@ -0,0 +1,589 @@
+"""
+Benchmark da carga de banco das etapas sobre um PostgreSQL local com N solicitações.
+
+Cria (se preciso) o banco --banco com a estrutura do startList e o povoa com
+--linhas solicitações de --empresas empresas, uma por empresa e dia, do dia mais
+recente para trás. O estado de cada solicitação segue a distribuição ESTADOS:
+os últimos DIAS_RECENTES dias concentram o trabalho em andamento e o histórico
+é quase todo finalizado. O povoamento é guardado no comentário da tabela e só é
+refeito com --recriar ou se os parâmetros mudarem.
+
+Para cada variante de índices e armazenamento (VARIANTES), executa as funções de
+banco das próprias etapas sobre uma conexão única, sem commit (cada execução é
+desfeita ao final, então a tabela é a mesma entre repetições e variantes):
+
+    solicitar     obter_solicitacoes_pendentes, atualizar_solicitacao
+    resolicitar   obter_solicitacoes_para_resolicitacao (marca esgotadas + consulta), atualizar_resolicitacao
+    localizar     obter_solicitacoes_solicitadas, registrar_resultados_caixa
+    baixar        obter_solicitacoes_com_link, buscar_solicitacao_por_hash, marcar_como_baixado
+    gerenciar     enviar_resultados_banco
+    fluxo         medir_filas
+    reconciliar   listar_solicitacoes_existentes
+
+As atualizações rodam sobre uma amostra de --lote solicitações no estado
+correspondente. Informa mediana e máximo do tempo de cada operação, o tempo
+gasto dentro do banco e, de cada comando distinto, o EXPLAIN (ANALYZE, BUFFERS)
+com os parâmetros da primeira execução (blocos lidos e índices usados na tabela,
+o texto completo em --planos). O tempo não inclui o commit nem a conexão.
+
+Recusa rodar no banco de produção (analytics). Conexão pelas mesmas variáveis
+POSTGRES_* dos serviços.
+
+Uso:
+    python benchmarkBanco.py [--banco nfce_benchmark] [--linhas 1000000] [--empresas 2000]
+                             [--variantes atual,sem_status,parciais_etapas,fillfactor]
+                             [--repeticoes 5] [--lote 50] [--planos DIR] [--recriar]
+"""
+import os, sys, json, time, hashlib, argparse, tempfile, statistics
+from datetime import date, datetime, timedelta
+
+BANCO_PRODUCAO = "analytics"
+DIAS_RECENTES = 30
+LINHAS_POR_LOTE = 500000
+
+# (estado, proporção nos últimos DIAS_RECENTES dias, proporção no histórico); o restante é "finalizado"
+ESTADOS = [
+    ("pendente", 0.10, 0.002),
+    ("aguardando_link", 0.08, 0.002),
+    ("aguardando_download", 0.05, 0.001),
+    ("baixado", 0.03, 0.001),
+    ("falha", 0.03, 0.004),
+    ("muito_grande", 0.005, 0.002),
+    ("esgotado", 0.005, 0.01),
+    ("sem_dados", 0.15, 0.15),
+]
+
+# Variantes comparadas com a estrutura do startList; "desfazer" volta à estrutura original
+VARIANTES = {
+    "atual": {
+        "descricao": "índices do startList",
+        "aplicar": [], "desfazer": [],
+    },
+    "sem_status": {
+        "descricao": "sem idx_solicitacoes_status (solicitado, baixado)",
+        "aplicar": ["DROP INDEX IF EXISTS nfce.idx_solicitacoes_status"],
+        "desfazer": ["CREATE INDEX IF NOT EXISTS idx_solicitacoes_status ON nfce.solicitacoes(solicitado, baixado)"],
+    },
+    "parciais_etapas": {
+        "descricao": "índices parciais com o filtro de cada etapa",
+        "aplicar": [
+            "CREATE INDEX IF NOT EXISTS idx_bench_solicitar ON nfce.solicitacoes(inscricao_estadual) WHERE solicitado = 0 AND tipo = 'NFCE'",
+            "CREATE INDEX IF NOT EXISTS idx_bench_aguardando_link ON nfce.solicitacoes(criado_em) "
+            "WHERE solicitado > 0 AND (link IS NULL OR link = '') AND baixado = 0 AND tipo = 'NFCE' AND NOT finalizado",
+            "CREATE INDEX IF NOT EXISTS idx_bench_baixar ON nfce.solicitacoes(inscricao_estadual) "
+            "WHERE link IS NOT NULL AND link != '' AND baixado = 0 AND tipo = 'NFCE' AND anexo = true AND NOT finalizado",
+            "CREATE INDEX IF NOT EXISTS idx_bench_arquivo ON nfce.solicitacoes(arquivo) WHERE NOT finalizado",
+        ],
+        "desfazer": [f"DROP INDEX IF EXISTS nfce.idx_bench_{nome}" for nome in ("solicitar", "aguardando_link", "baixar", "arquivo")],
+    },
+    "fillfactor": {
+        "descricao": "fillfactor 80 (espaço para atualizações HOT)",
+        "aplicar": ["ALTER TABLE nfce.solicitacoes SET (fillfactor = 80)", "VACUUM FULL nfce.solicitacoes"],
+        "desfazer": ["ALTER TABLE nfce.solicitacoes RESET (fillfactor)", "VACUUM FULL nfce.solicitacoes"],
+    },
+}
+
+# Amostras usadas pelas operações de atualização
+AMOSTRAS = {
+    "pendente": "solicitado = 0",
+    "aguardando_link": "solicitado > 0 AND link IS NULL AND NOT finalizado",
+    "aguardando_download": "anexo AND baixado = 0 AND NOT finalizado",
+    "baixado": "baixado > 0 AND NOT finalizado",
+    "falha": "anexo = false AND resultado IN ('ERRO_PROCESSAMENTO', 'DESCONHECIDO') AND NOT finalizado AND NOT esgotado",
+}
+
+def montar_ambiente(base):
+    """Variáveis lidas na importação das etapas; precisam existir antes delas"""
+    os.environ.update({
+        "DIRETORIO_EXECUCAO": base,
+        "DIRETORIO_DOWNLOADS": os.path.join(base, "incoming"),
+        "DISJUNTOR_BACKEND": "arquivo",
+        "DISJUNTOR_ARQUIVO": os.path.join(base, "disjuntor.json"),
+        "RASTREAMENTO_ARQUIVO": os.path.join(base, "spans.jsonl"),
+        "LOG_LEVEL": os.environ.get("LOG_LEVEL", "ERROR"),
+    })
+
+# ============================================
+# CONEXÃO REGISTRADA
+# ============================================
+
+class CursorBenchmark:
+    """Cursor que registra cada comando, seus parâmetros e o tempo gasto no banco"""
+    def __init__(self, conexao, cursor):
+        self.conexao, self.cursor = conexao, cursor
+
+    def registrar(self, metodo, consulta, argumento, parametros):
+        inicio = time.perf_counter()
+        try:
+            return metodo(consulta, argumento)
+        except Exception as erro:
+            self.conexao.erros.append(str(erro).strip())
+            raise
+        finally:
+            self.conexao.tempo_banco += time.perf_counter() - inicio
+            self.conexao.comandos.append((consulta, parametros[0] if parametros else None, len(parametros)))
+
+    def execute(self, consulta, parametros=None):
+        return self.registrar(self.cursor.execute, consulta, parametros, [parametros])
+
+    def executemany(self, consulta, lista):
+        lista = list(lista)
+        return self.registrar(self.cursor.executemany, consulta, lista, lista)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *erro):
+        self.cursor.close()
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def __getattr__(self, nome):
+        return getattr(self.cursor, nome)
+
+class ConexaoBenchmark:
+    """Conexão entregue às etapas: commit e close não têm efeito; desfazer() encerra cada execução"""
+    def __init__(self, conexao):
+        self.conexao = conexao
+        self.reiniciar()
+
+    def reiniciar(self):
+        self.comandos, self.erros, self.tempo_banco = [], [], 0.0
+
+    def cursor(self, *args, **kwargs):
+        return CursorBenchmark(self, self.conexao.cursor(*args, **kwargs))
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+    def rollback(self):
+        self.conexao.rollback()
+
+    def desfazer(self):
+        self.conexao.rollback()
+
+    def __getattr__(self, nome):
+        return getattr(self.conexao, nome)
+
+# ============================================
+# POVOAMENTO
+# ============================================
+
+def expressao_estado():
+    """CASE que sorteia o estado de cada linha pela distribuição ESTADOS (recente ou histórico)"""
+    ramos = []
+    for indice in (1, 2):
+        acumulado, casos = 0.0, []
+        for estado in ESTADOS:
+            acumulado += estado[indice]
+            casos.append(f"WHEN b.r < {acumulado:.6f} THEN '{estado[0]}'")
+        ramos.append(f"CASE {' '.join(casos)} ELSE 'finalizado' END")
+    return f"CASE WHEN b.dia >= %(hoje)s::date - {DIAS_RECENTES} THEN {ramos[0]} ELSE {ramos[1]} END"
+
+# Uma solicitação por empresa e dia: a linha g é da empresa g % empresas, g / empresas dias antes de ontem
+INSERIR_SOLICITACOES = """
+    INSERT INTO nfce.solicitacoes (inscricao_estadual, tipo, data_ini, data_fim, horario, link, solicitado, baixado,
+        finalizado, anexo, criado_em, atualizado_em, mensagens, arquivo, tamanho_arquivo, hash_arquivo, qtd_notas,
+        bytes_notas, caminho_final, resultado, proxima_tentativa, historico_tentativas, esgotado, tentativas)
+    SELECT l.ie, 'NFCE', to_char(l.dia, 'DD/MM/YYYY'), to_char(l.dia, 'DD/MM/YYYY'), h.horario,
+        CASE WHEN l.estado IN ('pendente', 'aguardando_link') THEN NULL
+             ELSE 'https://www4.sefaz.pb.gov.br/atf/seg/SEGf_MinhasMensagens.do?idMensagem=' || l.g END,
+        CASE l.estado WHEN 'pendente' THEN 0 WHEN 'esgotado' THEN 5 ELSE 1 + (l.r2 < 0.1)::int END,
+        CASE WHEN l.estado IN ('baixado', 'finalizado') THEN 1 ELSE 0 END,
+        l.estado IN ('finalizado', 'sem_dados'),
+        CASE WHEN l.estado IN ('aguardando_download', 'baixado', 'finalizado') THEN true
+             WHEN l.estado IN ('falha', 'muito_grande', 'sem_dados', 'esgotado') THEN false END,
+        l.criado_em, h.horario,
+        CASE WHEN l.estado NOT IN ('pendente', 'aguardando_link') THEN 1 END,
+        CASE WHEN l.estado IN ('baixado', 'finalizado') THEN 'NFCE_XML_' || l.ie || '_' || l.g || '.zip' END,
+        CASE WHEN l.estado IN ('baixado', 'finalizado') THEN 1000 + (l.r2 * 5000000)::bigint END,
+        CASE WHEN l.estado IN ('baixado', 'finalizado') THEN md5(l.g::text) || md5(l.ie || l.g) END,
+        CASE l.estado WHEN 'finalizado' THEN (l.r2 * 2000)::int WHEN 'sem_dados' THEN 0 END,
+        CASE l.estado WHEN 'finalizado' THEN (l.r2 * 2000)::bigint * 4500 WHEN 'sem_dados' THEN 0 END,
+        CASE WHEN l.estado = 'finalizado' THEN '/mnt/nfce/EMPRESA_SINTETICA_' || l.ie END,
+        CASE l.estado WHEN 'pendente' THEN NULL WHEN 'aguardando_link' THEN NULL
+             WHEN 'sem_dados' THEN 'SEM_DADOS' WHEN 'muito_grande' THEN 'MUITO_GRANDE' WHEN 'esgotado' THEN 'ERRO_PROCESSAMENTO'
+             WHEN 'falha' THEN CASE WHEN l.r2 < 0.7 THEN 'ERRO_PROCESSAMENTO' ELSE 'DESCONHECIDO' END
+             ELSE 'SUCESSO' END,
+        CASE WHEN l.estado = 'pendente' THEN NULL
+             WHEN l.estado = 'falha' THEN h.horario + INTERVAL '1 hour' ELSE h.horario + INTERVAL '1 day' END,
+        CASE WHEN h.horario IS NULL THEN '[]'::jsonb
+             ELSE jsonb_build_array(jsonb_build_object('horario', to_char(h.horario, 'YYYY-MM-DD"T"HH24:MI:SS'), 'sucesso', true)) END,
+        l.estado = 'esgotado',
+        CASE l.estado WHEN 'pendente' THEN 0 WHEN 'esgotado' THEN 6 ELSE 1 + (l.r2 < 0.1)::int END
+    FROM (
+        SELECT b.g, b.ie, b.dia, b.r2, e.estado, LEAST(b.dia + 5 + b.r2 * INTERVAL '6 hours', %(agora)s) AS criado_em
+        FROM (
+            SELECT g, '16' || lpad((g %% %(empresas)s)::text, 7, '0') AS ie, %(hoje)s::date - 1 - (g / %(empresas)s)::int AS dia,
+                   random() AS r, random() AS r2
+            FROM generate_series(%(inicio)s, %(fim)s) g
+        ) b
+        CROSS JOIN LATERAL (SELECT {estado} AS estado) e
+    ) l
+    CROSS JOIN LATERAL (
+        SELECT CASE WHEN l.estado = 'pendente' THEN NULL ELSE LEAST(l.criado_em + l.r2 * INTERVAL '2 hours', %(agora)s) END AS horario
+    ) h
+"""
+
+def conectar(parametros, banco, autocommit=False):
+    import psycopg2
+    conexao = psycopg2.connect(**dict(parametros, dbname=banco))
+    conexao.autocommit = autocommit
+    return conexao
+
+def criar_banco(parametros, banco):
+    from psycopg2 import sql
+    conexao = conectar(parametros, "postgres", autocommit=True)
+    try:
+        with conexao.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM pg_database WHERE datname = %s", (banco,))
+            if not cursor.fetchone():
+                cursor.execute(sql.SQL("CREATE DATABASE {}").format(sql.Identifier(banco)))
+                print(f"Banco {banco} criado")
+    finally:
+        conexao.close()
+
+def povoar(parametros, banco, opcoes):
+    """Cria a estrutura do startList e insere empresas e solicitações, a menos que já estejam lá"""
+    import startList
+    assinatura = json.dumps({"linhas": opcoes.linhas, "empresas": opcoes.empresas, "semente": opcoes.semente,
+                             "estados": ESTADOS, "dias_recentes": DIAS_RECENTES})
+    conexao = conectar(parametros, banco)
+    cursor = conexao.cursor()
+    cursor.execute("SELECT obj_description(to_regclass('nfce.solicitacoes'), 'pg_class')")
+    comentario = cursor.fetchone()[0]
+    if comentario and not opcoes.recriar:
+        povoamento = json.loads(comentario)
+        if povoamento.get("assinatura") == assinatura:
+            print(f"Reutilizando {opcoes.linhas} solicitações povoadas em {povoamento['povoado_em']} (--recriar para refazer)")
+            conexao.close()
+            return
+
+    cursor.execute("DROP SCHEMA IF EXISTS nfce CASCADE")
+    conexao.commit()
+    startList.conectar_postgres = lambda: conectar(parametros, banco)
+    if not startList.criar_estrutura_banco():
+        sys.exit("Falha ao criar a estrutura do banco (ver log do startList)")
+
+    # Índices e chave estrangeira são recriados depois da carga, que fica bem mais rápida sem eles
+    cursor.execute("SELECT indexname, indexdef FROM pg_indexes WHERE schemaname = 'nfce' AND tablename = 'solicitacoes' AND indexname != 'solicitacoes_pkey'")
+    indices = cursor.fetchall()
+    cursor.execute("SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint WHERE conrelid = 'nfce.solicitacoes'::regclass AND contype = 'f'")
+    restricoes = cursor.fetchall()
+    for nome, _ in indices:
+        cursor.execute(f"DROP INDEX nfce.{nome}")
+    for nome, _ in restricoes:
+        cursor.execute(f"ALTER TABLE nfce.solicitacoes DROP CONSTRAINT {nome}")
+
+    hoje, agora = date.today(), datetime.now().replace(microsecond=0)
+    cursor.execute("SELECT setseed(%s)", (opcoes.semente,))
+    cursor.execute("""
+        INSERT INTO nfce.empresas (inscricao_estadual, apelido, prioridade)
+        SELECT '16' || lpad(n::text, 7, '0'), 'EMPRESA_SINTETICA_16' || lpad(n::text, 7, '0'), CASE WHEN random() < 0.01 THEN 10 ELSE 0 END
+        FROM generate_series(0, %s - 1) n
+    """, (opcoes.empresas,))
+    conexao.commit()
+
+    consulta = INSERIR_SOLICITACOES.format(estado=expressao_estado())
+    inicio_carga = time.perf_counter()
+    for inicio in range(0, opcoes.linhas, LINHAS_POR_LOTE):
+        fim = min(inicio + LINHAS_POR_LOTE, opcoes.linhas) - 1
+        cursor.execute(consulta, {"inicio": inicio, "fim": fim, "empresas": opcoes.empresas, "hoje": hoje, "agora": agora})
+        conexao.commit()
+        print(f"  {fim + 1}/{opcoes.linhas} solicitações inseridas ({time.perf_counter() - inicio_carga:.0f}s)")
+
+    for _, definicao in indices:
+        cursor.execute(definicao)
+    for nome, definicao in restricoes:
+        cursor.execute(f"ALTER TABLE nfce.solicitacoes ADD CONSTRAINT {nome} {definicao}")
+    cursor.execute("COMMENT ON TABLE nfce.solicitacoes IS %s",
+                   (json.dumps({"assinatura": assinatura, "povoado_em": agora.isoformat()}),))
+    conexao.commit()
+    conexao.close()
+
+    conexao = conectar(parametros, banco, autocommit=True)
+    conexao.cursor().execute("VACUUM ANALYZE nfce.solicitacoes")
+    conexao.cursor().execute("VACUUM ANALYZE nfce.empresas")
+    conexao.close()
+    print(f"Povoamento concluído em {time.perf_counter() - inicio_carga:.0f}s")
+
+def distribuicao_estados(conexao):
+    with conexao.cursor() as cursor:
+        cursor.execute("""
+            SELECT COUNT(*), COUNT(*) FILTER (WHERE solicitado = 0),
+                   COUNT(*) FILTER (WHERE solicitado > 0 AND link IS NULL AND NOT finalizado),
+                   COUNT(*) FILTER (WHERE anexo AND baixado = 0 AND NOT finalizado),
+                   COUNT(*) FILTER (WHERE baixado > 0 AND NOT finalizado),
+                   COUNT(*) FILTER (WHERE anexo = false AND NOT finalizado AND NOT esgotado),
+                   COUNT(*) FILTER (WHERE esgotado), COUNT(*) FILTER (WHERE finalizado)
+            FROM nfce.solicitacoes
+        """)
+        linha = cursor.fetchone()
+    conexao.rollback()
+    nomes = ("total", "pendentes", "aguardando link", "aguardando download", "baixadas", "sem anexo", "esgotadas", "finalizadas")
+    return dict(zip(nomes, linha))
+
+def escolher_amostras(conexao, lote):
+    """Amostra determinística de cada estado, a mesma em todas as variantes"""
+    amostras = {}
+    with conexao.cursor() as cursor:
+        for estado, condicao in AMOSTRAS.items():
+            cursor.execute(f"""
+                SELECT id, inscricao_estadual, data_ini, arquivo FROM nfce.solicitacoes
+                WHERE {condicao} ORDER BY md5(id::text) LIMIT %s
+            """, (lote,))
+            amostras[estado] = [dict(zip(("id", "inscricao_estadual", "data_ini", "arquivo"), linha)) for linha in cursor.fetchall()]
+    conexao.rollback()
+    return amostras
+
+# ============================================
+# OPERAÇÕES
+# ============================================
+
+def montar_operacoes(amostras):
+    """Lista de (etapa, operação, executar, preparar) com as funções de banco das etapas"""
+    import solicitarXmls, solicitarXmlsFalhos, localizarLinks, baixarArquivos, gerenciarArquivos, controleFluxo, reconciliarLacunas
+    hoje = date.today()
+
+    def resultados_caixa():
+        resultados = []
+        for posicao, item in enumerate(amostras["aguardando_link"]):
+            resultado = ("SUCESSO", "SUCESSO", "SUCESSO", "SEM_DADOS", "ERRO_PROCESSAMENTO")[posicao % 5]
+            resultados.append({"id": item["id"], "link": f"https://www4.sefaz.pb.gov.br/atf/?idMensagem={item['id']}",
+                               "anexo": resultado == "SUCESSO", "mensagens": 1, "resultado": resultado})
+        return localizarLinks.registrar_resultados_caixa(resultados)
+
+    def preparar_journal():
+        journal = gerenciarArquivos.abrir_journal()
+        journal.execute("DELETE FROM resultados")
+        journal.executemany(
+            "INSERT INTO resultados (job_id, arquivo_original, caminho_final, notas_por_dia, enviado, criado_em) VALUES (?, ?, ?, ?, 0, ?)",
+            [(f"job_{item['id']}", item["arquivo"], f"/mnt/nfce/EMPRESA_SINTETICA_{item['inscricao_estadual']}",
+              json.dumps({f"{item['inscricao_estadual']}|{item['data_ini']}": [120, 540000]}), datetime.now().isoformat())
+             for item in amostras["baixado"]])
+        journal.commit()
+
+    def limpar_cache_filas():
+        controleFluxo.filas_cache = None
+
+    def sha256(item):
+        return hashlib.sha256(f"benchmark-{item['id']}".encode()).hexdigest()
+
+    return [
+        ("solicitar", "obter_solicitacoes_pendentes", lambda: solicitarXmls.obter_solicitacoes_pendentes(retry_count=1), None),
+        ("solicitar", "atualizar_solicitacao",
+         lambda: [solicitarXmls.atualizar_solicitacao(item["id"], retry_count=1) for item in amostras["pendente"]], None),
+        ("resolicitar", "obter_solicitacoes_para_resolicitacao",
+         lambda: solicitarXmlsFalhos.obter_solicitacoes_para_resolicitacao(retry_count=1), None),
+        ("resolicitar", "atualizar_resolicitacao",
+         lambda: [solicitarXmlsFalhos.atualizar_resolicitacao(item["id"], retry_count=1, tentativas=2) for item in amostras["falha"]], None),
+        ("localizar", "obter_solicitacoes_solicitadas", localizarLinks.obter_solicitacoes_solicitadas, None),
+        ("localizar", "registrar_resultados_caixa", resultados_caixa, None),
+        ("baixar", "obter_solicitacoes_com_link", baixarArquivos.obter_solicitacoes_com_link, None),
+        # Hash novo: o caso comum, em que nenhuma outra solicitação recebeu o mesmo arquivo
+        ("baixar", "buscar_solicitacao_por_hash",
+         lambda: [baixarArquivos.buscar_solicitacao_por_hash(sha256(item), item["id"]) for item in amostras["aguardando_download"]], None),
+        ("baixar", "marcar_como_baixado",
+         lambda: [baixarArquivos.marcar_como_baixado(item["id"], f"NFCE_XML_{item['inscricao_estadual']}_{item['id']}.zip", 250000, sha256(item))
+                  for item in amostras["aguardando_download"]], None),
+        ("gerenciar", "enviar_resultados_banco", gerenciarArquivos.enviar_resultados_banco, preparar_journal),
+        ("fluxo", "medir_filas", controleFluxo.medir_filas, limpar_cache_filas),
+        ("reconciliar", "listar_solicitacoes_existentes",
+         lambda: reconciliarLacunas.listar_solicitacoes_existentes(
+             sorted({item["inscricao_estadual"] for itens in amostras.values() for item in itens}), hoje - timedelta(days=DIAS_RECENTES), hoje), None),
+    ]
+
+def resumir_plano(plano):
+    raiz = plano[0]
+    nos, pilha = [], [raiz["Plan"]]
+    while pilha:
+        no = pilha.pop()
+        nos.append(no)
+        pilha.extend(no.get("Plans", []))
+    acessos = []
+    for no in nos:
+        alvo = no.get("Index Name") or no.get("Relation Name")
+        if alvo and f"{no['Node Type']} {alvo}" not in acessos:
+            acessos.append(f"{no['Node Type']} {alvo}")
+    return {"execucao_ms": raiz["Execution Time"], "planejamento_ms": raiz["Planning Time"],
+            "blocos_cache": raiz["Plan"].get("Shared Hit Blocks", 0), "blocos_lidos": raiz["Plan"].get("Shared Read Blocks", 0),
+            "acessos": acessos}
+
+def explicar(conexao, consulta, parametros):
+    """EXPLAIN (ANALYZE, BUFFERS) em JSON e em texto; o comando é executado e desfeito"""
+    try:
+        with conexao.cursor() as cursor:
+            cursor.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + consulta, parametros)
+            plano = cursor.fetchone()[0]
+            conexao.rollback()
+            cursor.execute("EXPLAIN (ANALYZE, BUFFERS) " + consulta, parametros)
+            texto = "\n".join(linha[0] for linha in cursor.fetchall())
+        return resumir_plano(plano if isinstance(plano, list) else json.loads(plano)), texto
+    finally:
+        conexao.rollback()
+
+def medir_operacao(conexao, executar, preparar, repeticoes):
+    """Executa a operação repeticoes + 1 vezes (a primeira só aquece o cache) e desfaz cada execução"""
+    tempos, tempos_banco, linhas = [], [], 0
+    for repeticao in range(repeticoes + 1):
+        if preparar:
+            preparar()
+        conexao.reiniciar()
+        inicio = time.perf_counter()
+        retorno = executar()
+        duracao = time.perf_counter() - inicio
+        conexao.desfazer()
+        if conexao.erros:
+            break
+        if repeticao:
+            tempos.append(duracao * 1000)
+            tempos_banco.append(conexao.tempo_banco * 1000)
+        linhas = retorno if isinstance(retorno, int) and not isinstance(retorno, bool) else \
+                 sum(1 for item in retorno if item is not False) if isinstance(retorno, (list, dict)) else int(bool(retorno))
+    return tempos, tempos_banco, linhas
+
+def executar_variante(nome, conexao, operacoes, opcoes):
+    diretorio = os.path.join(opcoes.planos, nome)
+    os.makedirs(diretorio, exist_ok=True)
+    resultados = []
+    for etapa, operacao, executar, preparar in operacoes:
+        tempos, tempos_banco, linhas = medir_operacao(conexao, executar, preparar, opcoes.repeticoes)
+        resultado = {"etapa": etapa, "operacao": operacao, "linhas": linhas, "erros": list(conexao.erros),
+                     "mediana_ms": statistics.median(tempos) if tempos else None, "maximo_ms": max(tempos) if tempos else None,
+                     "banco_ms": statistics.median(tempos_banco) if tempos_banco else None, "comandos": []}
+        distintos = {}
+        for consulta, parametros, execucoes in conexao.comandos:
+            distintos.setdefault(consulta, [parametros, 0])[1] += execucoes
+        for indice, (consulta, (parametros, execucoes)) in enumerate(distintos.items(), 1):
+            if resultado["erros"]:
+                break
+            resumo, texto = explicar(conexao.conexao, consulta, parametros)
+            resultado["comandos"].append(dict(resumo, execucoes=execucoes))
+            with open(os.path.join(diretorio, f"{etapa}.{operacao}.{indice}.txt"), "w", encoding="utf-8") as arquivo:
+                arquivo.write(f"-- {execucoes} execuções por operação; parâmetros da primeira: {parametros!r}\n")
+                arquivo.write(consulta.strip() + "\n\n" + texto + "\n")
+        resultados.append(resultado)
+    return resultados
+
+def tamanho_tabela(conexao):
+    with conexao.cursor() as cursor:
+        cursor.execute("SELECT pg_table_size('nfce.solicitacoes'), pg_indexes_size('nfce.solicitacoes')")
+        tabela, indices = cursor.fetchone()
+    conexao.rollback()
+    return tabela, indices
+
+def alterar_estrutura(parametros, banco, comandos):
+    if not comandos:
+        return
+    conexao = conectar(parametros, banco, autocommit=True)
+    try:
+        with conexao.cursor() as cursor:
+            for comando in comandos:
+                cursor.execute(comando)
+            cursor.execute("ANALYZE nfce.solicitacoes")
+    finally:
+        conexao.close()
+
+def imprimir_variante(nome, resultados, tamanhos):
+    print(f"\n== {nome}: {VARIANTES[nome]['descricao']} (tabela {tamanhos[0] / 2 ** 20:.0f} MB, índices {tamanhos[1] / 2 ** 20:.0f} MB)")
+    print(f"{'operação':<50} {'linhas':>7} {'mediana':>9} {'máximo':>9} {'banco':>9} {'plano':>9} {'blocos':>9}  acessos")
+    for resultado in resultados:
+        nome_operacao = f"{resultado['etapa']}.{resultado['operacao']}"
+        if resultado["erros"]:
+            print(f"{nome_operacao:<50} ERRO: {resultado['erros'][0]}")
+            continue
+        plano_ms = sum(comando["execucao_ms"] for comando in resultado["comandos"])
+        blocos = sum(comando["blocos_cache"] + comando["blocos_lidos"] for comando in resultado["comandos"])
+        acessos = ", ".join(acesso for comando in resultado["comandos"] for acesso in comando["acessos"] if "solicitacoes" in acesso)
+        print(f"{nome_operacao:<50} {resultado['linhas']:>7} {resultado['mediana_ms']:>7.1f}ms {resultado['maximo_ms']:>7.1f}ms "
+              f"{resultado['banco_ms']:>7.1f}ms {plano_ms:>7.1f}ms {blocos:>9}  {acessos}")
+
+def imprimir_comparacao(por_variante):
+    nomes = list(por_variante)
+    print(f"\nMediana por variante (relativa a {nomes[0]})")
+    print(f"{'operação':<50} " + " ".join(f"{nome:>18}" for nome in nomes))
+    for posicao, resultado in enumerate(por_variante[nomes[0]]):
+        celulas = []
+        for nome in nomes:
+            mediana = por_variante[nome][posicao]["mediana_ms"]
+            base = resultado["mediana_ms"]
+            if mediana is None:
+                celulas.append(f"{'erro':>18}")
+            elif nome == nomes[0] or not base:
+                celulas.append(f"{mediana:>16.1f}ms")
+            else:
+                celulas.append(f"{f'{mediana:.1f}ms ({mediana / base:.2f}x)':>18}")
+        print(f"{resultado['etapa'] + '.' + resultado['operacao']:<50} " + " ".join(celulas))
+
+def main():
+    argumentos = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    argumentos.add_argument("--banco", default="nfce_benchmark", help="banco usado no benchmark (criado se não existir)")
+    argumentos.add_argument("--linhas", type=int, default=1000000, help="solicitações povoadas")
+    argumentos.add_argument("--empresas", type=int, default=2000, help="empresas (uma solicitação por empresa e dia)")
+    argumentos.add_argument("--semente", type=float, default=0.42, help="semente do povoamento, entre -1 e 1 (setseed)")
+    argumentos.add_argument("--recriar", action="store_true", help="refaz o povoamento mesmo se já existir")
+    argumentos.add_argument("--variantes", default=",".join(VARIANTES), help="variantes comparadas, separadas por vírgula")
+    argumentos.add_argument("--repeticoes", type=int, default=5, help="execuções medidas de cada operação")
+    argumentos.add_argument("--lote", type=int, default=50, help="solicitações de cada amostra das atualizações")
+    argumentos.add_argument("--planos", default=os.path.join(tempfile.gettempdir(), "benchmark_banco"),
+                            help="diretório dos planos (EXPLAIN) e do resultado.json")
+    opcoes = argumentos.parse_args()
+
+    variantes = [nome.strip() for nome in opcoes.variantes.split(",") if nome.strip()]
+    desconhecidas = [nome for nome in variantes if nome not in VARIANTES]
+    if desconhecidas:
+        sys.exit(f"Variantes desconhecidas: {', '.join(desconhecidas)} (disponíveis: {', '.join(VARIANTES)})")
+    if opcoes.banco == BANCO_PRODUCAO:
+        sys.exit(f"O benchmark altera e desfaz dados em massa; use um banco próprio, não {BANCO_PRODUCAO}")
+
+    montar_ambiente(tempfile.mkdtemp(prefix="benchmark_banco_"))
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import utils, controleFluxo, solicitarXmls, solicitarXmlsFalhos, localizarLinks, baixarArquivos, gerenciarArquivos, reconciliarLacunas
+
+    parametros = utils.parametros_postgres()
+    if not parametros:
+        sys.exit("Defina POSTGRES_HOST, POSTGRES_USER e POSTGRES_PASSWORD")
+    criar_banco(parametros, opcoes.banco)
+    povoar(parametros, opcoes.banco, opcoes)
+
+    # Todas as etapas usam a mesma conexão registrada; o lote não é limitado pelo controle de fluxo
+    # (medir_filas é medida como operação própria)
+    conexao = ConexaoBenchmark(conectar(parametros, opcoes.banco))
+    for modulo in (controleFluxo, solicitarXmls, solicitarXmlsFalhos, localizarLinks, baixarArquivos, gerenciarArquivos, reconciliarLacunas):
+        modulo.conectar_postgres = lambda: conexao
+    controleFluxo.limite_lote = lambda etapa, lote: lote
+
+    distribuicao = distribuicao_estados(conexao.conexao)
+    print(", ".join(f"{nome}={quantidade}" for nome, quantidade in distribuicao.items()))
+    amostras = escolher_amostras(conexao.conexao, opcoes.lote)
+    operacoes = montar_operacoes(amostras)
+
+    por_variante, tamanhos = {}, {}
+    for nome in variantes:
+        alterar_estrutura(parametros, opcoes.banco, VARIANTES[nome]["aplicar"])
+        try:
+            tamanhos[nome] = tamanho_tabela(conexao.conexao)
+            por_variante[nome] = executar_variante(nome, conexao, operacoes, opcoes)
+        finally:
+            conexao.desfazer()
+            alterar_estrutura(parametros, opcoes.banco, VARIANTES[nome]["desfazer"])
+        imprimir_variante(nome, por_variante[nome], tamanhos[nome])
+    conexao.conexao.close()
+
+    if len(por_variante) > 1:
+        imprimir_comparacao(por_variante)
+
+    with open(os.path.join(opcoes.planos, "resultado.json"), "w", encoding="utf-8") as arquivo:
+        json.dump({"banco": opcoes.banco, "linhas": opcoes.linhas, "empresas": opcoes.empresas, "distribuicao": distribuicao,
+                   "variantes": {nome: {"tamanho_tabela": tamanhos[nome][0], "tamanho_indices": tamanhos[nome][1], "operacoes": resultados}
+                                 for nome, resultados in por_variante.items()}}, arquivo, indent=2, ensure_ascii=False)
+    print(f"\nPlanos e resultado.json em {opcoes.planos}")
+    erros = sum(1 for resultados in por_variante.values() for resultado in resultados if resultado["erros"])
+    sys.exit(1 if erros else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+"""
+Benchmark de ponta a ponta da ingestão de ZIPs do gerenciarArquivos, com baseline.
+
+Para cada tamanho de corpus (--notas, padrão 1000,10000,100000 notas) gera um
+corpus sintético com gerarCorpus (mesma semente, mesmos bytes) e processa todos
+os ZIPs em um processo filho, pelo mesmo caminho do serviço:
+criar_job_processamento, processar_zip, analisar_e_renomear,
+mover_para_destino_final (copiar_xmls_deduplicados, catálogo) e finalizar_job.
+
+Informa arquivos/s, MB/s, notas/s e pico de RSS do filho e, por fase (tempo
+exclusivo, sem as fases internas), tempo de relógio, CPU de usuário e de
+sistema, fsyncs feitos pelo Python (coluna "fsync py"; os syncs do journal SQLite
+não são contados) e trocas de contexto voluntárias. Fases em que o tempo de
+sistema supera o de usuário são marcadas como dominadas por syscalls.
+
+Com --gravar-baseline os resultados são gravados em --baseline; sem ele, são
+comparados com o baseline existente e o benchmark termina com código 1 se
+arquivos/s ou MB/s de algum cenário cair mais que --tolerancia.
+
+Uso:
+    python benchmarkIngestao.py [--notas 1000,10000,100000] [--repeticoes 3]
+                                [--baseline benchmark_ingestao.json] [--gravar-baseline] [--tolerancia 0.15]
+"""
+import os, sys, json, time, shutil, platform, argparse, resource, tempfile, subprocess
+
+METRICAS_COMPARADAS = ("arquivos_s", "mb_s")
+
+# Funções medidas no filho: nome da função -> nome da fase
+FASES = {
+    "processar_arquivo_zip_existente": "restante do ZIP",
+    "criar_job_processamento": "criar job (cópia)",
+    "processar_zip": "extração",
+    "analisar_e_renomear": "análise dos XMLs",
+    "mover_para_destino_final": "destino final",
+    "copiar_xmls_deduplicados": "cópia deduplicada",
+    "registrar_resultado_job": "resultado no journal",
+    "registrar_catalogo_job": "catálogo",
+    "finalizar_job": "finalizar job",
+    "mover_para_falhas": "mover para falhas",
+    "atualizar_estado": "estado no journal",
+}
+CAMPOS = ("segundos", "usuario", "sistema", "fsyncs", "trocas_voluntarias", "blocos_escritos")
+
+# ============================================
+# PROCESSO FILHO
+# ============================================
+
+fsyncs = 0
+
+def amostrar():
+    uso = resource.getrusage(resource.RUSAGE_SELF)
+    return (time.perf_counter(), uso.ru_utime, uso.ru_stime, fsyncs, uso.ru_nvcsw, uso.ru_oublock)
+
+def instrumentar_fases(modulo, totais):
+    """Envolve as funções de FASES acumulando em `totais` o custo exclusivo de cada fase"""
+    pilha = []
+
+    def medir(nome_fase, funcao):
+        def envoltorio(*args, **kwargs):
+            inicio = amostrar()
+            pilha.append([0] * len(CAMPOS))
+            try:
+                return funcao(*args, **kwargs)
+            finally:
+                internas = pilha.pop()
+                inclusivo = [fim - comeco for fim, comeco in zip(amostrar(), inicio)]
+                acumulado = totais.setdefault(nome_fase, [0] * len(CAMPOS) + [0])
+                for indice, (valor, interno) in enumerate(zip(inclusivo, internas)):
+                    acumulado[indice] += valor - interno
+                acumulado[-1] += 1
+                if pilha:
+                    pilha[-1] = [soma + valor for soma, valor in zip(pilha[-1], inclusivo)]
+        return envoltorio
+
+    for nome_funcao, nome_fase in FASES.items():
+        setattr(modulo, nome_funcao, medir(nome_fase, getattr(modulo, nome_funcao)))
+
+def executar_filho():
+    """Processa todos os ZIPs da pasta incoming e imprime as medições em JSON"""
+    fsync_original = os.fsync
+
+    def contar_fsync(descritor):
+        global fsyncs
+        fsyncs += 1
+        return fsync_original(descritor)
+
+    os.fsync = contar_fsync
+    import gerenciarArquivos
+
+    gerenciarArquivos.configurar_diretorios()
+    totais = {}
+    instrumentar_fases(gerenciarArquivos, totais)
+
+    incoming = gerenciarArquivos.ESTRUTURA_DIRETORIOS["incoming"]
+    arquivos = sorted(arquivo for arquivo in os.listdir(incoming) if arquivo.endswith(".zip"))
+    tamanho = sum(os.path.getsize(os.path.join(incoming, arquivo)) for arquivo in arquivos)
+
+    sucesso = 0
+    inicio = time.perf_counter()
+    for arquivo in arquivos:
+        if gerenciarArquivos.processar_arquivo_zip_existente(arquivo):
+            sucesso += 1
+    gerenciarArquivos.fechar_journal()
+    segundos = time.perf_counter() - inicio
+
+    notas_destino = sum(1 for _, _, nomes in os.walk(gerenciarArquivos.DIRETORIO_FINAL) for nome in nomes if nome.endswith(".xml"))
+    print(json.dumps({
+        "arquivos": len(arquivos), "sucesso": sucesso, "bytes": tamanho, "segundos": segundos,
+        "notas_destino": notas_destino, "rss_pico_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "fases": {fase: dict(zip(CAMPOS + ("chamadas",), valores)) for fase, valores in totais.items()},
+    }))
+
+# ============================================
+# PROCESSO PRINCIPAL
+# ============================================
+
+def executar_cenario(corpus, manifesto, repeticao):
+    """Copia o corpus para uma árvore nova e processa em um filho; retorna as medições"""
+    import gerarCorpus
+
+    base = tempfile.mkdtemp(prefix=f"benchmark_ingestao_{manifesto['notas']}_{repeticao}_")
+    try:
+        incoming = os.path.join(base, "NFCE_XML_TEMP", "incoming")
+        shutil.copytree(corpus, incoming, ignore=shutil.ignore_patterns("corpus.json"))
+        destino_final = os.path.join(base, "final")
+        gerarCorpus.criar_pastas_destino(destino_final, manifesto)
+
+        ambiente = dict(os.environ, DIRETORIO_EXECUCAO=base, DIRETORIO_FINAL=destino_final, DIRETORIO_DOWNLOADS=incoming,
+                        LOG_LEVEL="WARNING", METRICAS_PORTA_BASE="0", RASTREAMENTO="0")
+        processo = subprocess.run([sys.executable, os.path.abspath(__file__), "--filho"], env=ambiente, cwd=base,
+                                  stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        if processo.returncode != 0:
+            raise RuntimeError(f"filho terminou com código {processo.returncode}: {processo.stderr.strip()[-2000:]}")
+        medicao = json.loads(processo.stdout.strip().splitlines()[-1])
+    finally:
+        shutil.rmtree(base, ignore_errors=True)
+
+    segundos = medicao["segundos"] or 1e-9
+    medicao.update(arquivos_s=medicao["arquivos"] / segundos, mb_s=medicao["bytes"] / (1024 * 1024) / segundos,
+                   notas_s=manifesto["notas"] / segundos, rss_mb=medicao["rss_pico_kb"] / 1024, notas=manifesto["notas"])
+    return medicao
+
+def imprimir_fases(medicao):
+    fases = sorted(medicao["fases"].items(), key=lambda item: -item[1]["segundos"])
+    total = sum(dados["segundos"] for _, dados in fases) or 1e-9
+    # os.fsync chamados pelo Python; os syncs do journal SQLite (feitos em C) não entram na coluna
+    print(f"    {'fase':<22} {'tempo':>8} {'%':>5} {'usuário':>8} {'sistema':>8} {'fsync py':>9} {'trocas':>7} {'blocos':>8}")
+    for fase, dados in fases:
+        marca = "  <- syscalls" if dados["sistema"] > dados["usuario"] and dados["segundos"] > 0.01 * total else ""
+        print(f"    {fase:<22} {dados['segundos']:>7.2f}s {dados['segundos'] / total * 100:>4.0f}% {dados['usuario']:>7.2f}s "
+              f"{dados['sistema']:>7.2f}s {dados['fsyncs']:>9} {dados['trocas_voluntarias']:>7} {dados['blocos_escritos']:>8}{marca}")
+
+def descrever_maquina():
+    return {"python": platform.python_version(), "sistema": platform.platform(), "processadores": os.cpu_count()}
+
+def comparar_baseline(resultados, baseline, tolerancia):
+    """Retorna a lista de regressões de METRICAS_COMPARADAS em relação ao baseline"""
+    regressoes = []
+    for notas, atual in resultados.items():
+        referencia = baseline.get("cenarios", {}).get(notas)
+        if not referencia:
+            print(f"Cenário de {notas} notas ausente no baseline; não comparado")
+            continue
+        for metrica in METRICAS_COMPARADAS:
+            variacao = atual[metrica] / referencia[metrica] - 1 if referencia[metrica] else 0
+            print(f"  {notas:>7} notas  {metrica:<10} {referencia[metrica]:>10.2f} -> {atual[metrica]:>10.2f} ({variacao:+.1%})")
+            if variacao < -tolerancia:
+                regressoes.append(f"{notas} notas: {metrica} caiu {-variacao:.1%} (tolerância {tolerancia:.0%})")
+    return regressoes
+
+def main():
+    argumentos = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    argumentos.add_argument("--notas", default="1000,10000,100000", help="tamanhos de corpus, separados por vírgula")
+    argumentos.add_argument("--media-por-zip", type=int, default=500)
+    argumentos.add_argument("--semente", type=int, default=0)
+    argumentos.add_argument("--repeticoes", type=int, default=3, help="execuções por cenário; vale a de maior vazão")
+    argumentos.add_argument("--baseline", default="benchmark_ingestao.json")
+    argumentos.add_argument("--gravar-baseline", action="store_true", help="grava os resultados como novo baseline")
+    argumentos.add_argument("--tolerancia", type=float, default=0.15, help="queda máxima aceita em arquivos/s e MB/s")
+    argumentos.add_argument("--filho", action="store_true", help=argparse.SUPPRESS)
+    opcoes = argumentos.parse_args()
+
+    if opcoes.filho:
+        executar_filho()
+        return
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import gerarCorpus
+
+    resultados = {}
+    diretorio_corpus = tempfile.mkdtemp(prefix="benchmark_ingestao_corpus_")
+    try:
+        print(f"{'notas':>7} {'ZIPs':>5} {'MB':>7} {'tempo':>8} {'arquivos/s':>10} {'MB/s':>7} {'notas/s':>8} {'RSS MB':>7} {'falhas':>6} {'no destino':>10}")
+        for notas in [int(valor) for valor in opcoes.notas.split(",") if valor.strip()]:
+            corpus = os.path.join(diretorio_corpus, str(notas))
+            manifesto = gerarCorpus.gerar_corpus(corpus, notas=notas, media_por_zip=opcoes.media_por_zip, semente=opcoes.semente)
+
+            melhor = None
+            for repeticao in range(opcoes.repeticoes):
+                medicao = executar_cenario(corpus, manifesto, repeticao)
+                if melhor is None or medicao["arquivos_s"] > melhor["arquivos_s"]:
+                    melhor = medicao
+            shutil.rmtree(corpus, ignore_errors=True)
+
+            print(f"{notas:>7} {melhor['arquivos']:>5} {melhor['bytes'] / (1024 * 1024):>7.1f} {melhor['segundos']:>7.2f}s "
+                  f"{melhor['arquivos_s']:>10.2f} {melhor['mb_s']:>7.2f} {melhor['notas_s']:>8.0f} {melhor['rss_mb']:>7.1f} "
+                  f"{melhor['arquivos'] - melhor['sucesso']:>6} {melhor['notas_destino']:>10}")
+            imprimir_fases(melhor)
+            resultados[str(notas)] = {chave: melhor[chave] for chave in
+                                      ("arquivos", "bytes", "notas", "segundos", "arquivos_s", "mb_s", "notas_s", "rss_mb")}
+            resultados[str(notas)]["sha256_corpus"] = manifesto["sha256"]
+    finally:
+        shutil.rmtree(diretorio_corpus, ignore_errors=True)
+
+    if opcoes.gravar_baseline:
+        with open(opcoes.baseline, "w", encoding="utf-8") as f:
+            json.dump({"gerado_em": time.strftime("%Y-%m-%dT%H:%M:%S"), "maquina": descrever_maquina(),
+                       "semente": opcoes.semente, "cenarios": resultados}, f, ensure_ascii=False, indent=2)
+        print(f"Baseline gravado em {opcoes.baseline}")
+        return
+
+    if not os.path.exists(opcoes.baseline):
+        print(f"Sem baseline em {opcoes.baseline}; use --gravar-baseline para criar um")
+        return
+
+    with open(opcoes.baseline, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    if baseline.get("maquina") != descrever_maquina():
+        print(f"Aviso: baseline gerado em outra máquina ({baseline.get('maquina')})")
+    print(f"Comparação com {opcoes.baseline} ({baseline.get('gerado_em')}):")
+    regressoes = comparar_baseline(resultados, baseline, opcoes.tolerancia)
+    if regressoes:
+        for regressao in regressoes:
+            print(f"REGRESSÃO: {regressao}")
+        sys.exit(1)
+    print("Sem regressões acima da tolerância")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Benchmark do custo de uma chamada de log nos modos síncrono e fila (loggingConfig).
+
+Cada cenário roda em um processo filho com as variáveis LOG_* correspondentes,
+emite N registros e mede o tempo médio por chamada na thread de quem loga e o
+tempo para esvaziar a fila no encerramento. O console do filho vai para /dev/null.
+
+Uso:
+    python benchmarkLogging.py [--registros 100000]
+"""
+import os, sys, json, glob, time, argparse, subprocess
+
+CENARIOS = [
+    ("sincrono/texto", {"LOG_MODO": "sincrono", "LOG_FORMATO": "texto"}),
+    ("sincrono/json", {"LOG_MODO": "sincrono", "LOG_FORMATO": "json"}),
+    ("fila/bloquear", {"LOG_MODO": "fila", "LOG_FILA_POLITICA": "bloquear", "LOG_FORMATO": "texto"}),
+    ("fila/descartar", {"LOG_MODO": "fila", "LOG_FILA_POLITICA": "descartar", "LOG_FORMATO": "texto"}),
+    ("fila/json", {"LOG_MODO": "fila", "LOG_FILA_POLITICA": "bloquear", "LOG_FORMATO": "json"}),
+]
+
+def executar_filho(registros):
+    """Emite os registros e imprime as medições em JSON"""
+    import loggingConfig
+
+    logger = loggingConfig.get_logger("benchmark")
+    inicio = time.perf_counter()
+    for indice in range(registros):
+        logger.info("Link encontrado para solicitação %s - IE: %s", indice, "123456789")
+    chamadas = time.perf_counter() - inicio
+
+    inicio_encerramento = time.perf_counter()
+    descartados = sum(getattr(handler, "total_descartados", 0) for handler in loggingConfig.logging.getLogger().handlers)
+    loggingConfig.encerrar_logging()
+    encerramento = time.perf_counter() - inicio_encerramento
+
+    print(json.dumps({"chamadas": chamadas, "encerramento": encerramento, "descartados": descartados}))
+
+def remover_logs_benchmark():
+    for arquivo in glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), "logs", "benchmarkLogging.log*")):
+        os.remove(arquivo)
+
+def main():
+    argumentos = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    argumentos.add_argument("--registros", type=int, default=100000, help="registros emitidos por cenário")
+    argumentos.add_argument("--filho", action="store_true", help=argparse.SUPPRESS)
+    opcoes = argumentos.parse_args()
+
+    if opcoes.filho:
+        executar_filho(opcoes.registros)
+        return
+
+    print(f"{'cenário':<16} {'µs/chamada':>11} {'total':>9} {'encerramento':>13} {'descartados':>12}")
+    for nome, variaveis in CENARIOS:
+        remover_logs_benchmark()
+        ambiente = dict(os.environ, LOG_LEVEL="INFO", **variaveis)
+        processo = subprocess.run([sys.executable, os.path.abspath(__file__), "--filho", "--registros", str(opcoes.registros)],
+                                  env=ambiente, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+        if processo.returncode != 0:
+            print(f"{nome:<16} falhou (código {processo.returncode})")
+            continue
+        medicao = json.loads(processo.stdout.strip().splitlines()[-1])
+        print(f"{nome:<16} {medicao['chamadas'] / opcoes.registros * 1e6:>11.2f} {medicao['chamadas']:>8.2f}s "
+              f"{medicao['encerramento']:>12.2f}s {medicao['descartados']:>12}")
+    remover_logs_benchmark()
+
+if __name__ == "__main__":
+    main()
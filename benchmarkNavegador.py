@@ -0,0 +1,194 @@
+"""
+Benchmark offline das etapas com navegador sobre o portal simulado (simuladorSefaz).
+
+Executa em sequência, sem Selenoid nem banco, o mesmo código de produção de:
+
+    solicitar   solicitarXmls.processar_solicitacoes
+    localizar   localizarLinks.processar_caixa_downloads (processar_links_disponíveis)
+    baixar      baixarArquivos.processar_downloads
+
+O WebDriver é o NavegadorFalso (SELENOID_URL=simulado://) e as funções de banco
+das etapas são trocadas por um banco em memória com N solicitações. As pausas
+fixas das etapas (time.sleep) são multiplicadas por --escala-pausas (0 = sem
+pausas). O portal registra no máximo uma solicitação por segundo, como o
+horário de segundos das mensagens exige, o que limita a etapa solicitar.
+
+Para cada etapa são informados tempo, itens, comandos WebDriver e a conferência
+de que cada solicitação recebeu o link e o arquivo corretos.
+
+Uso:
+    python benchmarkNavegador.py [--solicitacoes 20] [--latencia 0.01] [--taxa-falha 0]
+                                 [--sessoes 2] [--linhas-ruido 200] [--escala-pausas 0] [--semente 0]
+"""
+import os, sys, time, random, shutil, zipfile, argparse, tempfile
+from datetime import date, datetime, timedelta
+
+def montar_ambiente(base, opcoes):
+    """Variáveis lidas na importação das etapas; precisam existir antes delas"""
+    os.environ.update({
+        "DIRETORIO_EXECUCAO": base,
+        "DISJUNTOR_BACKEND": "arquivo",
+        "DISJUNTOR_ARQUIVO": os.path.join(base, "disjuntor.json"),
+        "DOWNLOADS_SIMULTANEOS": str(opcoes.sessoes),
+        "TIMEOUT_DOWNLOAD": "30",
+        "RASTREAMENTO_ARQUIVO": os.path.join(base, "spans.jsonl"),
+        "PERFIL_NAVEGADOR": "1",
+        "PERFIL_ARQUIVO_PEDIDO": os.path.join(base, "profile.request"),
+        "LOG_LEVEL": os.environ.get("LOG_LEVEL", "WARNING"),
+    })
+
+# ============================================
+# BANCO EM MEMÓRIA
+# ============================================
+
+banco = {}
+
+def criar_banco(quantidade, semente):
+    aleatorio = random.Random(semente)
+    hoje = date.today()
+    for id_solicitacao in range(1, quantidade + 1):
+        dia = (hoje - timedelta(days=aleatorio.randrange(1, 365))).strftime("%d/%m/%Y")
+        banco[id_solicitacao] = {"id": id_solicitacao, "inscricao_estadual": f"16{aleatorio.randrange(10 ** 7):07d}",
+                                 "data_ini": dia, "data_fim": dia, "solicitado": 0, "horario": None, "link": None,
+                                 "anexo": None, "resultado": None, "baixado": 0, "arquivo": None, "hash_arquivo": None}
+
+def obter_solicitacoes_pendentes(retry_count=3):
+    return [{campo: item[campo] for campo in ("id", "inscricao_estadual", "data_ini", "data_fim")}
+            for item in banco.values() if item["solicitado"] == 0]
+
+def atualizar_solicitacao(id_solicitacao, horario=None, sucesso=True, retry_count=3):
+    if sucesso:
+        banco[id_solicitacao]["solicitado"] += 1
+        banco[id_solicitacao]["horario"] = horario or datetime.now()
+    return True
+
+def obter_solicitacoes_solicitadas():
+    return [{"id": item["id"], "inscricao_estadual": item["inscricao_estadual"],
+             "horario": item["horario"].strftime("%d/%m/%Y %H:%M:%S"), "horario_dt": item["horario"]}
+            for item in banco.values() if item["solicitado"] > 0 and not item["link"]]
+
+def registrar_resultados_caixa(resultados):
+    for resultado in resultados:
+        banco[resultado["id"]].update(link=resultado["link"], anexo=resultado["anexo"], resultado=resultado["resultado"])
+    return True
+
+def obter_solicitacoes_com_link():
+    return [{"id": item["id"], "inscricao_estadual": item["inscricao_estadual"], "link": item["link"]}
+            for item in banco.values() if item["link"] and item["anexo"] and not item["baixado"]]
+
+def buscar_solicitacao_por_hash(hash_arquivo, id_solicitacao):
+    return next(((item["id"], item["arquivo"]) for item in banco.values()
+                 if item["hash_arquivo"] == hash_arquivo and item["id"] != id_solicitacao), None)
+
+def registrar_falha_download(id_solicitacao, motivo, tamanho=None):
+    banco[id_solicitacao]["resultado"] = motivo
+    return False
+
+def marcar_como_baixado(id_solicitacao, arquivo=None, tamanho=None, hash_arquivo=None):
+    banco[id_solicitacao].update(baixado=banco[id_solicitacao]["baixado"] + 1, arquivo=arquivo, hash_arquivo=hash_arquivo)
+    return True
+
+# ============================================
+# EXECUÇÃO
+# ============================================
+
+def conferir(site, diretorio_incoming):
+    """Confere link e arquivo de cada solicitação contra as mensagens geradas pelo portal"""
+    por_ie_dia = {(mensagem.get("ie"), mensagem.get("data_ini")): mensagem for mensagem in site.mensagens if mensagem.get("ie")}
+    erros = []
+    for item in banco.values():
+        mensagem = por_ie_dia.get((item["inscricao_estadual"], item["data_ini"]))
+        if item["solicitado"] and mensagem is None:
+            erros.append(f"solicitação {item['id']}: sem mensagem no portal")
+            continue
+        if item["link"] and not item["link"].endswith(f"={mensagem['id']}"):
+            erros.append(f"solicitação {item['id']}: link {item['link']} de outra mensagem")
+        if item["baixado"]:
+            with zipfile.ZipFile(os.path.join(diretorio_incoming, item["arquivo"])) as arquivo_zip:
+                conteudo = b"".join(arquivo_zip.read(nome) for nome in arquivo_zip.namelist())
+            if f"<IE>{item['inscricao_estadual']}</IE>".encode() not in conteudo:
+                erros.append(f"solicitação {item['id']}: arquivo {item['arquivo']} de outra IE")
+    return erros
+
+def main():
+    argumentos = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    argumentos.add_argument("--solicitacoes", type=int, default=20, help="solicitações no banco em memória")
+    argumentos.add_argument("--latencia", type=float, default=0.01, help="segundos por comando WebDriver")
+    argumentos.add_argument("--taxa-falha", type=float, default=0.0, help="probabilidade de falha em get() e click()")
+    argumentos.add_argument("--sessoes", type=int, default=2, help="sessões simultâneas de download")
+    argumentos.add_argument("--linhas-ruido", type=int, default=200, help="mensagens de outros assuntos na caixa")
+    argumentos.add_argument("--tempo-download", type=float, default=0.0, help="segundos de cada download em andamento")
+    argumentos.add_argument("--escala-pausas", type=float, default=0.0, help="fator aplicado às pausas fixas das etapas")
+    argumentos.add_argument("--semente", type=int, default=0)
+    argumentos.add_argument("--manter", action="store_true", help="mantém o diretório temporário")
+    opcoes = argumentos.parse_args()
+
+    base = tempfile.mkdtemp(prefix="benchmark_navegador_")
+    montar_ambiente(base, opcoes)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    import simuladorSefaz, utils, solicitarXmls, localizarLinks, baixarArquivos
+
+    simuladorSefaz.configurar_ambiente()
+    site = simuladorSefaz.SiteSefazFalso(latencia=opcoes.latencia, taxa_falha=opcoes.taxa_falha, semente=opcoes.semente,
+                                         tempo_download=opcoes.tempo_download, linhas_ruido=opcoes.linhas_ruido)
+    simuladorSefaz.definir_site(site)
+
+    # Banco e credenciais em memória; pausas fixas escaladas (o simulador usa a própria referência a sleep)
+    utils.obter_credenciais_banco = lambda: ("usuario", "senha")
+    for modulo, nome in ((solicitarXmls, "obter_solicitacoes_pendentes"), (solicitarXmls, "atualizar_solicitacao"),
+                         (localizarLinks, "obter_solicitacoes_solicitadas"), (localizarLinks, "registrar_resultados_caixa"),
+                         (baixarArquivos, "obter_solicitacoes_com_link"), (baixarArquivos, "buscar_solicitacao_por_hash"),
+                         (baixarArquivos, "registrar_falha_download"), (baixarArquivos, "marcar_como_baixado")):
+        setattr(modulo, nome, globals()[nome])
+    time.sleep = lambda segundos: simuladorSefaz.dormir(max(segundos * opcoes.escala_pausas, 0.001))
+    baixarArquivos.DIRETORIO_DOWNLOADS = os.path.join(base, "incoming")
+    baixarArquivos.DIRETORIO_SESSOES = os.path.join(base, "sessoes")
+    os.makedirs(baixarArquivos.DIRETORIO_DOWNLOADS, exist_ok=True)
+
+    criar_banco(opcoes.solicitacoes, opcoes.semente)
+
+    def localizar():
+        navegador, _, links = localizarLinks.processar_caixa_downloads()
+        if navegador:
+            navegador.quit()
+        return links or 0
+
+    def solicitar():
+        try:
+            return solicitarXmls.processar_solicitacoes()
+        finally:
+            solicitarXmls.fechar_navegador()
+
+    etapas = [("solicitar", solicitar), ("localizar", localizar), ("baixar", baixarArquivos.processar_downloads)]
+    print(f"{opcoes.solicitacoes} solicitações, latência {opcoes.latencia * 1000:.0f}ms/comando, "
+          f"taxa de falha {opcoes.taxa_falha:.0%}, {opcoes.linhas_ruido} linhas de ruído na caixa")
+    print(f"{'etapa':<10} {'itens':>6} {'tempo':>9} {'itens/s':>8} {'comandos':>9} {'cmd/item':>9}")
+    for nome, funcao in etapas:
+        comandos_inicio = site.comandos
+        inicio = time.perf_counter()
+        itens = funcao() or 0
+        duracao = time.perf_counter() - inicio
+        comandos = site.comandos - comandos_inicio
+        print(f"{nome:<10} {itens:>6} {duracao:>8.2f}s {itens / duracao if duracao else 0:>8.2f} "
+              f"{comandos:>9} {comandos / itens if itens else 0:>9.1f}")
+
+    resultados = {}
+    for item in banco.values():
+        resultados[item["resultado"] or "SEM_LINK"] = resultados.get(item["resultado"] or "SEM_LINK", 0) + 1
+    print("Resultados: " + ", ".join(f"{classe}={quantidade}" for classe, quantidade in sorted(resultados.items())))
+    print(f"Falhas injetadas: {site.falhas_injetadas}, downloads entregues: {site.downloads}")
+
+    erros = conferir(site, baixarArquivos.DIRETORIO_DOWNLOADS)
+    for erro in erros:
+        print(f"ERRO: {erro}")
+    print("Conferência: OK" if not erros else f"Conferência: {len(erros)} erros")
+
+    if opcoes.manter:
+        print(f"Diretório mantido em {base}")
+    else:
+        shutil.rmtree(base, ignore_errors=True)
+    sys.exit(1 if erros else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+Controle de fluxo (backpressure) entre as etapas do pipeline.
+
+Mede a profundidade das filas intermediárias e limita o lote das etapas que as
+alimentam:
+
+    aguardando_link      solicitações feitas sem resposta localizada na caixa da SEFAZ
+    aguardando_download  solicitações com link e anexo ainda não baixadas
+    zips_pendentes       ZIPs em incoming/ mais jobs em processing/ do gerenciarArquivos
+
+Cada fila tem marca alta e baixa (FLUXO_<FILA>="alta,baixa"). Acima da marca alta a
+etapa é pausada até a fila voltar à marca baixa; entre as duas o lote fica limitado
+ao espaço que resta até a marca alta.
+
+Uso:
+    python controleFluxo.py    # mostra profundidades, marcas e o lote atual de cada etapa
+"""
+import os, time
+import metricas
+from dotenv import load_dotenv
+from loggingConfig import get_logger
+from utils import conectar_postgres, obter_diretorio_execucao
+
+load_dotenv()
+logger = get_logger(__name__)
+
+def ler_marcas(fila, padrao):
+    alta, baixa = (int(valor) for valor in os.environ.get(f"FLUXO_{fila.upper()}", padrao).split(","))
+    return alta, baixa
+
+MARCAS = {
+    "aguardando_link": ler_marcas("aguardando_link", "200,100"),
+    "aguardando_download": ler_marcas("aguardando_download", "200,100"),
+    "zips_pendentes": ler_marcas("zips_pendentes", "50,20"),
+}
+
+# Filas a jusante que limitam cada etapa
+ETAPAS = {
+    "solicitar": ("aguardando_link", "aguardando_download", "zips_pendentes"),
+    "resolicitar": ("aguardando_link", "aguardando_download", "zips_pendentes"),
+    "baixar": ("zips_pendentes",),
+}
+
+# Mesmos padrões do gerenciarArquivos (ESTRUTURA_DIRETORIOS)
+DIRETORIO_TEMP = os.path.join(os.environ.get("DIRETORIO_EXECUCAO") or obter_diretorio_execucao(), "NFCE_XML_TEMP")
+DIRETORIO_INCOMING = os.environ.get("DIRETORIO_DOWNLOADS") or os.path.join(DIRETORIO_TEMP, "incoming")
+DIRETORIO_PROCESSAMENTO = os.path.join(DIRETORIO_TEMP, "processing")
+FLUXO_CACHE = float(os.environ.get("FLUXO_CACHE", 15))
+
+# Medição mais recente e etapas/filas pausadas neste processo (histerese)
+filas_cache = None
+filas_cache_em = 0
+pausas = set()
+
+def contar_entradas(diretorio, filtro):
+    try:
+        with os.scandir(diretorio) as entradas:
+            return sum(1 for entrada in entradas if filtro(entrada))
+    except (OSError, TypeError):
+        return 0
+
+def medir_filas():
+    """
+    Retorna a profundidade de cada fila intermediária.
+
+    Retorna None se o banco estiver indisponível; nesse caso as etapas não são limitadas.
+    """
+    global filas_cache, filas_cache_em
+    if filas_cache and time.time() - filas_cache_em < FLUXO_CACHE:
+        return filas_cache
+
+    conexao = conectar_postgres()
+    if not conexao:
+        return None
+    try:
+        cursor = conexao.cursor()
+        with metricas.cronometrar(metricas.POSTGRES_SEGUNDOS, operacao="medir_filas"):
+            cursor.execute("""
+            SELECT COUNT(*) FILTER (WHERE solicitado > 0 AND (link IS NULL OR link = '') AND baixado = 0),
+                   COUNT(*) FILTER (WHERE link IS NOT NULL AND link != '' AND anexo = true AND baixado = 0)
+            FROM nfce.solicitacoes
+            WHERE tipo = 'NFCE' AND NOT finalizado AND NOT esgotado
+        """)
+        aguardando_link, aguardando_download = cursor.fetchone()
+        cursor.close()
+    except Exception as erro:
+        logger.error(f"Erro ao medir filas do pipeline: {erro}")
+        return None
+    finally:
+        conexao.close()
+
+    filas_cache = {
+        "aguardando_link": aguardando_link,
+        "aguardando_download": aguardando_download,
+        "zips_pendentes": contar_entradas(DIRETORIO_INCOMING, lambda entrada: entrada.name.endswith('.zip'))
+                          + contar_entradas(DIRETORIO_PROCESSAMENTO, lambda entrada: entrada.is_dir()),
+    }
+    filas_cache_em = time.time()
+    for fila, profundidade in filas_cache.items():
+        metricas.FILA_PROFUNDIDADE.definir(profundidade, fila=fila)
+    return filas_cache
+
+def calcular_limite(etapa, filas, lote, pausas_atuais):
+    """Lote permitido para a etapa dadas as profundidades; atualiza `pausas_atuais`"""
+    limite = lote
+    for fila in ETAPAS[etapa]:
+        alta, baixa = MARCAS[fila]
+        profundidade = filas[fila]
+        if (etapa, fila) in pausas_atuais:
+            if profundidade > baixa:
+                limite = 0
+                continue
+            pausas_atuais.discard((etapa, fila))
+            logger.info(f"Etapa '{etapa}' retomada: {fila}={profundidade} voltou à marca baixa ({baixa})")
+        elif profundidade >= alta:
+            pausas_atuais.add((etapa, fila))
+            logger.warning(f"Etapa '{etapa}' pausada: {fila}={profundidade} atingiu a marca alta ({alta})")
+            limite = 0
+            continue
+        if profundidade > baixa:
+            limite = min(limite, alta - profundidade)
+    return limite
+
+def limite_lote(etapa, lote):
+    """
+    Quantidade de itens que a etapa pode processar neste ciclo (0 = pausada).
+
+    Parâmetros:
+        etapa (str): "solicitar", "resolicitar" ou "baixar".
+        lote (int): Lote que a etapa usaria sem backpressure.
+    """
+    filas = medir_filas()
+    if filas is None:
+        return lote
+
+    limite = calcular_limite(etapa, filas, lote, pausas)
+    if 0 < limite < lote:
+        logger.info(f"Etapa '{etapa}' limitada a {limite} itens neste ciclo ({', '.join(f'{fila}={filas[fila]}' for fila in ETAPAS[etapa])})")
+    return limite
+
+def main():
+    from agendador import AGENDADOR_LOTE
+
+    filas = medir_filas()
+    if filas is None:
+        print("Não foi possível medir as filas (PostgreSQL indisponível)")
+        return
+    print("Filas:")
+    for fila, profundidade in filas.items():
+        alta, baixa = MARCAS[fila]
+        print(f"  {fila:<20} {profundidade:>6}   marcas alta={alta} baixa={baixa}")
+    print(f"\nLote atual por etapa (lote base {AGENDADOR_LOTE}):")
+    for etapa in ETAPAS:
+        limite = calcular_limite(etapa, filas, AGENDADOR_LOTE, set())
+        print(f"  {etapa:<12} {'PAUSADA' if limite == 0 else limite}")
+
+if __name__ == "__main__":
+    main()
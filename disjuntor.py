@@ -0,0 +1,221 @@
+"""
+Disjuntor (circuit breaker) compartilhado entre os serviços que acessam a SEFAZ.
+
+Após DISJUNTOR_LIMITE_FALHAS falhas consecutivas de navegação (Selenoid, login ou
+carregamento de página) o disjuntor abre e todas as etapas com navegador ficam
+pausadas. Passado DISJUNTOR_TEMPO_ABERTO, uma única thread (de um único processo)
+recebe a vez de sondar o portal (meio-aberto): sucesso fecha o disjuntor, falha o
+reabre.
+
+O estado fica em nfce.disjuntor (padrão) ou, com DISJUNTOR_BACKEND=arquivo, em um
+arquivo JSON local para instalações em um único servidor. As transições são
+registradas no log e, no PostgreSQL, publicadas via NOTIFY no canal disjuntor_sefaz.
+"""
+import os, sys, json, time, fcntl, socket, threading
+from dotenv import load_dotenv
+from loggingConfig import get_logger
+
+load_dotenv()
+logger = get_logger(__name__)
+
+FECHADO = "FECHADO"
+ABERTO = "ABERTO"
+MEIO_ABERTO = "MEIO_ABERTO"
+
+NOME_DISJUNTOR = "sefaz"
+CANAL_NOTIFICACAO = "disjuntor_sefaz"
+DISJUNTOR_BACKEND = os.environ.get("DISJUNTOR_BACKEND", "postgres").lower()  # "postgres" ou "arquivo"
+DISJUNTOR_ARQUIVO = os.environ.get("DISJUNTOR_ARQUIVO") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "disjuntor_sefaz.json")
+DISJUNTOR_LIMITE_FALHAS = int(os.environ.get("DISJUNTOR_LIMITE_FALHAS", 5))
+DISJUNTOR_TEMPO_ABERTO = int(os.environ.get("DISJUNTOR_TEMPO_ABERTO", 300))
+DISJUNTOR_TIMEOUT_SONDA = int(os.environ.get("DISJUNTOR_TIMEOUT_SONDA", 600))
+DISJUNTOR_CACHE = float(os.environ.get("DISJUNTOR_CACHE", 5))
+DISJUNTOR_INTERVALO_PAUSA = int(os.environ.get("DISJUNTOR_INTERVALO_PAUSA", 30))
+
+IDENTIFICACAO = f"{os.path.basename(sys.argv[0]) or 'python'}@{socket.gethostname()}:{os.getpid()}"
+
+def identificacao_sonda():
+    """Dono da sonda: o processo e a thread atual (o orquestrador roda várias etapas no mesmo processo)"""
+    return f"{IDENTIFICACAO}/{threading.current_thread().name}"
+
+# Último estado lido, para não consultar o backend a cada acesso de página
+estado_cache = None
+estado_cache_em = 0
+
+class DisjuntorAberto(Exception):
+    """Navegação bloqueada porque o disjuntor da SEFAZ está aberto"""
+
+def estado_inicial():
+    """Estado de um disjuntor fechado e sem falhas"""
+    return {"estado": FECHADO, "falhas": 0, "aberto_em": None, "sonda": None, "sonda_em": None}
+
+# ============================================
+# BACKENDS
+# ============================================
+
+def alterar_estado_postgres(funcao):
+    """Aplica `funcao` ao estado com a linha bloqueada (SELECT ... FOR UPDATE)"""
+    from utils import conectar_postgres
+
+    conexao = conectar_postgres()
+    if not conexao:
+        return None
+    try:
+        cursor = conexao.cursor()
+        cursor.execute("INSERT INTO nfce.disjuntor (nome) VALUES (%s) ON CONFLICT (nome) DO NOTHING", (NOME_DISJUNTOR,))
+        cursor.execute("""
+            SELECT estado, falhas_consecutivas, EXTRACT(EPOCH FROM aberto_em), sonda, EXTRACT(EPOCH FROM sonda_em)
+            FROM nfce.disjuntor WHERE nome = %s FOR UPDATE
+        """, (NOME_DISJUNTOR,))
+        estado, falhas, aberto_em, sonda, sonda_em = cursor.fetchone()
+        dados = {"estado": estado, "falhas": falhas, "aberto_em": aberto_em and float(aberto_em),
+                 "sonda": sonda, "sonda_em": sonda_em and float(sonda_em)}
+        original = dict(dados)
+
+        resultado = funcao(dados)
+
+        if dados != original:
+            cursor.execute("""
+                UPDATE nfce.disjuntor
+                SET estado = %s, falhas_consecutivas = %s, aberto_em = to_timestamp(%s), sonda = %s,
+                    sonda_em = to_timestamp(%s), atualizado_em = CURRENT_TIMESTAMP
+                WHERE nome = %s
+            """, (dados["estado"], dados["falhas"], dados["aberto_em"], dados["sonda"], dados["sonda_em"], NOME_DISJUNTOR))
+            if dados["estado"] != original["estado"]:
+                cursor.execute("SELECT pg_notify(%s, %s)", (CANAL_NOTIFICACAO, json.dumps(
+                    {"de": original["estado"], "para": dados["estado"], "falhas": dados["falhas"], "por": identificacao_sonda()})))
+        conexao.commit()
+        cursor.close()
+        return original, dados, resultado
+    except Exception as erro:
+        logger.error(f"Erro ao acessar o estado do disjuntor no PostgreSQL: {erro}")
+        conexao.rollback()
+        return None
+    finally:
+        conexao.close()
+
+def alterar_estado_arquivo(funcao):
+    """Aplica `funcao` ao estado com o arquivo de trava bloqueado (flock)"""
+    try:
+        with open(f"{DISJUNTOR_ARQUIVO}.lock", "a") as trava:
+            fcntl.flock(trava, fcntl.LOCK_EX)
+            try:
+                with open(DISJUNTOR_ARQUIVO, "r", encoding="utf-8") as f:
+                    dados = json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                dados = estado_inicial()
+            original = dict(dados)
+
+            resultado = funcao(dados)
+
+            if dados != original:
+                temporario = f"{DISJUNTOR_ARQUIVO}.{os.getpid()}.tmp"
+                with open(temporario, "w", encoding="utf-8") as f:
+                    json.dump(dados, f)
+                os.replace(temporario, DISJUNTOR_ARQUIVO)
+            return original, dados, resultado
+    except OSError as erro:
+        logger.error(f"Erro ao acessar o estado do disjuntor em {DISJUNTOR_ARQUIVO}: {erro}")
+        return None
+
+def alterar_estado(funcao):
+    """
+    Lê o estado compartilhado, aplica `funcao` (que pode alterá-lo) e grava o resultado.
+
+    Retorna o valor devolvido por `funcao`, ou None se o backend estiver indisponível.
+    """
+    global estado_cache, estado_cache_em
+
+    backend = alterar_estado_arquivo if DISJUNTOR_BACKEND == "arquivo" else alterar_estado_postgres
+    retorno = backend(funcao)
+    if retorno is None:
+        return None
+
+    original, dados, resultado = retorno
+    if original["estado"] != dados["estado"]:
+        publicar_transicao(original["estado"], dados)
+    estado_cache, estado_cache_em = dados, time.time()
+    return resultado
+
+def publicar_transicao(anterior, dados):
+    """Registra no log a transição feita por este processo (o NOTIFY sai na mesma transação)"""
+    if dados["estado"] == ABERTO:
+        logger.warning(f"Disjuntor SEFAZ ABERTO após {dados['falhas']} falhas consecutivas de navegação; "
+                       f"etapas com navegador pausadas por {DISJUNTOR_TEMPO_ABERTO}s")
+    elif dados["estado"] == MEIO_ABERTO:
+        logger.warning(f"Disjuntor SEFAZ MEIO-ABERTO: sondando o portal com {dados['sonda']}")
+    else:
+        logger.warning(f"Disjuntor SEFAZ FECHADO (antes {anterior}): navegação retomada")
+
+# ============================================
+# API
+# ============================================
+
+def permitir_navegacao():
+    """
+    Indica se este processo pode navegar no portal agora.
+
+    Com o disjuntor meio-aberto apenas a thread que detém a sonda é liberada. Se
+    o backend estiver indisponível a navegação é liberada, como antes do disjuntor.
+    """
+    agora = time.time()
+    sonda = identificacao_sonda()
+    if estado_cache and agora - estado_cache_em < DISJUNTOR_CACHE:
+        if estado_cache["estado"] == FECHADO:
+            return True
+        if estado_cache["estado"] == ABERTO and agora - (estado_cache["aberto_em"] or 0) < DISJUNTOR_TEMPO_ABERTO:
+            return False
+
+    def decidir(dados):
+        if dados["estado"] == FECHADO:
+            return True
+        if dados["estado"] == ABERTO:
+            if agora - (dados["aberto_em"] or 0) < DISJUNTOR_TEMPO_ABERTO:
+                return False
+            dados.update(estado=MEIO_ABERTO, sonda=sonda, sonda_em=agora)
+            return True
+        # Meio-aberto: a sonda é desta thread ou quem a detinha deixou de responder
+        if dados["sonda"] == sonda or agora - (dados["sonda_em"] or 0) > DISJUNTOR_TIMEOUT_SONDA:
+            dados.update(sonda=sonda, sonda_em=agora)
+            return True
+        return False
+
+    permitido = alterar_estado(decidir)
+    return True if permitido is None else permitido
+
+def registrar_sucesso():
+    """Registra uma navegação bem-sucedida, fechando o disjuntor se necessário"""
+    if estado_cache and estado_cache["estado"] == FECHADO and not estado_cache["falhas"] \
+            and time.time() - estado_cache_em < DISJUNTOR_CACHE:
+        return
+
+    def fechar(dados):
+        if dados["estado"] != FECHADO or dados["falhas"]:
+            dados.update(estado_inicial())
+
+    alterar_estado(fechar)
+
+def registrar_falha(motivo=None):
+    """Registra uma falha de navegação, abrindo o disjuntor ao atingir o limite"""
+    agora = time.time()
+
+    def contar(dados):
+        dados["falhas"] += 1
+        if dados["estado"] == MEIO_ABERTO or (dados["estado"] == FECHADO and dados["falhas"] >= DISJUNTOR_LIMITE_FALHAS):
+            dados.update(estado=ABERTO, aberto_em=agora, sonda=None, sonda_em=None)
+
+    if motivo:
+        logger.debug(f"Falha de navegação registrada no disjuntor: {motivo}")
+    alterar_estado(contar)
+
+def aguardar_liberacao():
+    """
+    Retorna True se a navegação está liberada; caso contrário aguarda
+    DISJUNTOR_INTERVALO_PAUSA segundos e retorna False para o laço tentar de novo.
+    """
+    if permitir_navegacao():
+        return True
+    logger.info(f"Disjuntor SEFAZ aberto. Etapa pausada, nova verificação em {DISJUNTOR_INTERVALO_PAUSA}s")
+    time.sleep(DISJUNTOR_INTERVALO_PAUSA)
+    return False
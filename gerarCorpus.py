@@ -0,0 +1,252 @@
+"""
+Gerador determinístico de corpus sintético de NFC-e (XMLs em ZIPs NFCE_XML*.zip).
+
+Produz notas no formato do portal (namespace http://www.portalfiscal.inf.br/nfe,
+chave de acesso e CNPJ com dígitos verificadores válidos, ide/dhEmi ou, no
+leiaute antigo, ide/dEmi, emit/IE e quantidade variável de det) agrupadas como
+a SEFAZ entrega: um ZIP por IE e dia. Uma fração configurável dos ZIPs traz
+notas de outra IE, membros corrompidos (XML truncado ou binário) e notas já
+entregues em ZIPs anteriores.
+
+A mesma semente e os mesmos parâmetros geram sempre os mesmos bytes; o
+corpus.json gravado junto com os ZIPs traz parâmetros, contagens por ZIP e o
+SHA-256 do conjunto, para conferir a reprodutibilidade.
+
+Uso:
+    python gerarCorpus.py <diretório> [--notas 10000] [--media-por-zip 500]
+                          [--distribuicao lognormal] [--semente 0] [--destino-final <dir>]
+"""
+import os, io, json, math, random, hashlib, zipfile, argparse
+from datetime import date, datetime, timedelta
+
+NAMESPACE_NFE = "http://www.portalfiscal.inf.br/nfe"
+CODIGO_UF_PB = "25"
+DATA_ZIP = (2024, 1, 1, 0, 0, 0)  # data fixa dos membros, para ZIPs idênticos entre execuções
+ULTIMO_DIA = date(2025, 1, 31)     # fim da janela de emissão (fixo pelo mesmo motivo)
+AMOSTRA_REENVIOS = 1000            # notas guardadas para sortear os reenvios
+
+PRODUTOS = [
+    ("ARROZ TIPO 1 5KG", "10063021", "UN", 24.90), ("FEIJAO CARIOCA 1KG", "07133319", "UN", 8.49),
+    ("CAFE TORRADO 500G", "09012100", "UN", 17.99), ("LEITE UHT INTEGRAL 1L", "04012010", "UN", 5.29),
+    ("ACUCAR CRISTAL 1KG", "17019900", "UN", 4.79), ("OLEO DE SOJA 900ML", "15079011", "UN", 7.99),
+    ("REFRIGERANTE 2L", "22021000", "UN", 9.49), ("PAO FRANCES", "19059090", "KG", 14.90),
+    ("DETERGENTE 500ML", "34022000", "UN", 2.59), ("SABONETE 90G", "34011190", "UN", 1.99),
+    ("GASOLINA COMUM", "27101259", "L", 5.89), ("AGUA MINERAL 500ML", "22011000", "UN", 1.50),
+]
+FORMAS_PAGAMENTO = ["01", "03", "04", "17"]  # dinheiro, crédito, débito, PIX
+
+def digito_modulo11(numero):
+    """Dígito verificador da chave de acesso (pesos 2 a 9 da direita para a esquerda)"""
+    soma = sum(int(digito) * (2 + indice % 8) for indice, digito in enumerate(reversed(numero)))
+    resto = soma % 11
+    return "0" if resto < 2 else str(11 - resto)
+
+def gerar_cnpj(aleatorio):
+    base = f"{aleatorio.randrange(10 ** 8):08d}0001"
+    for pesos in ((5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2), (6, 5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2)):
+        resto = sum(int(digito) * peso for digito, peso in zip(base, pesos)) % 11
+        base += "0" if resto < 2 else str(11 - resto)
+    return base
+
+def gerar_chave(cnpj, emissao, serie, numero, codigo):
+    sem_digito = f"{CODIGO_UF_PB}{emissao:%y%m}{cnpj}65{serie:03d}{numero:09d}1{codigo:08d}"
+    return sem_digito + digito_modulo11(sem_digito)
+
+def gerar_empresas(aleatorio, quantidade):
+    """Emitentes sintéticos: IE da PB (16 + 7 dígitos), CNPJ e razão social"""
+    empresas, ies = [], set()
+    while len(empresas) < quantidade:
+        ie = f"16{aleatorio.randrange(10 ** 7):07d}"
+        if ie in ies:
+            continue
+        ies.add(ie)
+        empresas.append({"ie": ie, "cnpj": gerar_cnpj(aleatorio), "nome": f"EMPRESA SINTETICA {len(empresas) + 1:04d} LTDA",
+                         "serie": aleatorio.randrange(1, 10), "numero": aleatorio.randrange(1, 50000)})
+    return empresas
+
+def gerar_xml(aleatorio, empresa, emissao, media_itens, leiaute_antigo=False):
+    """Retorna (chave, bytes) de uma NFC-e autorizada emitida por `empresa` em `emissao` (datetime)"""
+    empresa["numero"] += 1
+    chave = gerar_chave(empresa["cnpj"], emissao, empresa["serie"], empresa["numero"], aleatorio.randrange(10 ** 8))
+    itens = min(200, 1 + int(aleatorio.expovariate(1 / max(media_itens - 1, 0.001))))
+
+    detalhes, total = [], 0.0
+    for numero_item in range(1, itens + 1):
+        descricao, ncm, unidade, preco = PRODUTOS[aleatorio.randrange(len(PRODUTOS))]
+        quantidade = round(aleatorio.uniform(0.2, 3), 3) if unidade in ("KG", "L") else aleatorio.randrange(1, 6)
+        valor = round(quantidade * preco, 2)
+        total += valor
+        detalhes.append(
+            f'<det nItem="{numero_item}"><prod><cProd>{ncm[:6]}{numero_item:03d}</cProd><cEAN>SEM GTIN</cEAN>'
+            f'<xProd>{descricao}</xProd><NCM>{ncm}</NCM><CFOP>5102</CFOP><uCom>{unidade}</uCom>'
+            f'<qCom>{quantidade:.4f}</qCom><vUnCom>{preco:.2f}</vUnCom><vProd>{valor:.2f}</vProd>'
+            f'<cEANTrib>SEM GTIN</cEANTrib><uTrib>{unidade}</uTrib><qTrib>{quantidade:.4f}</qTrib>'
+            f'<vUnTrib>{preco:.2f}</vUnTrib><indTot>1</indTot></prod><imposto><ICMS><ICMSSN102><orig>0</orig>'
+            f'<CSOSN>102</CSOSN></ICMSSN102></ICMS></imposto></det>'
+        )
+
+    if leiaute_antigo:
+        versao, data = "3.10", f"<dEmi>{emissao:%Y-%m-%d}</dEmi>"
+    else:
+        versao, data = "4.00", f"<dhEmi>{emissao:%Y-%m-%dT%H:%M:%S}-03:00</dhEmi>"
+    recibo = emissao + timedelta(seconds=aleatorio.randrange(1, 30))
+    xml = (
+        f'<?xml version="1.0" encoding="UTF-8"?><nfeProc xmlns="{NAMESPACE_NFE}" versao="{versao}"><NFe xmlns="{NAMESPACE_NFE}">'
+        f'<infNFe Id="NFe{chave}" versao="{versao}"><ide><cUF>{CODIGO_UF_PB}</cUF><cNF>{chave[35:43]}</cNF>'
+        f'<natOp>VENDA</natOp><mod>65</mod><serie>{empresa["serie"]}</serie><nNF>{empresa["numero"]}</nNF>{data}'
+        f'<tpNF>1</tpNF><idDest>1</idDest><cMunFG>2507507</cMunFG><tpImp>4</tpImp><tpEmis>1</tpEmis>'
+        f'<cDV>{chave[-1]}</cDV><tpAmb>1</tpAmb><finNFe>1</finNFe><indFinal>1</indFinal><indPres>1</indPres></ide>'
+        f'<emit><CNPJ>{empresa["cnpj"]}</CNPJ><xNome>{empresa["nome"]}</xNome><enderEmit><xLgr>RUA SINTETICA</xLgr>'
+        f'<nro>{empresa["serie"] * 100}</nro><xBairro>CENTRO</xBairro><cMun>2507507</cMun><xMun>JOAO PESSOA</xMun>'
+        f'<UF>PB</UF><CEP>58000000</CEP></enderEmit><IE>{empresa["ie"]}</IE><CRT>1</CRT></emit>'
+        + "".join(detalhes) +
+        f'<total><ICMSTot><vBC>0.00</vBC><vICMS>0.00</vICMS><vProd>{total:.2f}</vProd><vDesc>0.00</vDesc>'
+        f'<vNF>{total:.2f}</vNF></ICMSTot></total><transp><modFrete>9</modFrete></transp>'
+        f'<pag><detPag><tPag>{FORMAS_PAGAMENTO[aleatorio.randrange(len(FORMAS_PAGAMENTO))]}</tPag><vPag>{total:.2f}</vPag></detPag></pag>'
+        f'</infNFe></NFe><protNFe versao="{versao}"><infProt><tpAmb>1</tpAmb><chNFe>{chave}</chNFe>'
+        f'<dhRecbto>{recibo:%Y-%m-%dT%H:%M:%S}-03:00</dhRecbto><nProt>3252{aleatorio.randrange(10 ** 11):011d}</nProt>'
+        f'<cStat>100</cStat><xMotivo>Autorizado o uso da NFC-e</xMotivo></infProt></protNFe></nfeProc>'
+    )
+    return chave, xml.encode("utf-8")
+
+def sortear_notas_por_zip(aleatorio, distribuicao, media, maximo):
+    if distribuicao == "fixa":
+        return media
+    if distribuicao == "uniforme":
+        return aleatorio.randint(1, 2 * media - 1)
+    # Lognormal com a média pedida: muitos ZIPs pequenos e alguns muito grandes
+    sigma = 1.0
+    return max(1, min(maximo, int(aleatorio.lognormvariate(math.log(media) - sigma ** 2 / 2, sigma))))
+
+def gravar_membro(arquivo_zip, nome, conteudo):
+    info = zipfile.ZipInfo(nome, date_time=DATA_ZIP)
+    info.compress_type = zipfile.ZIP_DEFLATED
+    info.external_attr = 0o644 << 16
+    arquivo_zip.writestr(info, conteudo)
+
+def gerar_corpus(diretorio, notas=10000, media_por_zip=500, distribuicao="lognormal", maximo_por_zip=20000,
+                 empresas=50, dias=30, media_itens=4, semente=0, proporcao_mista=0.05, proporcao_corrompida=0.05,
+                 proporcao_duplicadas=0.02, proporcao_leiaute_antigo=0.1):
+    """
+    Gera os ZIPs em `diretorio` até somar `notas` notas e grava o corpus.json.
+
+    Parâmetros:
+        notas (int): Total de notas válidas e distintas do corpus.
+        media_por_zip (int): Média de notas por ZIP.
+        distribuicao (str): "fixa", "uniforme" ou "lognormal" (notas por ZIP).
+        empresas (int): Quantidade de IEs emitentes.
+        dias (int): Janela de dias de emissão, terminando em ULTIMO_DIA.
+        media_itens (float): Média de itens (det) por nota.
+        proporcao_mista (float): Fração de ZIPs com algumas notas de outra IE.
+        proporcao_corrompida (float): Fração de ZIPs com membros corrompidos.
+        proporcao_duplicadas (float): Fração de notas repetidas de ZIPs anteriores.
+        proporcao_leiaute_antigo (float): Fração de notas com ide/dEmi em vez de dhEmi.
+
+    Retorna:
+        dict: Conteúdo do corpus.json.
+    """
+    aleatorio = random.Random(semente)
+    os.makedirs(diretorio, exist_ok=True)
+    emitentes = gerar_empresas(aleatorio, empresas)
+    geradas, entregues, manifesto_zips = 0, [], []
+    digest = hashlib.sha256()
+
+    while geradas < notas:
+        empresa = emitentes[aleatorio.randrange(len(emitentes))]
+        dia = ULTIMO_DIA - timedelta(days=aleatorio.randrange(dias))
+        quantidade = min(sortear_notas_por_zip(aleatorio, distribuicao, media_por_zip, maximo_por_zip), notas - geradas)
+        mista = aleatorio.random() < proporcao_mista
+        corrompida = aleatorio.random() < proporcao_corrompida
+        nome_zip = f"NFCE_XML_{empresa['ie']}_{dia:%Y%m%d}_{len(manifesto_zips):05d}.zip"
+        registro = {"arquivo": nome_zip, "ie": empresa["ie"], "dia": dia.strftime("%d/%m/%Y"), "notas": quantidade,
+                    "ies": [empresa["ie"]], "corrompidos": 0, "duplicadas": 0, "leiaute_antigo": 0}
+
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w") as arquivo_zip:
+            intrusa = emitentes[(emitentes.index(empresa) + 1) % len(emitentes)] if mista else None
+            for indice in range(quantidade):
+                emitente = intrusa if intrusa and indice % 10 == 0 else empresa
+                emissao = datetime(dia.year, dia.month, dia.day) + timedelta(seconds=aleatorio.randrange(6 * 3600, 23 * 3600))
+                antigo = aleatorio.random() < proporcao_leiaute_antigo
+                chave, conteudo = gerar_xml(aleatorio, emitente, emissao, media_itens, antigo)
+                gravar_membro(arquivo_zip, f"NFCE_{chave}.xml", conteudo)
+                registro["leiaute_antigo"] += antigo
+                if emitente is intrusa and intrusa["ie"] not in registro["ies"]:
+                    registro["ies"].append(intrusa["ie"])
+                # Amostragem por reservatório: memória constante em corpus grandes
+                if len(entregues) < AMOSTRA_REENVIOS:
+                    entregues.append((chave, conteudo))
+                elif (posicao := aleatorio.randrange(geradas + indice + 1)) < AMOSTRA_REENVIOS:
+                    entregues[posicao] = (chave, conteudo)
+
+            # Reentregas de notas de ZIPs anteriores (exercitam a deduplicação)
+            if manifesto_zips:
+                for _ in range(sum(aleatorio.random() < proporcao_duplicadas for _ in range(quantidade))):
+                    chave, conteudo = entregues[aleatorio.randrange(len(entregues))]
+                    gravar_membro(arquivo_zip, f"NFCE_{chave}_reenvio{registro['duplicadas']}.xml", conteudo)
+                    registro["duplicadas"] += 1
+
+            if corrompida:
+                chave, conteudo = gerar_xml(aleatorio, empresa, datetime(dia.year, dia.month, dia.day, 12), media_itens)
+                gravar_membro(arquivo_zip, f"NFCE_{chave}.xml", conteudo[:aleatorio.randrange(50, len(conteudo) - 20)])
+                gravar_membro(arquivo_zip, f"NFCE_{aleatorio.randrange(10 ** 12):012d}.xml", aleatorio.randbytes(aleatorio.randrange(64, 2048)))
+                registro["corrompidos"] += 2
+
+        conteudo_zip = buffer.getvalue()
+        with open(os.path.join(diretorio, nome_zip), "wb") as f:
+            f.write(conteudo_zip)
+        registro["bytes"] = len(conteudo_zip)
+        digest.update(nome_zip.encode("utf-8") + conteudo_zip)
+        manifesto_zips.append(registro)
+        geradas += quantidade
+
+    manifesto = {
+        "parametros": {"notas": notas, "media_por_zip": media_por_zip, "distribuicao": distribuicao, "maximo_por_zip": maximo_por_zip,
+                       "empresas": empresas, "dias": dias, "media_itens": media_itens, "semente": semente,
+                       "proporcao_mista": proporcao_mista, "proporcao_corrompida": proporcao_corrompida,
+                       "proporcao_duplicadas": proporcao_duplicadas, "proporcao_leiaute_antigo": proporcao_leiaute_antigo},
+        "zips": len(manifesto_zips),
+        "notas": geradas,
+        "bytes": sum(registro["bytes"] for registro in manifesto_zips),
+        "ies": sorted({ie for registro in manifesto_zips for ie in registro["ies"]}),
+        "sha256": digest.hexdigest(),
+        "arquivos": manifesto_zips,
+    }
+    with open(os.path.join(diretorio, "corpus.json"), "w", encoding="utf-8") as f:
+        json.dump(manifesto, f, ensure_ascii=False, indent=1)
+    return manifesto
+
+def criar_pastas_destino(diretorio_final, manifesto):
+    """Cria em `diretorio_final` uma pasta EMPRESA_SINTETICA_<IE> por IE do corpus"""
+    for ie in manifesto["ies"]:
+        os.makedirs(os.path.join(diretorio_final, f"EMPRESA_SINTETICA_{ie}"), exist_ok=True)
+
+def main():
+    argumentos = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    argumentos.add_argument("diretorio", help="onde gravar os ZIPs e o corpus.json")
+    argumentos.add_argument("--notas", type=int, default=10000, help="total de notas do corpus")
+    argumentos.add_argument("--media-por-zip", type=int, default=500)
+    argumentos.add_argument("--distribuicao", choices=["fixa", "uniforme", "lognormal"], default="lognormal")
+    argumentos.add_argument("--maximo-por-zip", type=int, default=20000)
+    argumentos.add_argument("--empresas", type=int, default=50)
+    argumentos.add_argument("--dias", type=int, default=30)
+    argumentos.add_argument("--media-itens", type=float, default=4)
+    argumentos.add_argument("--mista", type=float, default=0.05, help="fração de ZIPs com notas de outra IE")
+    argumentos.add_argument("--corrompida", type=float, default=0.05, help="fração de ZIPs com membros corrompidos")
+    argumentos.add_argument("--duplicadas", type=float, default=0.02, help="fração de notas reenviadas")
+    argumentos.add_argument("--leiaute-antigo", type=float, default=0.1, help="fração de notas com dEmi")
+    argumentos.add_argument("--semente", type=int, default=0)
+    argumentos.add_argument("--destino-final", help="cria também as pastas das empresas neste diretório")
+    opcoes = argumentos.parse_args()
+
+    manifesto = gerar_corpus(opcoes.diretorio, opcoes.notas, opcoes.media_por_zip, opcoes.distribuicao, opcoes.maximo_por_zip,
+                             opcoes.empresas, opcoes.dias, opcoes.media_itens, opcoes.semente, opcoes.mista,
+                             opcoes.corrompida, opcoes.duplicadas, opcoes.leiaute_antigo)
+    if opcoes.destino_final:
+        criar_pastas_destino(opcoes.destino_final, manifesto)
+    print(f"{manifesto['zips']} ZIPs, {manifesto['notas']} notas, {manifesto['bytes'] / (1024 * 1024):.1f} MB, "
+          f"{len(manifesto['ies'])} IEs em {opcoes.diretorio}")
+    print(f"SHA-256 do corpus: {manifesto['sha256']}")
+
+if __name__ == "__main__":
+    main()
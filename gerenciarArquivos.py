@@ -1,265 +1,4 @@
-import time, os, signal, sys
-from selenium.common.exceptions import TimeoutException
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support import expected_conditions as EC
-from dotenv import load_dotenv
-from loggingConfig import get_logger
-from utils import (
-    conectar_postgres,
-    iniciar_navegador_selenoid,
-    autenticar_sefaz,
-    acessar_pagina,
-    verificar_downloads_em_progresso,
-    clicar_elemento
-)
-
-load_dotenv()
-logger = get_logger(__name__)
-
-# Configuração do diretório de downloads
-DIRETORIO_DOWNLOADS = "/home/desenvolvimento/DownloadATF/NFCE_XML_TEMP/incoming"
-os.makedirs(DIRETORIO_DOWNLOADS, exist_ok=True)
-os.chmod(DIRETORIO_DOWNLOADS, 0o777)
-
-# Controle de execução
-RUNNING = True
-
-def configurar_tratamento_sinais():
-    """Configura o tratamento de sinais para finalização limpa"""
-    def handler_signal(signum, frame):
-        global RUNNING
-        logger.info(f"Sinal {signum} recebido. Preparando para encerrar serviço...")
-        RUNNING = False
-        logger.info("Serviço finalizado pelo usuário.")
-        sys.exit(0)
-
-    signal.signal(signal.SIGINT, handler_signal)
-    signal.signal(signal.SIGTERM, handler_signal)
-
-def obter_solicitacoes_com_link():
-    """Busca solicitações que têm link, anexo=true e ainda não foram baixadas"""
-    conexao = conectar_postgres()
-    if not conexao:
-        return []
-
-    try:
-        cursor = conexao.cursor()
-        cursor.execute("""
-            SELECT id, inscricao_estadual, link
-            FROM nfce.solicitacoes
-            WHERE link IS NOT NULL AND link != '' AND baixado = 0 AND tipo = 'NFCE' AND anexo = true
-            ORDER BY criado_em
-        """)
-
-        solicitacoes = []
-        for id, inscricao_estadual, link in cursor.fetchall():
-            solicitacoes.append({
-                "id": id,
-                "inscricao_estadual": inscricao_estadual,
-                "link": link
-            })
-
-        cursor.close()
-        conexao.close()
-
-        if solicitacoes:
-            logger.info(f"Encontradas {len(solicitacoes)} solicitações pendentes de download com anexo=true")
-        return solicitacoes
-
-    except Exception as erro:
-        logger.error(f"Erro ao buscar solicitações: {erro}")
-        if conexao:
-            conexao.close()
-        return []
-
-def marcar_como_baixado(id_solicitacao):
-    """Marca a solicitação como baixada no banco de dados"""
-    conexao = conectar_postgres()
-    if not conexao:
-        logger.error(f"Falha ao conectar ao PostgreSQL para marcar solicitação {id_solicitacao}")
-        return False
-
-    try:
-        cursor = conexao.cursor()
-        cursor.execute("""
-            UPDATE nfce.solicitacoes
-            SET baixado = baixado + 1,
-                atualizado_em = CURRENT_TIMESTAMP
-            WHERE id = %s
-        """, (id_solicitacao,))
-
-        conexao.commit()
-        cursor.close()
-        conexao.close()
-
-        logger.info(f"Solicitação {id_solicitacao} marcada como baixada com sucesso")
-        return True
-
-    except Exception as erro:
-        logger.error(f"Erro ao marcar solicitação {id_solicitacao} como baixada: {erro}")
-        if conexao:
-            conexao.rollback()
-            conexao.close()
-        return False
-
-def realizar_download(navegador, solicitacao):
-    """Acessa o link e inicia o download do arquivo"""
-    try:
-        logger.info(f"Iniciando download para IE {solicitacao['inscricao_estadual']} (ID: {solicitacao['id']})")
-
-        # Acessa o link para download
-        acessar_pagina(navegador, solicitacao["link"])
-
-        # Clica nos elementos de download
-        espera_curta = int(os.environ.get("ESPERA_CURTA", 2))
-        if clicar_elemento(navegador, os.environ.get("XPATH_IMAGEM_ANEXO"), espera_curta) and \
-           clicar_elemento(navegador, os.environ.get("XPATH_LINK_DOWNLOAD"), espera_curta):
-            logger.info(f"Download iniciado para IE {solicitacao['inscricao_estadual']} (ID: {solicitacao['id']})")
-            time.sleep(10)
-            return True
-        else:
-            logger.error(f"Falha ao clicar nos elementos para download - IE {solicitacao['inscricao_estadual']} (ID: {solicitacao['id']})")
-            return False
-    except Exception as e:
-        logger.error(f"Erro ao realizar download para IE {solicitacao['inscricao_estadual']} (ID: {solicitacao['id']}): {str(e)}")
-        return False
-
-def processar_downloads():
-    """Processa todos os downloads pendentes"""
-    # Verificar permissões do diretório
-    try:
-        test_file_path = os.path.join(DIRETORIO_DOWNLOADS, "test_write_permission.tmp")
-        with open(test_file_path, 'w') as f:
-            f.write("Teste de permissão de escrita")
-        os.remove(test_file_path)
-    except Exception as e:
-        logger.error(f"ERRO DE PERMISSÃO no diretório {DIRETORIO_DOWNLOADS}: {str(e)}")
-        return 0
-
-    # Carrega as solicitações pendentes de download
-    solicitacoes = obter_solicitacoes_com_link()
-
-    if not solicitacoes:
-        return 0
-
-    navegador = None
-    downloads_realizados = 0
-    total_solicitacoes = len(solicitacoes)
-
-    try:
-        # Inicia o navegador com Selenoid
-        logger.info(f"Iniciando navegador para processar {total_solicitacoes} downloads...")
-        navegador = iniciar_navegador_selenoid(DIRETORIO_DOWNLOADS)
-
-        if navegador and autenticar_sefaz(navegador):
-            logger.info("Navegador inicializado e autenticado com sucesso")
-
-            # Processa cada solicitação com link disponível
-            for i, solicitacao in enumerate(solicitacoes, 1):
-                # Log de progresso menos frequente
-                if i == 1 or i == total_solicitacoes or i % 10 == 0:
-                    logger.info(f"Processando solicitação {i}/{total_solicitacoes}")
-
-                if realizar_download(navegador, solicitacao):
-                    if marcar_como_baixado(solicitacao["id"]):
-                        downloads_realizados += 1
-                    else:
-                        logger.warning(f"Download realizado mas falha ao marcar como baixado: ID {solicitacao['id']}")
-
-                # Espera entre os downloads
-                time.sleep(5)
-
-            logger.info(f"Downloads concluídos: {downloads_realizados}/{total_solicitacoes}")
-        else:
-            logger.error("Falha na autenticação ou inicialização do navegador")
-
-    except Exception as e:
-        logger.error(f"Erro durante a execução dos downloads: {str(e)}")
-    finally:
-        # Aguarda downloads em andamento concluírem
-        max_tentativas = int(os.environ.get("MAX_TENTATIVAS", 10))
-        tentativa = 0
-
-        while verificar_downloads_em_progresso(DIRETORIO_DOWNLOADS) and tentativa < max_tentativas:
-            logger.debug(f"Aguardando conclusão de downloads em progresso... (tentativa {tentativa+1}/{max_tentativas})")
-            time.sleep(2)
-            tentativa += 1
-
-        if navegador:
-            try:
-                navegador.quit()
-                logger.info("Navegador fechado com sucesso")
-            except Exception as e:
-                logger.warning(f"Erro ao fechar navegador: {str(e)}")
-
-        try:
-            arquivos = os.listdir(DIRETORIO_DOWNLOADS)
-            logger.info(f"Total de {len(arquivos)} arquivos no diretório de download")
-        except Exception as e:
-            logger.error(f"Erro ao listar arquivos: {str(e)}")
-
-    return downloads_realizados
-
-def monitorar_downloads_continuamente():
-    """Função principal que monitora continuamente as solicitações para download"""
-    global RUNNING
-
-    execucao_id = f"DOWNLOAD-{time.strftime('%Y%m%d-%H%M%S')}"
-    logger.info(f"=" * 50)
-    logger.info(f"INICIANDO SERVIÇO DE MONITORAMENTO DE DOWNLOADS ({execucao_id})")
-    logger.info(f"=" * 50)
-
-    configurar_tratamento_sinais()
-
-    intervalo_verificacao = int(os.environ.get("INTERVALO_VERIFICACAO", 60))
-    ultimo_log_sem_downloads = 0
-    intervalo_min_log_sem_downloads = 300  # 5 minutos
-
-    while RUNNING:
-        try:
-            # Verifica se há solicitações com links para baixar
-            solicitacoes = obter_solicitacoes_com_link()
-
-            if not solicitacoes:
-                # Log periódico sobre ausência de downloads
-                agora = time.time()
-                if agora - ultimo_log_sem_downloads > intervalo_min_log_sem_downloads:
-                    logger.info("Não há solicitações pendentes para download. Aguardando...")
-                    ultimo_log_sem_downloads = agora
-
-                # Aguarda antes de verificar novamente
-                time.sleep(intervalo_verificacao)
-                continue
-
-            # Se há solicitações, processa os downloads
-            downloads_realizados = processar_downloads()
-
-            if downloads_realizados > 0:
-                logger.info(f"{downloads_realizados} downloads processados com sucesso")
-                time.sleep(5)
-            else:
-                time.sleep(intervalo_verificacao)
-
-        except Exception as e:
-            logger.error(f"Erro durante o monitoramento de downloads: {e}")
-            time.sleep(30)
-
-    logger.info("Serviço de monitoramento de downloads encerrado normalmente")
-
-if __name__ == "__main__":
-    try:
-        monitorar_downloads_continuamente()
-    except KeyboardInterrupt:
-        logger.info("Serviço de monitoramento de downloads interrompido pelo usuário")
-        sys.exit(0)
-    except Exception as e:
-        logger.critical(f"Erro fatal no serviço de monitoramento de downloads: {str(e)}")
-        sys.exit(1)
-desenvolvimento@srvms02:~/DownloadATF$ ls
-logs  NFCE_XML_TEMP  venv  atualizacaoManual.py  baixarArquivos.py  gerenciarArquivos.py  localizarLinks.py  loggingConfig.py  solicitarXmls.py  solicitarXmlsFalhos.py  startList.py  utils.py
-desenvolvimento@srvms02:~/DownloadATF$ cat gerenciarArquivos.py
-import os, re, shutil, time, json, uuid, zipfile, signal, sys
+import os, re, shutil, time, json, uuid, zipfile, signal, sys, sqlite3, hashlib, threading, queue
 from watchdog.events import FileSystemEventHandler
 from watchdog.observers import Observer
 import xml.etree.ElementTree as ET
@@ -268,7 +7,10 @@ from datetime import datetime
 from dateutil import parser
 import mysql.connector
 from dotenv import load_dotenv
-from loggingConfig import get_logger
+from loggingConfig import get_logger, log_amostrado, resumir_amostras
+from utils import conectar_postgres
+import metricas
+import perfilProcesso
 
 # Carregar variáveis de ambiente
 load_dotenv()
@@ -300,6 +42,31 @@ def obter_diretorio_execucao():
     else:
         return os.path.dirname(os.path.abspath(__file__))
 
+def gravar_arquivo_atomico(caminho, conteudo, sincronizar=True):
+    """
+    Grava o arquivo por meio de um temporário no mesmo diretório e os.replace.
+
+    Uma interrupção no meio da gravação deixa apenas o temporário oculto, nunca
+    um arquivo truncado no caminho final. Com sincronizar=True o conteúdo é
+    enviado ao disco (fsync) antes da troca de nomes.
+    """
+    diretorio, nome = os.path.split(caminho)
+    temporario = os.path.join(diretorio, f".{nome}.{os.getpid()}.tmp")
+    with open(temporario, 'wb') as f:
+        f.write(conteudo)
+        if sincronizar:
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(temporario, caminho)
+
+def sincronizar_diretorio(diretorio):
+    """Envia ao disco as entradas do diretório (criações e renomeações)"""
+    fd = os.open(diretorio, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
 # Diretórios
 DIRETORIO_EXECUCAO = os.environ.get("DIRETORIO_EXECUCAO") or obter_diretorio_execucao()
 DIRETORIO_BASE = os.path.join(DIRETORIO_EXECUCAO, "NFCE_XML_TEMP")
@@ -309,9 +76,23 @@ DIRETORIO_FINAL = os.environ.get("DIRETORIO_FINAL")
 ESTRUTURA_DIRETORIOS = {
     "incoming": os.environ.get("DIRETORIO_DOWNLOADS") or os.path.join(DIRETORIO_BASE, "incoming"),
     "processing": os.path.join(DIRETORIO_BASE, "processing"),
-    "failed": os.path.join(DIRETORIO_BASE, "failed")
+    "failed": os.path.join(DIRETORIO_BASE, "failed"),
+    "catalogo": os.path.join(DIRETORIO_BASE, "catalogo")
 }
 
+# Índice das notas já armazenadas no destino final, usado para deduplicação entre jobs
+ARQUIVO_INDICE_NOTAS = os.environ.get("ARQUIVO_INDICE_NOTAS") or os.path.join(DIRETORIO_BASE, "indice_notas.db")
+MODO_DEDUPLICACAO = os.environ.get("MODO_DEDUPLICACAO", "ignorar").lower()  # "ignorar" ou "hardlink"
+PADRAO_CHAVE_ACESSO = re.compile(rb'Id="NFe(\d{44})"')
+
+# Catálogo de notas (nfce.notas): linhas extraídas na análise e carregadas via COPY por job
+ARQUIVO_NOTAS_JOB = "notas.tsv"
+PADRAO_VALOR = re.compile(r'^\d{1,13}(\.\d{1,2})?$')
+
+# Journal SQLite com o estado dos jobs de processamento
+ARQUIVO_JOURNAL_JOBS = os.environ.get("ARQUIVO_JOURNAL_JOBS") or os.path.join(DIRETORIO_BASE, "journal_jobs.db")
+LOTE_JOURNAL = int(os.environ.get("LOTE_JOURNAL", 20))
+
 # Estados possíveis de processamento
 ESTADOS = {
     "INIT": "Inicializado",
@@ -325,10 +106,25 @@ ESTADOS = {
     "FAILED": "Processamento falhou"
 }
 
+# Estados gravados imediatamente no journal: os demais são agrupados no próximo commit
+ESTADOS_CONFIRMACAO_IMEDIATA = {"INIT", "MOVING", "COMPLETED", "FAILED"}
+# Estados finais não passam pela amostragem de log: são o rastro de cada job na recuperação
+ESTADOS_FINAIS = {"COMPLETED", "FAILED"}
+
 # Controle de processamento
 running = True
 ultimo_heartbeat = time.time()
 INTERVALO_HEARTBEAT = int(os.environ.get("INTERVALO_HEARTBEAT", 3600))  # 1 hora por padrão
+INTERVALO_RECONCILIACAO = int(os.environ.get("INTERVALO_RECONCILIACAO", 30))
+INTERVALO_RESULTADOS = int(os.environ.get("INTERVALO_RESULTADOS", 30))
+LOTE_RESULTADOS = int(os.environ.get("LOTE_RESULTADOS", 500))
+
+# Fila de arquivos prontos para processamento, alimentada pelo observador e pela reconciliação
+fila_trabalho = queue.Queue()
+fila_lock = threading.Lock()
+arquivos_enfileirados = set()
+arquivos_aguardando = {}   # nome -> (tamanho, mtime) de arquivos ainda incompletos
+arquivos_rejeitados = {}   # nome -> (tamanho, mtime) de arquivos cujo processamento falhou
 
 # ============================================
 # DATABASE FUNCTIONS
@@ -367,6 +163,164 @@ def listar_empresas():
     logger.error("Falha ao conectar ao banco de dados")
     return []
 
+def registrar_resultado_job(job_dir, state_data, destino_final):
+    """Guarda no journal o resultado do job para posterior envio a nfce.solicitacoes"""
+    with journal_lock:
+        abrir_journal().execute(
+            "INSERT OR REPLACE INTO resultados (job_id, arquivo_original, caminho_final, notas_por_dia, enviado, criado_em) VALUES (?, ?, ?, ?, 0, ?)",
+            (os.path.basename(job_dir), state_data.get("arquivo_original"), destino_final,
+             json.dumps(state_data.get("notas_por_dia", {})), datetime.now().isoformat())
+        )
+
+def enviar_resultados_banco(limite=None):
+    """
+    Envia os resultados pendentes para nfce.solicitacoes em uma única transação.
+
+    Cada (IE, dia) com notas no ZIP finaliza a solicitação correspondente,
+    registrando quantidade de notas, bytes e caminho final. A solicitação cujo
+    arquivo baixado é o próprio ZIP também é finalizada, mesmo sem notas no dia.
+
+    Retorna:
+        int: Quantidade de resultados enviados.
+    """
+    with journal_lock:
+        pendentes = abrir_journal().execute(
+            "SELECT job_id, arquivo_original, caminho_final, notas_por_dia FROM resultados WHERE enviado = 0 ORDER BY criado_em LIMIT ?",
+            (limite or LOTE_RESULTADOS,)
+        ).fetchall()
+
+    if not pendentes:
+        return 0
+
+    atualizacoes_dia = []
+    atualizacoes_arquivo = []
+    for _, arquivo_original, caminho_final, notas_por_dia in pendentes:
+        for chave, (quantidade, tamanho) in json.loads(notas_por_dia).items():
+            ie, data = chave.split("|", 1)
+            atualizacoes_dia.append((quantidade, tamanho, caminho_final, ie, data))
+        if arquivo_original:
+            atualizacoes_arquivo.append((caminho_final, arquivo_original))
+
+    conexao = conectar_postgres()
+    if not conexao:
+        logger.error(f"Falha ao conectar ao PostgreSQL. {len(pendentes)} resultados aguardando envio")
+        return 0
+
+    try:
+        cursor = conexao.cursor()
+        cursor.executemany("""
+            UPDATE nfce.solicitacoes
+            SET finalizado = TRUE, qtd_notas = %s, bytes_notas = %s, caminho_final = %s,
+                atualizado_em = CURRENT_TIMESTAMP
+            WHERE inscricao_estadual = %s AND data_ini = %s AND tipo = 'NFCE' AND NOT finalizado
+        """, atualizacoes_dia)
+        cursor.executemany("""
+            UPDATE nfce.solicitacoes
+            SET finalizado = TRUE, caminho_final = COALESCE(caminho_final, %s),
+                atualizado_em = CURRENT_TIMESTAMP
+            WHERE arquivo = %s AND tipo = 'NFCE' AND NOT finalizado
+        """, atualizacoes_arquivo)
+        conexao.commit()
+        cursor.close()
+        conexao.close()
+    except Exception as erro:
+        logger.error(f"Erro ao registrar resultados em nfce.solicitacoes: {erro}")
+        conexao.rollback()
+        conexao.close()
+        return 0
+
+    with journal_lock:
+        conexao_journal = abrir_journal()
+        conexao_journal.executemany(
+            "UPDATE resultados SET enviado = 1 WHERE job_id = ?", [(job_id,) for job_id, *_ in pendentes]
+        )
+        conexao_journal.commit()
+
+    logger.info(f"{len(pendentes)} resultados de ingestão registrados em nfce.solicitacoes ({len(atualizacoes_dia)} empresa-dias)")
+    return len(pendentes)
+
+def formatar_linha_copy(valores):
+    """Formata uma linha no formato texto do COPY (tabulações, \\N para nulos)"""
+    campos = []
+    for valor in valores:
+        if valor is None:
+            campos.append("\\N")
+        else:
+            campos.append(str(valor).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r"))
+    return "\t".join(campos) + "\n"
+
+def registrar_catalogo_job(job_dir, caminhos):
+    """
+    Grava na pasta catalogo as notas do job com o caminho onde ficaram armazenadas.
+
+    O arquivo sobrevive à remoção do job e é carregado em nfce.notas por
+    enviar_catalogo_notas, um COPY por job.
+    """
+    job_id = os.path.basename(job_dir)
+    arquivo_notas = os.path.join(job_dir, ARQUIVO_NOTAS_JOB)
+    if not os.path.exists(arquivo_notas):
+        logger.warning(f"Job {job_id} sem {ARQUIVO_NOTAS_JOB}; notas não serão catalogadas")
+        return
+
+    linhas = []
+    with open(arquivo_notas, 'r', encoding='utf-8') as f:
+        for linha in f:
+            arquivo, *dados = linha.rstrip("\n").split("\t")
+            caminho = caminhos.get(arquivo)
+            if caminho:
+                linhas.append("\t".join(dados) + "\t" + formatar_linha_copy((caminho, job_id)))
+
+    if linhas:
+        gravar_arquivo_atomico(os.path.join(ESTRUTURA_DIRETORIOS["catalogo"], f"{job_id}.tsv"), "".join(linhas).encode('utf-8'))
+
+def enviar_catalogo_notas():
+    """
+    Carrega em nfce.notas os arquivos pendentes da pasta catalogo.
+
+    Cada arquivo (um job) é copiado via COPY para uma tabela temporária e inserido
+    ignorando chaves já catalogadas; o arquivo só é removido após o commit.
+
+    Retorna:
+        int: Quantidade de notas inseridas.
+    """
+    diretorio = ESTRUTURA_DIRETORIOS["catalogo"]
+    if not os.path.isdir(diretorio):
+        return 0
+    pendentes = sorted(entrada.path for entrada in os.scandir(diretorio) if entrada.name.endswith('.tsv'))
+    if not pendentes:
+        return 0
+
+    conexao = conectar_postgres()
+    if not conexao:
+        logger.error(f"Falha ao conectar ao PostgreSQL. {len(pendentes)} jobs aguardando catalogação")
+        return 0
+
+    inseridas = 0
+    caminho = None
+    try:
+        cursor = conexao.cursor()
+        # Com o pool do orquestrador a sessão é reaproveitada e a tabela temporária pode já existir nela
+        cursor.execute("CREATE TEMP TABLE IF NOT EXISTS notas_carga (LIKE nfce.notas INCLUDING DEFAULTS) ON COMMIT DELETE ROWS")
+        for caminho in pendentes:
+            with open(caminho, 'r', encoding='utf-8') as f:
+                cursor.copy_expert(
+                    "COPY notas_carga (chave, inscricao_estadual, cnpj, dh_emi, valor_total, caminho, job_id) FROM STDIN", f
+                )
+            cursor.execute("INSERT INTO nfce.notas SELECT * FROM notas_carga ON CONFLICT (chave) DO NOTHING")
+            inseridas += cursor.rowcount
+            conexao.commit()
+            os.remove(caminho)
+        cursor.close()
+        conexao.close()
+    except Exception as erro:
+        logger.error(f"Erro ao carregar catálogo de notas ({os.path.basename(caminho or diretorio)}): {erro}")
+        conexao.rollback()
+        conexao.close()
+        return inseridas
+
+    logger.info(f"{inseridas} notas catalogadas em nfce.notas a partir de {len(pendentes)} jobs")
+    return inseridas
+
 # ============================================
 # XML FUNCTIONS
 # ============================================
@@ -407,6 +361,43 @@ def extrair_dado_xml(xml_path, tipo):
         logger.error(f"Erro ao processar o XML {xml_path}: {e}")
         return None
 
+def extrair_dados_nota(xml_path):
+    """
+    Extrai em uma única leitura os dados da nota usados na análise e no catálogo.
+
+    Retorna:
+        dict: chave, ie, cnpj, data_emissao (datetime) e valor_total (str); campos
+        não encontrados ficam como None.
+    """
+    root = ET.parse(xml_path).getroot()
+    namespace = {'nfe': 'http://www.portalfiscal.inf.br/nfe'}
+
+    def texto(caminho):
+        elemento = root.find(caminho, namespace)
+        return elemento.text.strip() if elemento is not None and elemento.text else None
+
+    inf_nfe = root.find('.//nfe:infNFe', namespace)
+    identificador = inf_nfe.get('Id', '') if inf_nfe is not None else ''
+    chave = identificador[3:] if re.fullmatch(r'NFe\d{44}', identificador) else None
+
+    dh_emi = texto('.//nfe:ide/nfe:dhEmi')
+    d_emi = texto('.//nfe:ide/nfe:dEmi')
+    if dh_emi:
+        data_emissao = parser.isoparse(dh_emi)
+    elif d_emi:
+        data_emissao = parser.parse(d_emi)
+    else:
+        data_emissao = None
+
+    valor_total = texto('.//nfe:total/nfe:ICMSTot/nfe:vNF')
+    return {
+        "chave": chave,
+        "ie": texto('.//nfe:emit/nfe:IE'),
+        "cnpj": texto('.//nfe:emit/nfe:CNPJ'),
+        "data_emissao": data_emissao,
+        "valor_total": valor_total if valor_total and PADRAO_VALOR.match(valor_total) else None
+    }
+
 # ============================================
 # DIRECTORY MANAGEMENT
 # ============================================
@@ -421,39 +412,6 @@ def gerar_id_job():
     """Gera um ID único para o job de processamento"""
     return f"job_{uuid.uuid4().hex[:10]}_{int(time.time())}"
 
-def atualizar_estado(job_dir, estado, dados_adicionais=None):
-    """Atualiza o estado de um job de processamento"""
-    state_file = os.path.join(job_dir, ".state")
-
-    state_data = {
-        "estado": estado,
-        "descricao": ESTADOS.get(estado, "Estado desconhecido"),
-        "timestamp": datetime.now().isoformat(),
-    }
-
-    if dados_adicionais:
-        state_data.update(dados_adicionais)
-
-    with open(state_file, 'w') as f:
-        json.dump(state_data, f, indent=2)
-
-    logger.info(f"Estado do job {os.path.basename(job_dir)} atualizado para: {estado}")
-
-def ler_estado(job_dir):
-    """Lê o estado atual de um job de processamento"""
-    state_file = os.path.join(job_dir, ".state")
-
-    if not os.path.exists(state_file):
-        return None
-
-    try:
-        with open(state_file, 'r') as f:
-            state_data = json.load(f)
-        return state_data
-    except Exception as e:
-        logger.error(f"Erro ao ler estado do job {os.path.basename(job_dir)}: {e}")
-        return None
-
 def mover_para_falhas(job_dir, motivo):
     """Move um job falho para o diretório de falhas"""
     job_id = os.path.basename(job_dir)
@@ -469,8 +427,192 @@ def mover_para_falhas(job_dir, motivo):
 
     # Mover pasta
     shutil.move(job_dir, destino)
+    desativar_job(job_dir)
     logger.info(f"Job {job_id} movido para falhas. Motivo: {motivo}")
 
+# ============================================
+# JOB JOURNAL
+# ============================================
+
+journal_conexao = None
+journal_lock = threading.Lock()
+journal_pendentes = 0
+
+def abrir_journal():
+    """Abre o journal de jobs (WAL), criando a tabela e importando estados legados se necessário"""
+    global journal_conexao
+    if journal_conexao is not None:
+        return journal_conexao
+
+    os.makedirs(os.path.dirname(ARQUIVO_JOURNAL_JOBS), exist_ok=True)
+    conexao = sqlite3.connect(ARQUIVO_JOURNAL_JOBS, check_same_thread=False)
+    conexao.execute("PRAGMA journal_mode=WAL")
+    # FULL: cada commit chega ao disco antes de apagar ou mover o diretório do job
+    conexao.execute("PRAGMA synchronous=FULL")
+
+    novo_journal = conexao.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'jobs'"
+    ).fetchone() is None
+
+    conexao.execute("""
+        CREATE TABLE IF NOT EXISTS jobs (
+            job_id TEXT PRIMARY KEY,
+            estado TEXT NOT NULL,
+            descricao TEXT,
+            dados TEXT NOT NULL DEFAULT '{}',
+            ativo INTEGER NOT NULL DEFAULT 1,
+            criado_em TEXT NOT NULL,
+            atualizado_em TEXT NOT NULL
+        )
+    """)
+    conexao.execute("CREATE INDEX IF NOT EXISTS idx_jobs_ativos ON jobs(estado) WHERE ativo = 1")
+    # Resultados de jobs concluídos ainda não enviados para nfce.solicitacoes
+    conexao.execute("""
+        CREATE TABLE IF NOT EXISTS resultados (
+            job_id TEXT PRIMARY KEY,
+            arquivo_original TEXT,
+            caminho_final TEXT NOT NULL,
+            notas_por_dia TEXT NOT NULL,
+            enviado INTEGER NOT NULL DEFAULT 0,
+            criado_em TEXT NOT NULL
+        )
+    """)
+    conexao.execute("CREATE INDEX IF NOT EXISTS idx_resultados_pendentes ON resultados(criado_em) WHERE enviado = 0")
+    conexao.commit()
+
+    journal_conexao = conexao
+    if novo_journal:
+        importar_estados_legados(conexao)
+    return conexao
+
+def importar_estados_legados(conexao):
+    """Importa para o journal os arquivos .state de jobs criados antes dele existir"""
+    processing_dir = ESTRUTURA_DIRETORIOS["processing"]
+    if not os.path.isdir(processing_dir):
+        return
+
+    importados = 0
+    for job_id in os.listdir(processing_dir):
+        state_file = os.path.join(processing_dir, job_id, ".state")
+        if not os.path.isfile(state_file):
+            continue
+        try:
+            with open(state_file, 'r') as f:
+                state_data = json.load(f)
+        except Exception as e:
+            logger.warning(f"Estado legado ilegível para job {job_id}: {e}")
+            state_data = {"estado": "INIT"}
+
+        estado = state_data.pop("estado", "INIT")
+        state_data.pop("descricao", None)
+        timestamp = state_data.pop("timestamp", datetime.now().isoformat())
+        conexao.execute(
+            "INSERT OR IGNORE INTO jobs (job_id, estado, descricao, dados, ativo, criado_em, atualizado_em) VALUES (?, ?, ?, ?, 1, ?, ?)",
+            (job_id, estado, ESTADOS.get(estado, "Estado desconhecido"), json.dumps(state_data), timestamp, timestamp)
+        )
+        importados += 1
+
+    conexao.commit()
+    if importados:
+        logger.info(f"{importados} estados legados (.state) importados para o journal")
+
+def confirmar_journal():
+    """Grava no disco as transições de estado pendentes"""
+    global journal_pendentes
+    with journal_lock:
+        if journal_conexao is not None and journal_pendentes:
+            journal_conexao.commit()
+            journal_pendentes = 0
+
+def fechar_journal():
+    """Confirma as transições pendentes e fecha o journal"""
+    global journal_conexao
+    confirmar_journal()
+    with journal_lock:
+        if journal_conexao is not None:
+            journal_conexao.close()
+            journal_conexao = None
+
+def atualizar_estado(job_dir, estado, dados_adicionais=None):
+    """
+    Atualiza o estado de um job de processamento no journal.
+
+    Os dados adicionais são mesclados aos já registrados para o job. Estados
+    intermediários são confirmados em lote; INIT, MOVING, COMPLETED e FAILED
+    são confirmados imediatamente, pois precedem operações irreversíveis.
+    """
+    global journal_pendentes
+    job_id = os.path.basename(job_dir)
+    agora = datetime.now().isoformat()
+
+    with journal_lock:
+        conexao = abrir_journal()
+        linha = conexao.execute("SELECT dados FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        dados = json.loads(linha[0]) if linha else {}
+        if dados_adicionais:
+            dados.update(dados_adicionais)
+
+        conexao.execute("""
+            INSERT INTO jobs (job_id, estado, descricao, dados, ativo, criado_em, atualizado_em)
+            VALUES (?, ?, ?, ?, 1, ?, ?)
+            ON CONFLICT(job_id) DO UPDATE SET
+                estado = excluded.estado,
+                descricao = excluded.descricao,
+                dados = excluded.dados,
+                atualizado_em = excluded.atualizado_em
+        """, (job_id, estado, ESTADOS.get(estado, "Estado desconhecido"), json.dumps(dados), agora, agora))
+
+        journal_pendentes += 1
+        if estado in ESTADOS_CONFIRMACAO_IMEDIATA or journal_pendentes >= LOTE_JOURNAL:
+            conexao.commit()
+            journal_pendentes = 0
+
+    if estado in ESTADOS_FINAIS:
+        logger.info(f"Estado do job {job_id} atualizado para: {estado}")
+    else:
+        log_amostrado(logger, f"estado_job:{estado}", "Estado do job %s atualizado para: %s", job_id, estado)
+
+def desativar_job(job_dir):
+    """Marca o job como encerrado, retirando-o da recuperação na inicialização"""
+    global journal_pendentes
+    with journal_lock:
+        conexao = abrir_journal()
+        conexao.execute(
+            "UPDATE jobs SET ativo = 0, atualizado_em = ? WHERE job_id = ?",
+            (datetime.now().isoformat(), os.path.basename(job_dir))
+        )
+        conexao.commit()
+        journal_pendentes = 0
+
+def ler_estado(job_dir):
+    """Lê o estado atual de um job de processamento"""
+    job_id = os.path.basename(job_dir)
+
+    try:
+        with journal_lock:
+            linha = abrir_journal().execute(
+                "SELECT estado, descricao, dados, atualizado_em FROM jobs WHERE job_id = ?", (job_id,)
+            ).fetchone()
+    except Exception as e:
+        logger.error(f"Erro ao ler estado do job {job_id}: {e}")
+        return None
+
+    if not linha:
+        return None
+
+    estado, descricao, dados, atualizado_em = linha
+    state_data = json.loads(dados)
+    state_data.update({"estado": estado, "descricao": descricao, "timestamp": atualizado_em})
+    return state_data
+
+def listar_jobs_ativos():
+    """Retorna os IDs dos jobs ainda não encerrados, em ordem de criação"""
+    with journal_lock:
+        linhas = abrir_journal().execute(
+            "SELECT job_id FROM jobs WHERE ativo = 1 ORDER BY criado_em"
+        ).fetchall()
+    return [job_id for (job_id,) in linhas]
+
 # ============================================
 # RECOVERY FUNCTIONS
 # ============================================
@@ -479,8 +621,7 @@ def verificar_processamentos_pendentes():
     """Verifica e recupera processamentos interrompidos na inicialização"""
     processing_dir = ESTRUTURA_DIRETORIOS["processing"]
 
-    jobs = [d for d in os.listdir(processing_dir)
-            if os.path.isdir(os.path.join(processing_dir, d))]
+    jobs = listar_jobs_ativos()
 
     if not jobs:
         logger.info("Nenhum processamento pendente encontrado")
@@ -490,10 +631,16 @@ def verificar_processamentos_pendentes():
 
     for job_id in jobs:
         job_dir = os.path.join(processing_dir, job_id)
+
+        if not os.path.isdir(job_dir):
+            logger.warning(f"Diretório do job {job_id} não existe mais. Encerrando no journal...")
+            desativar_job(job_dir)
+            continue
+
         state_data = ler_estado(job_dir)
 
         if not state_data:
-            logger.warning(f"Job {job_id} não possui arquivo de estado válido. Movendo para falhas...")
+            logger.warning(f"Job {job_id} não possui estado válido. Movendo para falhas...")
             mover_para_falhas(job_dir, "sem_estado_valido")
             continue
 
@@ -566,6 +713,9 @@ def criar_job_processamento(arquivo_zip):
     # Criar diretório do job
     job_id = gerar_id_job()
     job_dir = os.path.join(ESTRUTURA_DIRETORIOS["processing"], job_id)
+
+    # Registrar o job antes de criar o diretório: a recuperação parte do journal
+    atualizar_estado(job_dir, "INIT", {"arquivo_original": arquivo_zip})
     os.makedirs(job_dir, exist_ok=True)
 
     # Criar diretório de extração
@@ -577,9 +727,6 @@ def criar_job_processamento(arquivo_zip):
     zip_destino = os.path.join(job_dir, arquivo_zip)
     shutil.copy2(zip_origem, zip_destino)
 
-    # Inicializar estado
-    atualizar_estado(job_dir, "INIT", {"arquivo_original": arquivo_zip})
-
     logger.info(f"Job de processamento {job_id} criado para o arquivo {arquivo_zip}")
     return job_dir
 
@@ -596,6 +743,7 @@ def finalizar_job(job_dir):
     # Remover o diretório do job
     try:
         shutil.rmtree(job_dir)
+        desativar_job(job_dir)
         logger.info(f"Job {job_id} removido após processamento bem-sucedido")
     except Exception as e:
         logger.error(f"Erro ao remover job {job_id}: {e}")
@@ -625,9 +773,8 @@ def processar_zip(zip_file_path, job_dir):
                         base_name, ext = os.path.splitext(caminho_extraido)
                         caminho_extraido = f"{base_name}_{int(time.time())}{ext}"
 
-                    # Extrair o arquivo
-                    with open(caminho_extraido, 'wb') as f:
-                        f.write(zip_ref.read(item))
+                    # Extrair o arquivo (o ZIP continua sendo a origem, então dispensa fsync)
+                    gravar_arquivo_atomico(caminho_extraido, zip_ref.read(item), sincronizar=False)
 
         # Verificar se extraiu algum arquivo
         arquivos_xml = [f for f in os.listdir(extracted_dir) if f.endswith('.xml')]
@@ -636,6 +783,7 @@ def processar_zip(zip_file_path, job_dir):
             return False
 
         # Atualizar estado
+        metricas.INGESTAO_XMLS.incrementar(len(arquivos_xml))
         atualizar_estado(job_dir, "EXTRACTED", {"qtd_xmls": len(arquivos_xml)})
 
         # Continuar processamento - analisar e renomear
@@ -669,19 +817,33 @@ def analisar_e_renomear(job_dir):
         # Extrair dados dos XMLs
         datas = []
         ies = set()
+        notas_por_dia = {}  # "IE|DD/MM/AAAA" -> [quantidade, bytes]
+        linhas_catalogo = []
 
         for xml_file in arquivos_xml:
             xml_path = os.path.join(extracted_dir, xml_file)
             logger.debug(f"Extraindo dados do XML: {xml_file}")
 
             try:
-                ie_empresa = extrair_dado_xml(xml_path, "ie")
-                data_emissao = extrair_dado_xml(xml_path, "data")
+                dados_nota = extrair_dados_nota(xml_path)
+                ie_empresa = dados_nota["ie"]
+                data_emissao = dados_nota["data_emissao"]
 
                 if data_emissao:
-                    datas.append(data_emissao)
+                    # dhEmi traz fuso e dEmi (leiaute antigo) não: compara pelo horário local da nota
+                    datas.append(data_emissao.replace(tzinfo=None))
                 if ie_empresa:
                     ies.add(ie_empresa)
+                if ie_empresa and data_emissao:
+                    # Mesmo formato de data usado em nfce.solicitacoes
+                    contagem = notas_por_dia.setdefault(f"{ie_empresa}|{data_emissao.strftime('%d/%m/%Y')}", [0, 0])
+                    contagem[0] += 1
+                    contagem[1] += os.path.getsize(xml_path)
+                if dados_nota["chave"]:
+                    linhas_catalogo.append((
+                        xml_file, dados_nota["chave"], ie_empresa, dados_nota["cnpj"],
+                        data_emissao.isoformat() if data_emissao else None, dados_nota["valor_total"]
+                    ))
             except Exception as e:
                 logger.warning(f"Erro ao extrair dados do XML {xml_file}: {e}")
                 # Continuar com os outros arquivos, não falhar o job inteiro
@@ -698,12 +860,20 @@ def analisar_e_renomear(job_dir):
         else:
             novo_nome = f"{data_ini}_{data_fim}_{next(iter(ies), 'SEM_IE')}"
 
+        # Linhas do catálogo, completadas com o caminho final depois da cópia
+        gravar_arquivo_atomico(
+            os.path.join(job_dir, ARQUIVO_NOTAS_JOB),
+            "".join(formatar_linha_copy(linha) for linha in linhas_catalogo).encode('utf-8'),
+            sincronizar=False
+        )
+
         # Salvar informações no estado
         atualizar_estado(job_dir, "RENAMING", {
             "nome_diretorio": novo_nome,
             "data_ini": data_ini,
             "data_fim": data_fim,
-            "ies": list(ies)
+            "ies": list(ies),
+            "notas_por_dia": notas_por_dia
         })
 
         # Continuar processamento - mover para destino final
@@ -722,6 +892,157 @@ def encontrar_pasta_destino(ie):
             return folder
     return None
 
+# ============================================
+# DEDUPLICATION
+# ============================================
+
+def abrir_indice_notas():
+    """Abre (criando se necessário) o índice SQLite de notas armazenadas"""
+    conexao = sqlite3.connect(ARQUIVO_INDICE_NOTAS)
+    conexao.execute("PRAGMA journal_mode=WAL")
+    conexao.execute("PRAGMA synchronous=NORMAL")
+    conexao.execute("""
+        CREATE TABLE IF NOT EXISTS notas (
+            chave TEXT PRIMARY KEY,
+            hash TEXT NOT NULL,
+            caminho TEXT NOT NULL,
+            tamanho INTEGER NOT NULL,
+            registrado_em TEXT NOT NULL
+        )
+    """)
+    return conexao
+
+def identificar_nota(conteudo):
+    """
+    Identifica uma nota pelo conteúdo do XML.
+
+    Retorna:
+        tuple: (chave, hash) onde chave é a chave de acesso de 44 dígitos ou,
+        se ela não for encontrada, o SHA-256 do conteúdo prefixado com "sha256:".
+    """
+    hash_conteudo = hashlib.sha256(conteudo).hexdigest()
+    match = PADRAO_CHAVE_ACESSO.search(conteudo)
+    chave = match.group(1).decode('ascii') if match else f"sha256:{hash_conteudo}"
+    return chave, hash_conteudo
+
+def copiar_xmls_deduplicados(extracted_dir, destino_final):
+    """
+    Copia os XMLs extraídos para o destino final, sem duplicar notas já armazenadas.
+
+    Notas já presentes na árvore final são ignoradas ou, com MODO_DEDUPLICACAO
+    igual a "hardlink", vinculadas ao destino sem ocupar espaço adicional. O
+    diretório de destino só é criado se ao menos um arquivo for gravado nele.
+
+    Retorna:
+        dict: Contagem de arquivos copiados, ignorados e vinculados, bytes economizados
+        e, em "caminhos", o local onde cada arquivo ficou armazenado.
+    """
+    estatisticas = {"copiados": 0, "ignorados": 0, "vinculados": 0, "bytes_economizados": 0, "caminhos": {}}
+    indice = abrir_indice_notas()
+
+    try:
+        for arquivo in sorted(os.listdir(extracted_dir)):
+            if not arquivo.endswith('.xml'):
+                continue
+
+            origem = os.path.join(extracted_dir, arquivo)
+            destino = os.path.join(destino_final, arquivo)
+            with open(origem, 'rb') as f:
+                conteudo = f.read()
+
+            chave, hash_conteudo = identificar_nota(conteudo)
+            registro = indice.execute("SELECT caminho FROM notas WHERE chave = ?", (chave,)).fetchone()
+
+            if registro and os.path.exists(registro[0]):
+                estatisticas["bytes_economizados"] += len(conteudo)
+                caminho_existente = registro[0]
+
+                if MODO_DEDUPLICACAO != "hardlink" or os.path.abspath(caminho_existente) == os.path.abspath(destino):
+                    estatisticas["ignorados"] += 1
+                    estatisticas["caminhos"][arquivo] = caminho_existente
+                    continue
+
+                try:
+                    os.makedirs(destino_final, exist_ok=True)
+                    if os.path.exists(destino):
+                        os.remove(destino)
+                    os.link(caminho_existente, destino)
+                    estatisticas["vinculados"] += 1
+                    estatisticas["caminhos"][arquivo] = destino
+                    continue
+                except OSError as e:
+                    # Sistemas de arquivos distintos ou sem suporte a hardlink: copia normalmente
+                    logger.debug(f"Não foi possível vincular {arquivo}: {e}")
+                    estatisticas["bytes_economizados"] -= len(conteudo)
+
+            os.makedirs(destino_final, exist_ok=True)
+            gravar_arquivo_atomico(destino, conteudo)
+            shutil.copystat(origem, destino)
+
+            indice.execute(
+                "INSERT OR REPLACE INTO notas (chave, hash, caminho, tamanho, registrado_em) VALUES (?, ?, ?, ?, ?)",
+                (chave, hash_conteudo, destino, len(conteudo), datetime.now().isoformat())
+            )
+            estatisticas["copiados"] += 1
+            estatisticas["caminhos"][arquivo] = destino
+
+        # As entradas do diretório precisam estar em disco antes que o job seja apagado
+        if os.path.isdir(destino_final):
+            sincronizar_diretorio(destino_final)
+        indice.commit()
+    finally:
+        indice.close()
+
+    logger.info(
+        f"Deduplicação em {destino_final}: {estatisticas['copiados']} copiados, "
+        f"{estatisticas['ignorados']} ignorados, {estatisticas['vinculados']} vinculados, "
+        f"{estatisticas['bytes_economizados'] / (1024 * 1024):.2f} MB economizados"
+    )
+    return estatisticas
+
+def nome_unico_em_erros(novo_nome):
+    """Retorna um caminho livre na pasta ERROS, acrescentando sufixo (n) se necessário"""
+    erros_path = os.path.join(DIRETORIO_FINAL, "ERROS")
+    if not os.path.exists(erros_path):
+        os.makedirs(erros_path, exist_ok=True)
+        logger.info(f"Subpasta 'ERROS' criada em {erros_path}")
+
+    destino_final = os.path.join(erros_path, novo_nome)
+    if os.path.exists(destino_final):
+        for i in range(1, 100):
+            destino_final = os.path.join(erros_path, f"{novo_nome} ({i})")
+            if not os.path.exists(destino_final):
+                break
+    return destino_final
+
+def definir_destino_final(novo_nome):
+    """
+    Determina o diretório de destino de um job a partir do nome calculado na análise.
+
+    Retorna:
+        str: Caminho de destino dentro de DIRETORIO_FINAL.
+        None: Se o nome não tiver o formato esperado.
+    """
+    # Caso especial - diretório de erros
+    if novo_nome.startswith("ERR_"):
+        return nome_unico_em_erros(novo_nome)
+
+    # Pasta normal - procurar pela IE
+    try:
+        *_, ie = novo_nome.rsplit('_', 1)
+    except ValueError:
+        return None
+
+    matching_folder = encontrar_pasta_destino(ie)
+    if not matching_folder:
+        # Não encontrou pasta de destino - mover para erros
+        logger.error(f"Não foi encontrada subpasta para IE {ie}")
+        return nome_unico_em_erros(novo_nome)
+
+    # Se a pasta já existir, as notas são mescladas: as que já estão
+    # armazenadas são ignoradas pela deduplicação
+    return os.path.join(DIRETORIO_FINAL, matching_folder, novo_nome)
+
 def mover_para_destino_final(job_dir):
     """Move os arquivos processados para o destino final"""
     try:
@@ -737,93 +1058,22 @@ def mover_para_destino_final(job_dir):
             mover_para_falhas(job_dir, "nome_diretorio_ausente")
             return False
 
-        # Atualizar estado
-        atualizar_estado(job_dir, "MOVING", {"destino": DIRETORIO_FINAL})
-
-        # Determinar se é um erro ou uma pasta normal
-        if novo_nome.startswith("ERR_"):
-            # Caso especial - diretório de erros
-            erros_path = os.path.join(DIRETORIO_FINAL, "ERROS")
-            if not os.path.exists(erros_path):
-                os.makedirs(erros_path, exist_ok=True)
-                logger.info(f"Subpasta 'ERROS' criada em {erros_path}")
-
-            destino_final = os.path.join(erros_path, novo_nome)
-
-            # Garantir nome único
-            if os.path.exists(destino_final):
-                base_name = novo_nome
-                for i in range(1, 100):
-                    novo_nome_com_sufixo = f"{base_name} ({i})"
-                    destino_final = os.path.join(erros_path, novo_nome_com_sufixo)
-                    if not os.path.exists(destino_final):
-                        novo_nome = novo_nome_com_sufixo
-                        break
-
-            # Criar diretório final
-            os.makedirs(destino_final, exist_ok=True)
-
-            # Copiar arquivos XML
-            extracted_dir = os.path.join(job_dir, "extracted")
-            for arquivo in os.listdir(extracted_dir):
-                if arquivo.endswith('.xml'):
-                    shutil.copy2(
-                        os.path.join(extracted_dir, arquivo),
-                        os.path.join(destino_final, arquivo)
-                    )
-
-            logger.info(f"Arquivos copiados para pasta de erros: {destino_final}")
-
-        else:
-            # Pasta normal - procurar pela IE
-            try:
-                *_, ie = novo_nome.rsplit('_', 1)
-            except ValueError:
-                mover_para_falhas(job_dir, f"formato_invalido_nome_{novo_nome}")
-                return False
-
-            # Encontrar pasta correspondente no destino
-            matching_folder = encontrar_pasta_destino(ie)
-
-            if not matching_folder:
-                # Não encontrou pasta de destino - mover para erros
-                logger.error(f"Não foi encontrada subpasta para IE {ie}")
-
-                erros_path = os.path.join(DIRETORIO_FINAL, "ERROS")
-                os.makedirs(erros_path, exist_ok=True)
-
-                destino_final = os.path.join(erros_path, novo_nome)
-                if os.path.exists(destino_final):
-                    base_name = novo_nome
-                    for i in range(1, 100):
-                        novo_nome_com_sufixo = f"{base_name} ({i})"
-                        destino_final = os.path.join(erros_path, novo_nome_com_sufixo)
-                        if not os.path.exists(destino_final):
-                            novo_nome = novo_nome_com_sufixo
-                            break
-            else:
-                # Encontrou pasta de destino
-                destino_final = os.path.join(DIRETORIO_FINAL, matching_folder, novo_nome)
-
-                # Garantir nome único
-                if os.path.exists(destino_final):
-                    # Se já existe, substituir
-                    logger.info(f"Destino {destino_final} já existe, substituindo...")
-                    shutil.rmtree(destino_final)
+        # Na recuperação de um job interrompido durante a cópia, retoma no mesmo destino
+        destino_final = state_data.get("destino_final") or definir_destino_final(novo_nome)
+        if not destino_final:
+            mover_para_falhas(job_dir, f"formato_invalido_nome_{novo_nome}")
+            return False
 
-            # Criar diretório final
-            os.makedirs(destino_final, exist_ok=True)
+        # Atualizar estado
+        atualizar_estado(job_dir, "MOVING", {"destino": DIRETORIO_FINAL, "destino_final": destino_final})
 
-            # Copiar arquivos XML
-            extracted_dir = os.path.join(job_dir, "extracted")
-            for arquivo in os.listdir(extracted_dir):
-                if arquivo.endswith('.xml'):
-                    shutil.copy2(
-                        os.path.join(extracted_dir, arquivo),
-                        os.path.join(destino_final, arquivo)
-                    )
+        # Copiar arquivos XML (a pasta só é criada se houver notas novas)
+        estatisticas = copiar_xmls_deduplicados(os.path.join(job_dir, "extracted"), destino_final)
+        logger.info(f"Arquivos copiados para destino final: {destino_final}")
 
-            logger.info(f"Arquivos copiados para destino final: {destino_final}")
+        # Confirmado junto com o estado COMPLETED e enviado ao banco em lote
+        registrar_resultado_job(job_dir, state_data, destino_final)
+        registrar_catalogo_job(job_dir, estatisticas["caminhos"])
 
         # Finalizar job - agora vai remover o job em vez de movê-lo para completed
         finalizar_job(job_dir)
@@ -870,12 +1120,17 @@ def processar_arquivo_zip_existente(arquivo_zip):
         return False
 
     logger.info(f"Processando arquivo ZIP existente: {arquivo_zip}")
+    tamanho_zip = os.path.getsize(caminho_zip)
+    inicio = time.perf_counter()
 
     # Criar job de processamento
     job_dir = criar_job_processamento(arquivo_zip)
 
     # Processar o ZIP
     resultado = processar_zip(os.path.join(job_dir, arquivo_zip), job_dir)
+    metricas.INGESTAO_SEGUNDOS.observar(time.perf_counter() - inicio)
+    metricas.INGESTAO_ZIPS.incrementar(resultado="sucesso" if resultado else "falha")
+    metricas.INGESTAO_BYTES.incrementar(tamanho_zip)
 
     # Se processado com sucesso, excluir o arquivo original da pasta incoming
     if resultado:
@@ -902,11 +1157,14 @@ def processar_arquivos_existentes():
 
     for arquivo_zip in arquivos_zip:
         try:
-            processar_arquivo_zip_existente(arquivo_zip)
+            if not processar_arquivo_zip_existente(arquivo_zip):
+                registrar_rejeicao(arquivo_zip)
         except Exception as e:
             logger.error(f"Erro ao processar arquivo {arquivo_zip}: {e}", exc_info=True)
             # Continuar com o próximo arquivo
 
+    resumir_amostras("estado_job:")
+
 def heartbeat():
     """Registra que o serviço está funcionando"""
     global ultimo_heartbeat
@@ -919,30 +1177,121 @@ def heartbeat():
 # MONITORING
 # ============================================
 
+def zip_completo(caminho):
+    """Verifica se o ZIP já tem o registro de fim do diretório central (EOCD)"""
+    try:
+        tamanho = os.path.getsize(caminho)
+        if tamanho < 22:
+            return False
+        # O EOCD ocupa 22 bytes mais um comentário opcional de até 64KB no final do arquivo
+        with open(caminho, 'rb') as f:
+            f.seek(max(0, tamanho - 65557))
+            return b'PK\x05\x06' in f.read()
+    except OSError:
+        return False
+
+def enfileirar_arquivo(arquivo):
+    """Coloca o arquivo na fila de trabalho, se ainda não estiver nela"""
+    with fila_lock:
+        if arquivo in arquivos_enfileirados:
+            return False
+        arquivos_enfileirados.add(arquivo)
+        arquivos_aguardando.pop(arquivo, None)
+    fila_trabalho.put(arquivo)
+    return True
+
+def avaliar_arquivo(caminho, stat=None):
+    """
+    Enfileira o ZIP se ele estiver pronto.
+
+    Um arquivo está pronto quando possui o EOCD ou quando tamanho e mtime não
+    mudaram desde a última avaliação (ZIPs corrompidos seguem para a fila e
+    terminam em failed, como antes). Arquivos incompletos ficam registrados
+    para a próxima passagem de reconciliação.
+    """
+    arquivo = os.path.basename(caminho)
+    try:
+        stat = stat or os.stat(caminho)
+    except FileNotFoundError:
+        return False
+    assinatura = (stat.st_size, stat.st_mtime)
+
+    with fila_lock:
+        if arquivo in arquivos_enfileirados or arquivos_rejeitados.get(arquivo) == assinatura:
+            return False
+        assinatura_anterior = arquivos_aguardando.get(arquivo)
+
+    if stat.st_size > 0 and (zip_completo(caminho) or assinatura_anterior == assinatura):
+        return enfileirar_arquivo(arquivo)
+
+    with fila_lock:
+        arquivos_aguardando[arquivo] = assinatura
+    return False
+
+def reconciliar_incoming():
+    """Varre a pasta incoming e enfileira ZIPs prontos cujos eventos foram perdidos"""
+    enfileirados = 0
+    with os.scandir(ESTRUTURA_DIRETORIOS["incoming"]) as entradas:
+        for entrada in entradas:
+            if entrada.name.endswith('.zip') and entrada.is_file():
+                if avaliar_arquivo(entrada.path, entrada.stat()):
+                    enfileirados += 1
+    if enfileirados:
+        logger.info(f"Reconciliação: {enfileirados} arquivos enfileirados sem evento correspondente")
+    return enfileirados
+
+def registrar_rejeicao(arquivo):
+    """Evita novas tentativas com um ZIP que falhou enquanto ele não mudar (ou até reiniciar o serviço)"""
+    try:
+        stat = os.stat(os.path.join(ESTRUTURA_DIRETORIOS["incoming"], arquivo))
+    except FileNotFoundError:
+        return
+    with fila_lock:
+        arquivos_rejeitados[arquivo] = (stat.st_size, stat.st_mtime)
+
+def processar_fila(timeout=1):
+    """Processa o próximo arquivo da fila de trabalho, aguardando até timeout segundos"""
+    try:
+        arquivo = fila_trabalho.get(timeout=timeout)
+    except queue.Empty:
+        return False
+
+    try:
+        if not processar_arquivo_zip_existente(arquivo):
+            registrar_rejeicao(arquivo)
+    except Exception as e:
+        logger.error(f"Erro ao processar o novo arquivo {arquivo}: {e}", exc_info=True)
+    finally:
+        with fila_lock:
+            arquivos_enfileirados.discard(arquivo)
+        fila_trabalho.task_done()
+    return True
+
 class ArquivoHandler(FileSystemEventHandler):
-    """Manipulador de eventos para novos arquivos"""
-    def on_created(self, event):
+    """Manipulador de eventos para novos arquivos: apenas enfileira, sem bloquear o observador"""
+    def _avaliar(self, caminho):
         global ultimo_heartbeat
         ultimo_heartbeat = time.time()
 
-        # Verificar se é um arquivo e não uma pasta
-        if not event.is_directory and event.src_path.endswith('.zip'):
-            arquivo = os.path.basename(event.src_path)
+        # Verificar se o arquivo é um ZIP na pasta incoming
+        if not caminho.endswith('.zip') or os.path.dirname(caminho) != ESTRUTURA_DIRETORIOS["incoming"]:
+            return
 
-            # Verificar se o arquivo está na pasta incoming
-            if os.path.dirname(event.src_path) != ESTRUTURA_DIRETORIOS["incoming"]:
-                return
+        if avaliar_arquivo(caminho):
+            logger.info(f"Novo arquivo detectado: {os.path.basename(caminho)}")
 
-            logger.info(f"Novo arquivo detectado: {arquivo}")
+    def on_created(self, event):
+        if not event.is_directory:
+            self._avaliar(event.src_path)
 
-            # Dar um pequeno tempo para garantir que o arquivo está completamente copiado
-            time.sleep(2)
+    def on_moved(self, event):
+        # Chrome grava *.crdownload e renomeia para .zip ao concluir
+        if not event.is_directory:
+            self._avaliar(event.dest_path)
 
-            # Processar o novo arquivo
-            try:
-                processar_arquivo_zip_existente(arquivo)
-            except Exception as e:
-                logger.error(f"Erro ao processar o novo arquivo {arquivo}: {e}", exc_info=True)
+    def on_closed(self, event):
+        if not event.is_directory:
+            self._avaliar(event.src_path)
 
 def configurar_tratamento_sinais():
     """Configura handlers para sinais do sistema operacional"""
@@ -967,17 +1316,37 @@ def iniciar_monitoramento():
         recursive=False
     )
     observer.start()
+    ultima_reconciliacao = 0
+    ultimo_envio_resultados = 0
 
     try:
         while running:
+            perfilProcesso.marcar_ciclo()
+
             # Verificação de saúde periódica
             heartbeat()
-            time.sleep(1)
+
+            # Passagem periódica para eventos perdidos e arquivos que ainda estavam incompletos
+            if time.time() - ultima_reconciliacao > INTERVALO_RECONCILIACAO:
+                reconciliar_incoming()
+                # Amostragem dos estados recomeça a cada passagem, como por ciclo nas outras etapas
+                resumir_amostras("estado_job:")
+                ultima_reconciliacao = time.time()
+
+            if time.time() - ultimo_envio_resultados > INTERVALO_RESULTADOS:
+                enviar_resultados_banco()
+                enviar_catalogo_notas()
+                ultimo_envio_resultados = time.time()
+
+            processar_fila(timeout=1)
     except Exception as e:
         logger.error(f"Erro durante o monitoramento: {e}", exc_info=True)
     finally:
         observer.stop()
         observer.join()
+        enviar_resultados_banco()
+        enviar_catalogo_notas()
+        fechar_journal()
         logger.info("Monitoramento finalizado")
 
 def main():
@@ -989,7 +1358,17 @@ def main():
 
     # Configuração para captura de sinais
     configurar_tratamento_sinais()
+    metricas.iniciar_servidor_metricas("gerenciarArquivos")
+    # O laço do monitoramento gira a cada segundo: um pedido cobre cerca de 5 minutos
+    perfilProcesso.instalar("gerenciarArquivos", ciclos=300)
+
+    preparar_servico()
+
+    # Iniciar o monitoramento contínuo
+    iniciar_monitoramento()
 
+def preparar_servico():
+    """Prepara diretórios e recupera o trabalho pendente antes do monitoramento"""
     # Configurar estrutura de diretórios
     configurar_diretorios()
 
@@ -1002,9 +1381,6 @@ def main():
     # Processar arquivos existentes na pasta incoming
     processar_arquivos_existentes()
 
-    # Iniciar o monitoramento contínuo
-    iniciar_monitoramento()
-
 if __name__ == "__main__":
     try:
         main()
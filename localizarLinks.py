@@ -6,7 +6,11 @@ from selenium.webdriver.support import expected_conditions as EC
 from selenium.common.exceptions import TimeoutException
 from dotenv import load_dotenv
 from utils import (conectar_postgres, iniciar_navegador_selenoid, autenticar_sefaz, acessar_pagina)
-from loggingConfig import get_logger
+import disjuntor
+import metricas
+import perfilNavegador
+import perfilProcesso
+from loggingConfig import get_logger, log_amostrado, resumir_amostras
 
 load_dotenv()
 os.makedirs("logs", exist_ok=True)
@@ -49,6 +53,9 @@ def acessar_pagina_com_timeout_estendido(navegador, url, timeout_maximo=300):
             tempo_decorrido = time.time() - inicio
             logger.info(f"Página carregada com sucesso após {tempo_decorrido:.1f} segundos (tentativa {tentativas})")
             return True
+        except disjuntor.DisjuntorAberto as e:
+            # Outras falhas (deste ou de outro serviço) abriram o disjuntor: não insiste
+            raise TimeoutException(str(e))
         except Exception as e:
             tempo_decorrido = time.time() - inicio
             tempo_restante = timeout_maximo - tempo_decorrido
@@ -76,10 +83,11 @@ def obter_solicitacoes_solicitadas():
 
     try:
         cursor = conexao.cursor()
-        cursor.execute("""
+        with metricas.cronometrar(metricas.POSTGRES_SEGUNDOS, operacao="obter_solicitacoes_solicitadas"):
+            cursor.execute("""
             SELECT id, inscricao_estadual, horario, criado_em
             FROM nfce.solicitacoes
-            WHERE solicitado > 0 AND (link IS NULL OR link = '') AND baixado = 0 AND tipo = 'NFCE'
+            WHERE solicitado > 0 AND (link IS NULL OR link = '') AND baixado = 0 AND tipo = 'NFCE' AND NOT finalizado AND NOT esgotado
             AND (mensagens < 4 OR mensagens IS NULL)
             ORDER BY criado_em
         """)
@@ -120,86 +128,88 @@ def obter_solicitacoes_solicitadas():
             conexao.close()
         return []
 
-def atualizar_link_solicitacao(id_solicitacao, link):
-    logger.info(f"Atualizando link para solicitação {id_solicitacao}")
-    conexao = conectar_postgres()
-    if not conexao:
-        logger.error(f"Falha ao conectar ao PostgreSQL para atualizar link da solicitação {id_solicitacao}")
-        return False
+# Classificação do resultado informado pela SEFAZ no corpo da mensagem (sem anexo)
+RESULTADO_SUCESSO = "SUCESSO"
+RESULTADO_SEM_DADOS = "SEM_DADOS"
+RESULTADO_MUITO_GRANDE = "MUITO_GRANDE"
+RESULTADO_ERRO = "ERRO_PROCESSAMENTO"
+RESULTADO_DESCONHECIDO = "DESCONHECIDO"
+
+# Se mais de uma classe casar o texto é ambíguo e fica DESCONHECIDO (será resolicitado)
+PADROES_RESULTADO = [
+    (RESULTADO_SEM_DADOS, re.compile(
+        r"n[ãa]o\s+(foram|foi)\s+(encontrad|localizad)|nenhum(a)?\s+(registro|nota|documento|arquivo)|"
+        r"n[ãa]o\s+h[áa]\s+(registros|notas|documentos|dados)|sem\s+(registros|movimento|dados)", re.IGNORECASE)),
+    (RESULTADO_MUITO_GRANDE, re.compile(
+        r"exced|limite\s+m[áa]ximo|tamanho\s+m[áa]ximo|muito\s+grande|reduza\s+o\s+per[íi]odo", re.IGNORECASE)),
+    (RESULTADO_ERRO, re.compile(
+        r"erro|falha|n[ãa]o\s+foi\s+poss[íi]vel|tente\s+novamente|indispon[íi]vel", re.IGNORECASE)),
+]
+
+def classificar_mensagem(texto):
+    """
+    Classifica o corpo de uma mensagem sem anexo da caixa de downloads.
 
+    SEM_DADOS finaliza a solicitação de vez, então só é aceito quando é a única
+    classe que casa; textos ambíguos ou sem padrão conhecido ficam DESCONHECIDO.
+    """
+    classes = [resultado for resultado, padrao in PADROES_RESULTADO if padrao.search(texto or "")]
+    if len(classes) == 1:
+        return classes[0]
+    if len(classes) > 1:
+        logger.warning(f"Mensagem ambígua ({', '.join(classes)}) classificada como {RESULTADO_DESCONHECIDO}: {texto[:200]!r}")
+    return RESULTADO_DESCONHECIDO
+
+def ler_corpo_mensagem(navegador, url):
+    """
+    Abre a mensagem e retorna o texto do elemento de conteúdo (XPATH_CORPO_MENSAGEM),
+    sem menus e rodapé do portal, ou None em caso de falha.
+    """
+    xpath_corpo = os.environ.get("XPATH_CORPO_MENSAGEM")
+    if not xpath_corpo:
+        logger.warning("XPATH_CORPO_MENSAGEM não configurado: mensagem sem anexo não será classificada")
+        return None
     try:
-        cursor = conexao.cursor()
-        cursor.execute("""
-            UPDATE nfce.solicitacoes
-            SET link = %s, atualizado_em = CURRENT_TIMESTAMP
-            WHERE id = %s
-        """, (link, id_solicitacao))
-
-        conexao.commit()
-        cursor.close()
-        conexao.close()
-        logger.info(f"Link atualizado com sucesso para solicitação {id_solicitacao}")
-        return True
-
-    except Exception as erro:
-        logger.error(f"Erro ao atualizar link da solicitação {id_solicitacao}: {erro}")
-        if conexao:
-            conexao.rollback()
-            conexao.close()
-        return False
-
-def atualizar_status_anexo(id_solicitacao, tem_anexo):
-    """Atualiza o status do anexo no banco de dados."""
-    conexao = conectar_postgres()
-    if not conexao:
-        logger.error(f"Falha ao conectar ao PostgreSQL para atualizar status do anexo da solicitação {id_solicitacao}")
-        return False
+        acessar_pagina(navegador, url)
+        return navegador.find_element(By.XPATH, xpath_corpo).text
+    except Exception as e:
+        logger.warning(f"Não foi possível ler a mensagem {url}: {str(e)}")
+        return None
 
-    try:
-        cursor = conexao.cursor()
-        cursor.execute("""
-            UPDATE nfce.solicitacoes
-            SET anexo = %s, atualizado_em = CURRENT_TIMESTAMP
-            WHERE id = %s
-        """, (tem_anexo, id_solicitacao))
+def registrar_resultados_caixa(resultados):
+    """
+    Grava em uma única transação link, anexo, mensagens e classificação das solicitações.
 
-        conexao.commit()
-        cursor.close()
-        conexao.close()
-        status_texto = "Com" if tem_anexo else "Sem"
-        logger.info(f"{status_texto} anexo - Solicitação {id_solicitacao}")
+    Solicitações classificadas como SEM_DADOS são finalizadas com zero notas: a
+    SEFAZ já informou que não há o que baixar e elas não devem ser resolicitadas.
+    """
+    if not resultados:
         return True
 
-    except Exception as erro:
-        logger.error(f"Erro ao atualizar status de anexo da solicitação {id_solicitacao}: {erro}")
-        if conexao:
-            conexao.rollback()
-            conexao.close()
-        return False
-
-def atualizar_quantidade_mensagens(id_solicitacao, quantidade_mensagens):
-    """Atualiza a quantidade de mensagens no banco de dados."""
     conexao = conectar_postgres()
     if not conexao:
-        logger.error(f"Falha ao conectar ao PostgreSQL para atualizar quantidade de mensagens da solicitação {id_solicitacao}")
+        logger.error(f"Falha ao conectar ao PostgreSQL para registrar {len(resultados)} resultados da caixa de downloads")
         return False
 
     try:
         cursor = conexao.cursor()
-        cursor.execute("""
+        cursor.executemany("""
             UPDATE nfce.solicitacoes
-            SET mensagens = %s, atualizado_em = CURRENT_TIMESTAMP
-            WHERE id = %s
-        """, (quantidade_mensagens, id_solicitacao))
+            SET link = %(link)s, anexo = %(anexo)s, mensagens = COALESCE(%(mensagens)s, mensagens),
+                resultado = %(resultado)s,
+                finalizado = finalizado OR %(sem_dados)s,
+                qtd_notas = CASE WHEN %(sem_dados)s THEN 0 ELSE qtd_notas END,
+                atualizado_em = CURRENT_TIMESTAMP
+            WHERE id = %(id)s
+        """, [dict(resultado, sem_dados=resultado["resultado"] == RESULTADO_SEM_DADOS) for resultado in resultados])
 
         conexao.commit()
         cursor.close()
         conexao.close()
-        logger.info(f"Quantidade de mensagens atualizada para {quantidade_mensagens} - Solicitação {id_solicitacao}")
         return True
 
     except Exception as erro:
-        logger.error(f"Erro ao atualizar quantidade de mensagens da solicitação {id_solicitacao}: {erro}")
+        logger.error(f"Erro ao registrar resultados da caixa de downloads: {erro}")
         if conexao:
             conexao.rollback()
             conexao.close()
@@ -228,7 +238,7 @@ def processar_links_disponíveis(navegador, solicitacoes):
 
     links_encontrados = 0
     processadas = 0
-    anexos_atualizados = 0
+    resultados = []
     solicitacoes_por_horario = {item["horario"]: item for item in solicitacoes if item["horario"]}
     logger.info(f"Classificadas {len(solicitacoes_por_horario)} solicitações por horário para correspondência")
 
@@ -302,28 +312,45 @@ def processar_links_disponíveis(navegador, solicitacoes):
 
             if item_encontrado:
                 # Processa todas as solicitações independentemente do número de mensagens
-                # Atualiza o link da solicitação
-                atualizar_link_solicitacao(item_encontrado["id"], url)
+                resultados.append({
+                    "id": item_encontrado["id"],
+                    "link": url,
+                    "anexo": tem_anexo,
+                    "mensagens": quantidade_mensagens,
+                    "resultado": RESULTADO_SUCESSO if tem_anexo else None
+                })
                 links_encontrados += 1
 
-                # Atualiza o status do anexo
-                atualizar_status_anexo(item_encontrado["id"], tem_anexo)
-                anexos_atualizados += 1
-
-                # Atualiza a quantidade de mensagens se disponível
-                if quantidade_mensagens is not None:
-                    atualizar_quantidade_mensagens(item_encontrado["id"], quantidade_mensagens)
-
-                status_anexo = "com anexo" if tem_anexo else "sem anexo"
-                logger.info(f"Link adicionado para solicitação {item_encontrado['id']} (horário {link_text}) - {status_anexo}, {quantidade_mensagens} mensagens")
+                log_amostrado(logger, "link_encontrado", "Link encontrado para solicitação %s (horário %s) - %s, %s mensagens",
+                              item_encontrado['id'], link_text, "com anexo" if tem_anexo else "sem anexo", quantidade_mensagens)
 
         except Exception as e:
             logger.debug(f"Erro ao processar linha: {str(e)}")
             continue
 
+    resumir_amostras("link_encontrado")
+
+    # Mensagens sem anexo são abertas só depois da varredura, que depende da tabela na página atual
+    for resultado in resultados:
+        if resultado["resultado"] is None:
+            resultado["resultado"] = classificar_mensagem(ler_corpo_mensagem(navegador, resultado["link"]))
+
+    if not registrar_resultados_caixa(resultados):
+        return 0
+
+    contagem = {}
+    for resultado in resultados:
+        contagem[resultado["resultado"]] = contagem.get(resultado["resultado"], 0) + 1
+    if contagem:
+        logger.info("Resultados classificados: " + ", ".join(f"{classe}={quantidade}" for classe, quantidade in sorted(contagem.items())))
+
+    perfilNavegador.relatorio_ciclo("localizar")
+    metricas.CAIXA_LINHAS.incrementar(processadas)
+    metricas.CAIXA_LINKS.incrementar(links_encontrados)
+
     tempo_total = time.time() - inicio
     if links_encontrados > 0:
-        logger.info(f"Processamento concluído: {links_encontrados} links encontrados ({anexos_atualizados} atualizados com status de anexo) em {processadas}/{total_linhas} linhas ({tempo_total:.1f}s)")
+        logger.info(f"Processamento concluído: {links_encontrados} links encontrados em {processadas}/{total_linhas} linhas ({tempo_total:.1f}s)")
     else:
         logger.info(f"Processamento concluído: nenhum link encontrado em {processadas}/{total_linhas} linhas ({tempo_total:.1f}s)")
 
@@ -341,12 +368,75 @@ def verificar_necessidade_renovar_sessao(navegador, ultima_verificacao):
             acessar_pagina_com_timeout_estendido(navegador, os.environ.get('URL_CAIXA_DOWNLOADS'), 300)
             logger.info("Sessão renovada com sucesso")
             return tempo_atual, True
-        except:
+        except Exception:
             logger.error("Falha ao renovar sessão do navegador")
             return tempo_atual, False
 
     return ultima_verificacao, True
 
+def fechar_navegador(navegador, motivo):
+    """Fecha o navegador ignorando falhas (a sessão pode já ter expirado no Selenoid)"""
+    global navegador_global
+    try:
+        navegador.quit()
+        logger.info(f"Navegador fechado {motivo}")
+    except Exception as e:
+        logger.warning(f"Falha ao fechar navegador {motivo}: {str(e)}")
+    if navegador_global is navegador:
+        navegador_global = None
+
+def processar_caixa_downloads(navegador=None, ultima_verificacao=0):
+    """
+    Executa um ciclo de verificação da caixa de downloads, reaproveitando `navegador`
+    se a sessão ainda for válida. Usado pelo laço contínuo deste módulo e pelo orquestrador.
+
+    Retorna:
+        tuple: (navegador, ultima_verificacao, links encontrados). Links é None quando
+        não há solicitações aguardando link; o navegador é None se não pôde ser aberto.
+    """
+    global navegador_global
+
+    # Primeiro verifica se há solicitações pendentes antes de iniciar o navegador
+    solicitacoes = obter_solicitacoes_solicitadas()
+    if not solicitacoes:
+        return navegador, ultima_verificacao, None
+
+    logger.info(f"Processando {len(solicitacoes)} solicitações pendentes")
+
+    sessao_valida = False
+    if navegador:
+        ultima_verificacao, sessao_valida = verificar_necessidade_renovar_sessao(navegador, ultima_verificacao)
+
+    if not navegador or not sessao_valida:
+        if navegador:
+            fechar_navegador(navegador, "para reinicialização")
+
+        logger.info("Encontradas solicitações pendentes. Iniciando navegador...")
+        navegador = iniciar_navegador_selenoid()
+        navegador_global = navegador  # Atualiza a referência global
+        if not navegador or not autenticar_sefaz(navegador):
+            logger.error("Falha na autenticação ou inicialização do navegador")
+            if navegador:
+                fechar_navegador(navegador, "após falha na autenticação")
+            return None, 0, 0
+
+        ultima_verificacao = time.time()
+        logger.info("Navegador iniciado com sucesso e autenticação realizada")
+
+    # Processa as solicitações com tempo de espera estendido (até 5 minutos)
+    logger.info("Acessando página de caixa de downloads...")
+    try:
+        acessar_pagina_com_timeout_estendido(navegador, os.environ.get('URL_CAIXA_DOWNLOADS'), 300)
+        links_encontrados = processar_links_disponíveis(navegador, solicitacoes)
+    except TimeoutException:
+        logger.error("Tempo esgotado ao tentar acessar a caixa de downloads. Tentando novamente no próximo ciclo.")
+        links_encontrados = 0
+    except Exception as e:
+        logger.error(f"Erro ao acessar caixa de downloads: {str(e)}")
+        links_encontrados = 0
+
+    return navegador, ultima_verificacao, links_encontrados
+
 def monitorar_solicitacoes_continuamente():
     global ULTIMO_LOG_SEM_SOLICITACOES
     global navegador_global
@@ -355,6 +445,8 @@ def monitorar_solicitacoes_continuamente():
     logger.info(f"=" * 50)
     logger.info(f"INICIANDO SERVIÇO DE MONITORAMENTO CONTÍNUO ({execucao_id})")
     logger.info(f"=" * 50)
+    metricas.iniciar_servidor_metricas("localizarLinks")
+    perfilProcesso.instalar("localizarLinks")
 
     navegador = None
     ultima_verificacao = 0
@@ -363,24 +455,27 @@ def monitorar_solicitacoes_continuamente():
     ciclos_totais = 0
 
     while True:
+        perfilProcesso.marcar_ciclo()
         ciclos_totais += 1
         hora_atual = datetime.now().strftime("%H:%M:%S")
         logger.info(f"Iniciando ciclo #{ciclos_totais} de verificação às {hora_atual}")
 
         try:
-            # Primeiro verifica se há solicitações pendentes antes de iniciar o navegador
-            solicitacoes = obter_solicitacoes_solicitadas()
+            # SEFAZ fora do ar: fecha o navegador e aguarda o disjuntor fechar
+            if not disjuntor.aguardar_liberacao():
+                if navegador:
+                    fechar_navegador(navegador, "enquanto o disjuntor está aberto")
+                    navegador = None
+                continue
+
+            navegador, ultima_verificacao, links_encontrados = processar_caixa_downloads(navegador, ultima_verificacao)
+            navegador_global = navegador
 
             # Se não houver solicitações e o navegador estiver aberto, fecha ele
-            if not solicitacoes:
+            if links_encontrados is None:
                 if navegador:
                     logger.info("Não há solicitações pendentes. Fechando navegador para economizar recursos...")
-                    try:
-                        navegador.quit()
-                        navegador_global = None
-                        logger.info("Navegador fechado com sucesso")
-                    except:
-                        logger.warning("Falha ao fechar navegador")
+                    fechar_navegador(navegador, "por inatividade")
                     navegador = None
 
                 # Log periódico sobre ausência de solicitações
@@ -398,45 +493,9 @@ def monitorar_solicitacoes_continuamente():
 
             # Reinicia contador de ciclos sem solicitação
             ciclos_sem_solicitacao = 0
-            logger.info(f"Processando {len(solicitacoes)} solicitações pendentes")
-
-            # Se há solicitações mas o navegador não está aberto, inicia ele
-            sessao_valida = False
-            if navegador:
-                ultima_verificacao, sessao_valida = verificar_necessidade_renovar_sessao(navegador, ultima_verificacao)
 
-            if not navegador or not sessao_valida:
-                if navegador:
-                    try:
-                        logger.info("Reinicializando navegador...")
-                        navegador.quit()
-                        navegador_global = None
-                    except:
-                        logger.warning("Falha ao fechar navegador antigo")
-
-                logger.info("Encontradas solicitações pendentes. Iniciando navegador...")
-                navegador = iniciar_navegador_selenoid()
-                navegador_global = navegador  # Atualiza a referência global
-                if not navegador or not autenticar_sefaz(navegador):
-                    logger.error("Falha na autenticação ou inicialização do navegador. Tentando novamente em 60 segundos...")
-                    time.sleep(60)
-                    continue
-
-                ultima_verificacao = time.time()
-                logger.info("Navegador iniciado com sucesso e autenticação realizada")
-
-            # Processa as solicitações com tempo de espera estendido (até 5 minutos)
-            logger.info("Acessando página de caixa de downloads...")
-            try:
-                # Usando a nova função com timeout estendido de 5 minutos (300 segundos)
-                acessar_pagina_com_timeout_estendido(navegador, os.environ.get('URL_CAIXA_DOWNLOADS'), 300)
-                links_encontrados = processar_links_disponíveis(navegador, solicitacoes)
-            except TimeoutException:
-                logger.error("Tempo esgotado ao tentar acessar a caixa de downloads. Tentando novamente no próximo ciclo.")
-                time.sleep(60)
-                continue
-            except Exception as e:
-                logger.error(f"Erro ao acessar caixa de downloads: {str(e)}")
+            if not navegador:
+                logger.info("Tentando iniciar o navegador novamente em 60 segundos...")
                 time.sleep(60)
                 continue
 
@@ -454,12 +513,7 @@ def monitorar_solicitacoes_continuamente():
         except Exception as e:
             logger.error(f"Erro durante o monitoramento: {str(e)}")
             if navegador:
-                try:
-                    navegador.quit()
-                    navegador_global = None
-                    logger.info("Navegador fechado após erro")
-                except:
-                    logger.warning("Falha ao fechar navegador após erro")
+                fechar_navegador(navegador, "após erro")
                 navegador = None
             logger.info("Aguardando 60 segundos para tentar novamente após erro...")
             time.sleep(60)
@@ -489,6 +543,6 @@ if __name__ == "__main__":
             try:
                 navegador_global.quit()
                 logger.info("Navegador fechado após erro fatal.")
-            except:
+            except Exception:
                 pass
         sys.exit(1)
\ No newline at end of file
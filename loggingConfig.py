@@ -1,7 +1,104 @@
 import logging
 import os
 import sys
-from logging.handlers import RotatingFileHandler
+import json
+import copy
+import queue
+import atexit
+import threading
+import time
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
+from dotenv import load_dotenv
+
+# As variáveis LOG_* precisam estar carregadas antes da configuração automática abaixo
+load_dotenv()
+
+# Listener ativo no modo fila (LOG_MODO=fila)
+listener_ativo = None
+
+class FormatadorJson(logging.Formatter):
+    """Uma linha JSON por registro (LOG_FORMATO=json)"""
+    def format(self, record):
+        dados = {
+            "momento": self.formatTime(record, self.datefmt),
+            "nivel": record.levelname,
+            "logger": record.name,
+            "mensagem": record.getMessage(),
+            "processo": record.process,
+            "thread": record.threadName,
+        }
+        if record.exc_info:
+            dados["excecao"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            dados["excecao"] = record.exc_text
+        return json.dumps(dados, ensure_ascii=False)
+
+class FilaLimitadaHandler(QueueHandler):
+    """
+    Enfileira os registros para o QueueListener gravar em outra thread.
+
+    Com a fila cheia, a política "descartar" perde o registro e contabiliza a perda
+    (informada no próximo registro aceito); "bloquear" espera espaço na fila.
+    """
+    def __init__(self, fila, politica="descartar"):
+        super().__init__(fila)
+        self.politica = politica
+        self.descartados = 0
+        self.total_descartados = 0
+        self.trava_descartados = threading.Lock()
+
+    def prepare(self, record):
+        """
+        Resolve a mensagem e guarda o traceback em exc_text para o formatador do
+        listener. O prepare padrão formata o registro inteiro e apaga exc_info/exc_text,
+        o que tirava o campo "excecao" do log JSON.
+        """
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = record.exc_text or logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        if self.politica == "bloquear":
+            self.queue.put(record)
+            return
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self.trava_descartados:
+                self.descartados += 1
+                self.total_descartados += 1
+            return
+        if self.descartados:
+            with self.trava_descartados:
+                descartados, self.descartados = self.descartados, 0
+            aviso = logging.LogRecord("loggingConfig", logging.WARNING, __file__, 0,
+                                      f"{descartados} registros de log descartados (fila de log cheia)", None, None)
+            try:
+                self.queue.put_nowait(aviso)
+            except queue.Full:
+                with self.trava_descartados:
+                    self.descartados += descartados
+
+class ListenerFila(QueueListener):
+    """QueueListener que espera espaço na fila para o sinal de parada (com a fila cheia o padrão falha)"""
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+def encerrar_logging():
+    """Para o listener do modo fila, gravando os registros ainda enfileirados"""
+    global listener_ativo
+    if listener_ativo is not None:
+        listener, listener_ativo = listener_ativo, None
+        listener.stop()
+        for handler in listener.handlers:
+            handler.flush()
+
+atexit.register(encerrar_logging)
 
 def get_execution_path():
     """Retorna o diretório onde o script foi executado"""
@@ -14,6 +111,9 @@ def configure_logging(auto_configure=True):
     - Usa nome do arquivo principal como nome do log
     - Evita duplicação de handlers
     - Suporta configuração de nível através da variável de ambiente LOG_LEVEL
+    - LOG_MODO=fila grava em thread própria via QueueHandler/QueueListener, com
+      fila de LOG_FILA_TAMANHO registros e política LOG_FILA_POLITICA (descartar ou bloquear)
+    - LOG_FORMATO=json grava uma linha JSON por registro
     """
     # Obtém o caminho de execução e nome do arquivo principal
     execution_path = get_execution_path()
@@ -33,15 +133,19 @@ def configure_logging(auto_configure=True):
     logger.setLevel(log_level)
 
     # Remove todos os handlers existentes para evitar duplicação
+    encerrar_logging()
     for handler in logger.handlers[:]:
         logger.removeHandler(handler)
         handler.close()
 
     # Formato padrão dos logs
-    formatter = logging.Formatter(
-        '%(asctime)s - %(levelname)s - %(name)s - %(message)s',
-        datefmt='%Y-%m-%d %H:%M:%S'
-    )
+    if os.environ.get('LOG_FORMATO', 'texto').lower() == 'json':
+        formatter = FormatadorJson(datefmt='%Y-%m-%dT%H:%M:%S')
+    else:
+        formatter = logging.Formatter(
+            '%(asctime)s - %(levelname)s - %(name)s - %(message)s',
+            datefmt='%Y-%m-%d %H:%M:%S'
+        )
 
     # Handler para arquivo (rotativo, 20MB, 5 backups)
     file_handler = RotatingFileHandler(
@@ -51,12 +155,23 @@ def configure_logging(auto_configure=True):
         encoding='utf-8'
     )
     file_handler.setFormatter(formatter)
-    logger.addHandler(file_handler)
 
     # Handler para console
     console_handler = logging.StreamHandler()
     console_handler.setFormatter(formatter)
-    logger.addHandler(console_handler)
+
+    modo = os.environ.get('LOG_MODO', 'sincrono').lower()
+    if modo == 'fila':
+        # Disco e console ficam na thread do listener; quem loga só enfileira
+        global listener_ativo
+        fila = queue.Queue(maxsize=int(os.environ.get('LOG_FILA_TAMANHO', 10000)))
+        politica = os.environ.get('LOG_FILA_POLITICA', 'descartar').lower()
+        logger.addHandler(FilaLimitadaHandler(fila, politica))
+        listener_ativo = ListenerFila(fila, file_handler, console_handler, respect_handler_level=True)
+        listener_ativo.start()
+    else:
+        logger.addHandler(file_handler)
+        logger.addHandler(console_handler)
 
     # Configura níveis de log para bibliotecas externas
     logging.getLogger('selenium').setLevel(logging.WARNING)
@@ -66,7 +181,71 @@ def configure_logging(auto_configure=True):
     # Reduz logs de módulos internos para diminuir verbosidade
     logging.getLogger('utils').setLevel(logging.WARNING)
 
-    logger.info(f'Logging configurado. Arquivo: {log_file} | Nível: {log_level_name}')
+    logger.info(f'Logging configurado. Arquivo: {log_file} | Nível: {log_level_name} | Modo: {modo}')
+
+# ============================================
+# AMOSTRAGEM DE LOGS EM LAÇOS POR ITEM
+# ============================================
+
+# Por chave: registra as LOG_AMOSTRA_PRIMEIROS primeiras ocorrências, depois uma a cada
+# LOG_AMOSTRA_A_CADA, nunca mais que LOG_AMOSTRA_MAX_POR_SEGUNDO por segundo; a cada
+# LOG_AMOSTRA_RESUMO segundos sai uma linha de resumo com o que foi suprimido
+LOG_AMOSTRA_PRIMEIROS = int(os.environ.get('LOG_AMOSTRA_PRIMEIROS', 10))
+LOG_AMOSTRA_A_CADA = int(os.environ.get('LOG_AMOSTRA_A_CADA', 1000))
+LOG_AMOSTRA_MAX_POR_SEGUNDO = int(os.environ.get('LOG_AMOSTRA_MAX_POR_SEGUNDO', 5))
+LOG_AMOSTRA_RESUMO = float(os.environ.get('LOG_AMOSTRA_RESUMO', 60))
+
+amostras = {}
+trava_amostras = threading.Lock()
+
+def log_amostrado(logger, chave, mensagem, *args, nivel=logging.INFO):
+    """
+    Registra `mensagem` (com `args` no estilo %) conforme a amostragem da `chave`.
+
+    Retorna True se a mensagem foi registrada.
+    """
+    if not logger.isEnabledFor(nivel):
+        return False
+    agora = time.monotonic()
+    resumo = None
+    with trava_amostras:
+        amostra = amostras.get(chave)
+        if amostra is None:
+            amostra = amostras[chave] = {"total": 0, "suprimidas": 0, "segundo": int(agora), "no_segundo": 0,
+                                         "resumo_em": agora, "logger": logger, "nivel": nivel}
+        amostra["total"] += 1
+        if int(agora) != amostra["segundo"]:
+            amostra["segundo"], amostra["no_segundo"] = int(agora), 0
+
+        registrar = (amostra["total"] <= LOG_AMOSTRA_PRIMEIROS or amostra["total"] % LOG_AMOSTRA_A_CADA == 0) \
+            and amostra["no_segundo"] < LOG_AMOSTRA_MAX_POR_SEGUNDO
+        if registrar:
+            amostra["no_segundo"] += 1
+        else:
+            amostra["suprimidas"] += 1
+
+        if amostra["suprimidas"] and agora - amostra["resumo_em"] >= LOG_AMOSTRA_RESUMO:
+            resumo = (amostra["total"], amostra["suprimidas"], agora - amostra["resumo_em"])
+            amostra["suprimidas"], amostra["resumo_em"] = 0, agora
+
+    if registrar:
+        logger.log(nivel, mensagem, *args)
+    if resumo:
+        logger.log(nivel, "[%s] %d ocorrências no total; %d suprimidas nos últimos %.0fs", chave, *resumo)
+    return registrar
+
+def resumir_amostras(prefixo=""):
+    """
+    Emite o resumo das chaves (que começam com `prefixo`) com mensagens suprimidas
+    e zera suas contagens. Chamado ao fim de um lote ou ciclo.
+    """
+    with trava_amostras:
+        chaves = [chave for chave in amostras if chave.startswith(prefixo)]
+        encerradas = [(chave, amostras.pop(chave)) for chave in chaves]
+    for chave, amostra in encerradas:
+        if amostra["suprimidas"]:
+            amostra["logger"].log(amostra["nivel"], "[%s] %d ocorrências no total; %d suprimidas desde o último resumo",
+                                  chave, amostra["total"], amostra["suprimidas"])
 
 def get_logger(name=None):
     """
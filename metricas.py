@@ -0,0 +1,221 @@
+"""
+Registro de métricas no formato texto do Prometheus, servido por HTTP em cada processo.
+
+Contadores, medidores e histogramas ficam em memória e são expostos em
+http://METRICAS_HOST:<porta>/metrics. A porta de cada serviço é
+METRICAS_PORTA_BASE + deslocamento em PORTAS_SERVICOS, ou METRICAS_PORTA_<SERVICO>
+(ex.: METRICAS_PORTA_BAIXARARQUIVOS=9500). METRICAS_PORTA_BASE=0 desativa o servidor.
+"""
+import os, time, bisect, threading, weakref
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from dotenv import load_dotenv
+from loggingConfig import get_logger
+
+load_dotenv()
+logger = get_logger(__name__)
+
+METRICAS_HOST = os.environ.get("METRICAS_HOST", "127.0.0.1")
+METRICAS_PORTA_BASE = int(os.environ.get("METRICAS_PORTA_BASE", 9460))
+
+PORTAS_SERVICOS = {
+    "solicitarXmls": 0,
+    "solicitarXmlsFalhos": 1,
+    "localizarLinks": 2,
+    "baixarArquivos": 3,
+    "gerenciarArquivos": 4,
+    "orquestrador": 5,
+}
+
+LIMITES_PADRAO = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+registro = {}
+trava_registro = threading.Lock()
+
+def formatar_rotulos(rotulos, extra=None):
+    itens = list(rotulos) + ([extra] if extra else [])
+    if not itens:
+        return ""
+    return "{" + ",".join(f'{nome}="{str(valor).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+                          for nome, valor in itens) + "}"
+
+def formatar_valor(valor):
+    return "+Inf" if valor == float("inf") else repr(float(valor))
+
+class Metrica:
+    tipo = None
+
+    def __init__(self, nome, ajuda):
+        self.nome, self.ajuda = nome, ajuda
+        self.valores = {}
+
+    def exportar(self):
+        linhas = [f"# HELP {self.nome} {self.ajuda}", f"# TYPE {self.nome} {self.tipo}"]
+        with trava_registro:
+            valores = list(self.valores.items())
+        for rotulos, valor in sorted(valores, key=lambda item: item[0]):
+            linhas.append(f"{self.nome}{formatar_rotulos(rotulos)} {formatar_valor(valor)}")
+        return linhas
+
+class Contador(Metrica):
+    tipo = "counter"
+
+    def incrementar(self, valor=1, **rotulos):
+        chave = tuple(sorted(rotulos.items()))
+        with trava_registro:
+            self.valores[chave] = self.valores.get(chave, 0) + valor
+
+class Medidor(Metrica):
+    tipo = "gauge"
+
+    def __init__(self, nome, ajuda, funcao=None):
+        super().__init__(nome, ajuda)
+        self.funcao = funcao
+
+    def definir(self, valor, **rotulos):
+        with trava_registro:
+            self.valores[tuple(sorted(rotulos.items()))] = valor
+
+    def exportar(self):
+        if self.funcao:
+            try:
+                self.definir(self.funcao())
+            except Exception as erro:
+                logger.debug(f"Erro ao calcular a métrica {self.nome}: {erro}")
+        return super().exportar()
+
+class Histograma(Metrica):
+    tipo = "histogram"
+
+    def __init__(self, nome, ajuda, limites=LIMITES_PADRAO):
+        super().__init__(nome, ajuda)
+        self.limites = tuple(limites)
+
+    def observar(self, valor, **rotulos):
+        chave = tuple(sorted(rotulos.items()))
+        with trava_registro:
+            serie = self.valores.get(chave)
+            if serie is None:
+                serie = self.valores[chave] = {"baldes": [0] * len(self.limites), "soma": 0.0, "contagem": 0}
+            indice = bisect.bisect_left(self.limites, valor)
+            if indice < len(self.limites):
+                serie["baldes"][indice] += 1
+            serie["soma"] += valor
+            serie["contagem"] += 1
+
+    def exportar(self):
+        linhas = [f"# HELP {self.nome} {self.ajuda}", f"# TYPE {self.nome} {self.tipo}"]
+        with trava_registro:
+            series = [(rotulos, dict(serie, baldes=list(serie["baldes"]))) for rotulos, serie in self.valores.items()]
+        for rotulos, serie in sorted(series, key=lambda item: item[0]):
+            acumulado = 0
+            for limite, quantidade in zip(self.limites, serie["baldes"]):
+                acumulado += quantidade
+                linhas.append(f"{self.nome}_bucket{formatar_rotulos(rotulos, ('le', formatar_valor(limite)))} {acumulado}")
+            linhas.append(f"{self.nome}_bucket{formatar_rotulos(rotulos, ('le', '+Inf'))} {serie['contagem']}")
+            linhas.append(f"{self.nome}_sum{formatar_rotulos(rotulos)} {formatar_valor(serie['soma'])}")
+            linhas.append(f"{self.nome}_count{formatar_rotulos(rotulos)} {serie['contagem']}")
+        return linhas
+
+def obter_ou_criar(classe, nome, *argumentos, **opcoes):
+    with trava_registro:
+        metrica = registro.get(nome)
+        if metrica is None:
+            metrica = registro[nome] = classe(nome, *argumentos, **opcoes)
+    return metrica
+
+def contador(nome, ajuda):
+    return obter_ou_criar(Contador, nome, ajuda)
+
+def medidor(nome, ajuda, funcao=None):
+    return obter_ou_criar(Medidor, nome, ajuda, funcao=funcao)
+
+def histograma(nome, ajuda, limites=LIMITES_PADRAO):
+    return obter_ou_criar(Histograma, nome, ajuda, limites=limites)
+
+@contextmanager
+def cronometrar(metrica, **rotulos):
+    """Observa no histograma a duração do bloco, em segundos"""
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrica.observar(time.perf_counter() - inicio, **rotulos)
+
+def exportar():
+    """Texto no formato de exposição do Prometheus com todas as métricas do processo"""
+    with trava_registro:
+        metricas = sorted(registro.values(), key=lambda metrica: metrica.nome)
+    linhas = []
+    for metrica in metricas:
+        linhas.extend(metrica.exportar())
+    return "\n".join(linhas) + "\n"
+
+# ============================================
+# MÉTRICAS DO PIPELINE
+# ============================================
+
+FILA_PROFUNDIDADE = medidor("nfce_fila_profundidade", "Itens em cada fila intermediária do pipeline")
+SOLICITACOES_ENVIADAS = contador("nfce_solicitacoes_enviadas_total", "Solicitações enviadas ao portal por etapa e resultado")
+CAIXA_LINHAS = contador("nfce_caixa_linhas_total", "Linhas da caixa de downloads examinadas")
+CAIXA_LINKS = contador("nfce_caixa_links_encontrados_total", "Linhas da caixa de downloads associadas a uma solicitação")
+DOWNLOAD_SEGUNDOS = histograma("nfce_download_segundos", "Tempo entre o clique no link e o ZIP completo na sessão",
+                               (1, 2, 5, 10, 20, 30, 60, 120, 300, 600))
+DOWNLOAD_BYTES = contador("nfce_download_bytes_total", "Bytes dos ZIPs baixados")
+INGESTAO_ZIPS = contador("nfce_ingestao_zips_total", "ZIPs processados pelo gerenciador por resultado")
+INGESTAO_XMLS = contador("nfce_ingestao_xmls_total", "XMLs extraídos dos ZIPs")
+INGESTAO_BYTES = contador("nfce_ingestao_bytes_total", "Bytes dos ZIPs processados")
+INGESTAO_SEGUNDOS = histograma("nfce_ingestao_zip_segundos", "Tempo de processamento de um ZIP, da criação do job ao destino final")
+POSTGRES_SEGUNDOS = histograma("nfce_postgres_segundos", "Tempo das operações no PostgreSQL (conexão e consultas das etapas)")
+
+# Sessões de navegador vivas neste processo (somem ao ser coletadas)
+navegadores = weakref.WeakKeyDictionary()
+
+def registrar_navegador(navegador):
+    try:
+        navegadores[navegador] = time.time()
+    except TypeError:
+        pass
+
+def idade_navegador_mais_antigo():
+    inicios = list(navegadores.values())
+    return time.time() - min(inicios) if inicios else 0
+
+NAVEGADOR_SESSOES = medidor("nfce_navegador_sessoes", "Sessões de navegador abertas neste processo", lambda: len(navegadores))
+NAVEGADOR_IDADE = medidor("nfce_navegador_idade_segundos", "Idade da sessão de navegador mais antiga deste processo", idade_navegador_mais_antigo)
+
+# ============================================
+# SERVIDOR HTTP
+# ============================================
+
+class TratadorMetricas(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        corpo = exportar().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(corpo)))
+        self.end_headers()
+        self.wfile.write(corpo)
+
+    def log_message(self, formato, *args):
+        pass
+
+def iniciar_servidor_metricas(servico):
+    """Serve /metrics em uma thread daemon; retorna o servidor ou None se desativado/indisponível"""
+    porta = os.environ.get(f"METRICAS_PORTA_{servico.upper()}")
+    if porta is None:
+        if not METRICAS_PORTA_BASE:
+            return None
+        porta = METRICAS_PORTA_BASE + PORTAS_SERVICOS.get(servico, len(PORTAS_SERVICOS))
+    try:
+        servidor = ThreadingHTTPServer((METRICAS_HOST, int(porta)), TratadorMetricas)
+    except OSError as erro:
+        logger.warning(f"Servidor de métricas não iniciado em {METRICAS_HOST}:{porta}: {erro}")
+        return None
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, name="metricas", daemon=True).start()
+    logger.info(f"Métricas de {servico} disponíveis em http://{METRICAS_HOST}:{porta}/metrics")
+    return servidor
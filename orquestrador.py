@@ -0,0 +1,240 @@
+"""
+Orquestrador do pipeline em um único processo (asyncio).
+
+Hospeda cada etapa como uma tarefa assíncrona:
+
+    solicitar      solicitarXmls.processar_solicitacoes
+    resolicitar    solicitarXmlsFalhos.processar_resolicitacoes
+    localizar      localizarLinks.processar_caixa_downloads
+    baixar         baixarArquivos.processar_downloads
+    gerenciar      gerenciarArquivos (watchdog da pasta incoming)
+
+As chamadas Selenium são bloqueantes e rodam em um executor limitado
+(ORQUESTRADOR_THREADS_NAVEGADOR). Solicitar, resolicitar e localizar compartilham
+uma única sessão autenticada na SEFAZ, usada por uma etapa de cada vez; o
+download mantém suas próprias sessões. Todas as etapas usam o mesmo pool de
+conexões PostgreSQL. SIGINT/SIGTERM encerram as tarefas ao fim do ciclo atual e
+fecham navegadores, executor e pool.
+
+O perfil sob demanda (perfilProcesso, kill -USR1) é instalado na partida e conta
+um ciclo a cada INTERVALO_VERIFICACAO segundos. Cada chamada no executor de
+navegadores e o monitoramento do gerenciar são perfilados nas próprias threads e
+somados ao mesmo .pstats.
+
+Cada etapa continua podendo rodar isolada pelo próprio script.
+
+Uso:
+    python orquestrador.py [--etapas solicitar,resolicitar,localizar,baixar,gerenciar]
+"""
+import os, sys, time, signal, asyncio, argparse
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from loggingConfig import get_logger
+import utils, disjuntor, metricas, perfilProcesso
+import solicitarXmls, solicitarXmlsFalhos, localizarLinks, baixarArquivos, gerenciarArquivos
+
+load_dotenv()
+logger = get_logger(__name__)
+
+ETAPAS = ("solicitar", "resolicitar", "localizar", "baixar", "gerenciar")
+
+ORQUESTRADOR_THREADS_NAVEGADOR = int(os.environ.get("ORQUESTRADOR_THREADS_NAVEGADOR", 2))
+ORQUESTRADOR_POOL_MINIMO = int(os.environ.get("ORQUESTRADOR_POOL_MINIMO", 1))
+ORQUESTRADOR_POOL_MAXIMO = int(os.environ.get("ORQUESTRADOR_POOL_MAXIMO", 10))
+INTERVALO_VERIFICACAO = int(os.environ.get("INTERVALO_VERIFICACAO", 60))
+TEMPO_INATIVIDADE_NAVEGADOR = int(os.environ.get("TEMPO_INATIVIDADE_NAVEGADOR", 300))
+
+class Orquestrador:
+    """Estado compartilhado entre as tarefas das etapas"""
+
+    def __init__(self, etapas):
+        self.etapas = etapas
+        self.parar = asyncio.Event()
+        self.executor = ThreadPoolExecutor(max_workers=ORQUESTRADOR_THREADS_NAVEGADOR, thread_name_prefix="navegador")
+        # Sessão SEFAZ compartilhada por solicitar, resolicitar e localizar
+        self.trava_navegador = asyncio.Lock()
+        self.navegador = None
+        self.ultima_verificacao = 0
+        self.ultima_atividade = 0
+
+    async def executar(self, funcao, *argumentos):
+        """Roda uma chamada bloqueante no executor de navegadores"""
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, perfilProcesso.executar_perfilado, funcao, *argumentos)
+
+    async def aguardar(self, segundos):
+        """Espera `segundos` ou até o pedido de parada; retorna True se deve parar"""
+        try:
+            await asyncio.wait_for(self.parar.wait(), segundos)
+        except asyncio.TimeoutError:
+            pass
+        return self.parar.is_set()
+
+    def solicitar_parada(self):
+        if self.parar.is_set():
+            return
+        logger.info("Sinal de encerramento recebido. Finalizando etapas após o ciclo atual...")
+        self.parar.set()
+        solicitarXmls.RUNNING = False
+        solicitarXmlsFalhos.RUNNING = False
+        baixarArquivos.RUNNING = False
+        gerenciarArquivos.running = False
+
+    # ============================================
+    # NAVEGADOR COMPARTILHADO
+    # ============================================
+
+    def ciclo_formulario(self, modulo, processar):
+        """Executa um ciclo de solicitar/resolicitar com o navegador compartilhado"""
+        modulo.navegador_global = self.navegador
+        try:
+            return processar()
+        finally:
+            self.navegador = modulo.navegador_global
+            modulo.navegador_global = None
+
+    def ciclo_caixa(self):
+        """Executa um ciclo do localizarLinks com o navegador compartilhado"""
+        localizarLinks.navegador_global = self.navegador
+        try:
+            self.navegador, self.ultima_verificacao, links = localizarLinks.processar_caixa_downloads(
+                self.navegador, self.ultima_verificacao)
+            return links
+        finally:
+            localizarLinks.navegador_global = None
+
+    def fechar_navegador(self):
+        if self.navegador is None:
+            return
+        try:
+            self.navegador.quit()
+            logger.info("Navegador compartilhado fechado")
+        except Exception as erro:
+            logger.warning(f"Erro ao fechar navegador compartilhado: {erro}")
+        self.navegador = None
+        self.ultima_verificacao = 0
+
+    async def ciclo_compartilhado(self, funcao, *argumentos):
+        """Roda `funcao` com a sessão compartilhada, uma etapa de cada vez"""
+        async with self.trava_navegador:
+            if self.parar.is_set():
+                return None
+            if not await self.executar(disjuntor.permitir_navegacao):
+                await self.executar(self.fechar_navegador)
+                return None
+            resultado = await self.executar(funcao, *argumentos)
+            if resultado:
+                self.ultima_atividade = time.time()
+            elif self.navegador and time.time() - self.ultima_atividade > TEMPO_INATIVIDADE_NAVEGADOR:
+                logger.info("Navegador compartilhado inativo. Fechando para economizar recursos...")
+                await self.executar(self.fechar_navegador)
+            return resultado
+
+    # ============================================
+    # ETAPAS
+    # ============================================
+
+    async def etapa_solicitar(self):
+        while not self.parar.is_set():
+            processadas = await self.ciclo_compartilhado(self.ciclo_formulario, solicitarXmls, solicitarXmls.processar_solicitacoes)
+            if await self.aguardar(5 if processadas else INTERVALO_VERIFICACAO):
+                break
+
+    async def etapa_resolicitar(self):
+        while not self.parar.is_set():
+            processadas = await self.ciclo_compartilhado(self.ciclo_formulario, solicitarXmlsFalhos, solicitarXmlsFalhos.processar_resolicitacoes)
+            if await self.aguardar(5 if processadas else INTERVALO_VERIFICACAO):
+                break
+
+    async def etapa_localizar(self):
+        ciclos_sem_link = 0
+        while not self.parar.is_set():
+            links = await self.ciclo_compartilhado(self.ciclo_caixa)
+            if links:
+                ciclos_sem_link = 0
+                espera = 15
+            else:
+                ciclos_sem_link += 1
+                espera = min(60 * (ciclos_sem_link // 3 + 1), 300)
+            if await self.aguardar(espera):
+                break
+
+    async def etapa_baixar(self):
+        while not self.parar.is_set():
+            downloads = 0
+            if await self.executar(disjuntor.permitir_navegacao):
+                downloads = await self.executar(baixarArquivos.processar_downloads)
+            if await self.aguardar(5 if downloads else INTERVALO_VERIFICACAO):
+                break
+
+    async def etapa_gerenciar(self):
+        # Monitoramento contínuo em thread própria, fora do executor de navegadores
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, gerenciarArquivos.preparar_servico)
+        if not self.parar.is_set():
+            await loop.run_in_executor(None, gerenciarArquivos.iniciar_monitoramento)
+
+    async def marcar_ciclos_perfil(self):
+        """Ciclos do perfil sob demanda, independentes das etapas hospedadas"""
+        while not self.parar.is_set():
+            perfilProcesso.marcar_ciclo()
+            if await self.aguardar(INTERVALO_VERIFICACAO):
+                break
+
+    async def supervisionar(self, nome):
+        """Mantém a etapa rodando, reiniciando-a após erros inesperados"""
+        while not self.parar.is_set():
+            try:
+                await getattr(self, f"etapa_{nome}")()
+            except Exception as erro:
+                logger.error(f"Erro na etapa '{nome}': {erro}", exc_info=True)
+                if await self.aguardar(30):
+                    break
+                continue
+            if nome == "gerenciar" and not self.parar.is_set():
+                logger.warning("Monitoramento de arquivos encerrado inesperadamente. Reiniciando em 30s...")
+                if await self.aguardar(30):
+                    break
+        logger.info(f"Etapa '{nome}' encerrada")
+
+    async def iniciar(self):
+        loop = asyncio.get_running_loop()
+        for sinal in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sinal, self.solicitar_parada)
+
+        logger.info(f"Etapas ativas: {', '.join(self.etapas)} ({ORQUESTRADOR_THREADS_NAVEGADOR} threads de navegador)")
+        try:
+            await asyncio.gather(self.marcar_ciclos_perfil(), *(self.supervisionar(nome) for nome in self.etapas))
+        finally:
+            await self.executar(self.fechar_navegador)
+            self.executor.shutdown(wait=True)
+
+def main():
+    argumentos = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    argumentos.add_argument("--etapas", default=",".join(ETAPAS), help="etapas a hospedar, separadas por vírgula")
+    opcoes = argumentos.parse_args()
+
+    etapas = [etapa.strip() for etapa in opcoes.etapas.split(",") if etapa.strip()]
+    invalidas = [etapa for etapa in etapas if etapa not in ETAPAS]
+    if invalidas or not etapas:
+        print(f"Etapas inválidas: {', '.join(invalidas) or '(nenhuma)'}. Opções: {', '.join(ETAPAS)}")
+        sys.exit(2)
+
+    execucao_id = f"ORQUESTRADOR-{time.strftime('%Y%m%d-%H%M%S')}"
+    logger.info("=" * 50)
+    logger.info(f"INICIANDO ORQUESTRADOR DO PIPELINE NFC-e ({execucao_id})")
+    logger.info("=" * 50)
+
+    metricas.iniciar_servidor_metricas("orquestrador")
+    # SIGUSR1 só pode ser registrado na thread principal, antes de as etapas começarem
+    perfilProcesso.instalar("orquestrador")
+    if not utils.ativar_pool_postgres(ORQUESTRADOR_POOL_MINIMO, ORQUESTRADOR_POOL_MAXIMO):
+        logger.warning("Pool de conexões indisponível; cada operação abrirá sua própria conexão")
+    try:
+        asyncio.run(Orquestrador(etapas).iniciar())
+    finally:
+        utils.fechar_pool_postgres()
+        logger.info("Orquestrador encerrado")
+
+if __name__ == "__main__":
+    main()
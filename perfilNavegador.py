@@ -0,0 +1,107 @@
+"""
+Perfil dos comandos WebDriver enviados ao Selenoid (opcional, PERFIL_NAVEGADOR=1).
+
+Cada find_element, .text, get_attribute, click, send_keys etc. é uma requisição
+HTTP ao Selenoid. Com o perfil ativo, iniciar_navegador_selenoid envolve o
+execute() do navegador (por onde passam também os comandos dos WebElements) e
+conta, por comando e por função chamadora, quantidade e latência.
+
+relatorio_ciclo() registra no log os totais do ciclo e avisa quando uma única
+chamada de uma função enviou mais que PERFIL_NAVEGADOR_ORCAMENTO comandos.
+"""
+import os, sys, time, threading
+from dotenv import load_dotenv
+from loggingConfig import get_logger
+
+load_dotenv()
+logger = get_logger(__name__)
+
+PERFIL_NAVEGADOR = os.environ.get("PERFIL_NAVEGADOR", "0") == "1"
+PERFIL_NAVEGADOR_ORCAMENTO = int(os.environ.get("PERFIL_NAVEGADOR_ORCAMENTO", 200))
+PERFIL_NAVEGADOR_TOP = int(os.environ.get("PERFIL_NAVEGADOR_TOP", 10))
+
+# Frames destes arquivos não contam como chamador
+IGNORAR_CHAMADORES = (os.sep + "selenium" + os.sep, os.path.abspath(__file__))
+
+trava = threading.Lock()
+comandos = {}   # comando -> [quantidade, segundos]
+chamadores = {} # "modulo.funcao" -> {"quantidade", "segundos", "chamadas", "maximo", "atual", "frame"}
+
+def identificar_chamador():
+    """Retorna (frame, "modulo.funcao") do primeiro frame fora do Selenium e deste módulo"""
+    frame = sys._getframe(2)
+    while frame is not None:
+        arquivo = frame.f_code.co_filename
+        if not any(trecho in arquivo for trecho in IGNORAR_CHAMADORES):
+            modulo = os.path.splitext(os.path.basename(arquivo))[0]
+            return frame, f"{modulo}.{frame.f_code.co_name}"
+        frame = frame.f_back
+    return None, "desconhecido"
+
+def registrar_comando(comando, duracao, frame, chamador):
+    with trava:
+        total = comandos.setdefault(comando, [0, 0.0])
+        total[0] += 1
+        total[1] += duracao
+
+        dados = chamadores.get(chamador)
+        if dados is None:
+            dados = chamadores[chamador] = {"quantidade": 0, "segundos": 0.0, "chamadas": 0, "maximo": 0, "atual": 0, "frame": None}
+        # Um frame diferente indica uma nova chamada da função; a referência ao último
+        # frame evita que o endereço seja reaproveitado pela chamada seguinte
+        if dados["frame"] is not frame:
+            dados["frame"] = frame
+            dados["chamadas"] += 1
+            dados["atual"] = 0
+        dados["quantidade"] += 1
+        dados["segundos"] += duracao
+        dados["atual"] += 1
+        dados["maximo"] = max(dados["maximo"], dados["atual"])
+
+def instrumentar(navegador):
+    """Passa a medir os comandos enviados por `navegador` (sem efeito com o perfil desativado)"""
+    if not PERFIL_NAVEGADOR or getattr(navegador, "perfil_instrumentado", False):
+        return navegador
+    execute_original = navegador.execute
+
+    def execute(comando, parametros=None):
+        frame, chamador = identificar_chamador()
+        inicio = time.perf_counter()
+        try:
+            return execute_original(comando, parametros)
+        finally:
+            registrar_comando(comando, time.perf_counter() - inicio, frame, chamador)
+
+    navegador.execute = execute
+    navegador.perfil_instrumentado = True
+    return navegador
+
+def relatorio_ciclo(ciclo):
+    """Registra os totais de comandos desde o último relatório e zera as contagens"""
+    global comandos, chamadores
+    if not PERFIL_NAVEGADOR:
+        return None
+    with trava:
+        por_comando, por_chamador = comandos, chamadores
+        comandos, chamadores = {}, {}
+    for dados in por_chamador.values():
+        dados.pop("frame", None)
+    if not por_comando:
+        return None
+
+    total = sum(quantidade for quantidade, _ in por_comando.values())
+    segundos = sum(duracao for _, duracao in por_comando.values())
+    logger.info(f"Comandos WebDriver no ciclo '{ciclo}': {total} em {segundos:.1f}s "
+                f"(média {segundos / total * 1000:.0f}ms por ida e volta)")
+    for comando, (quantidade, duracao) in sorted(por_comando.items(), key=lambda item: -item[1][0])[:PERFIL_NAVEGADOR_TOP]:
+        logger.info(f"  {comando:<28} {quantidade:>7}  {duracao:>8.1f}s  {duracao / quantidade * 1000:>6.0f}ms")
+    logger.info("  Por função chamadora:")
+    for chamador, dados in sorted(por_chamador.items(), key=lambda item: -item[1]["quantidade"])[:PERFIL_NAVEGADOR_TOP]:
+        logger.info(f"  {chamador:<40} {dados['quantidade']:>7} comandos em {dados['chamadas']} chamadas "
+                    f"(máx. {dados['maximo']} por chamada)  {dados['segundos']:>8.1f}s")
+
+    for chamador, dados in por_chamador.items():
+        if dados["maximo"] > PERFIL_NAVEGADOR_ORCAMENTO:
+            logger.warning(f"{chamador} enviou {dados['maximo']} comandos WebDriver em uma única chamada "
+                           f"(orçamento {PERFIL_NAVEGADOR_ORCAMENTO})")
+    return {"comandos": por_comando, "chamadores": por_chamador}
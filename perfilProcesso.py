@@ -0,0 +1,188 @@
+"""
+Captura sob demanda de cProfile e tracemalloc nos serviços de longa duração.
+
+Sem reiniciar o serviço, um perfil é pedido com:
+
+    kill -USR1 <pid>
+    echo 5 > <diretório de execução>/profile.request   # opcional: número de ciclos
+
+O laço do serviço chama marcar_ciclo() no início de cada iteração. Os próximos
+N ciclos (conteúdo do arquivo, ou PERFIL_CICLOS) rodam sob cProfile e entre um
+snapshot tracemalloc e outro. Ao final são gravados em logs/perfil/:
+
+    <servico>_<AAAAMMDD-HHMMSS>.pstats     (abrir com python -m pstats)
+    <servico>_<AAAAMMDD-HHMMSS>_memoria.txt (maiores diferenças de alocação)
+
+e um resumo com as funções mais caras e as maiores alocações vai para o log.
+
+O cProfile só acompanha a thread em que foi ligado. Os ciclos são contados na
+thread que chamou instalar(); as demais entram na captura por trechos: cada
+chamada de executar_perfilado() (executor do orquestrador) ou o intervalo entre
+duas chamadas de marcar_ciclo() em outra thread (monitoramento do gerenciar) é
+perfilado à parte e somado ao .pstats. O trecho ainda aberto quando a captura
+termina fica de fora.
+"""
+import os, io, sys, time, atexit, signal, pstats, cProfile, threading, tracemalloc
+from dotenv import load_dotenv
+from loggingConfig import get_logger, get_execution_path
+
+load_dotenv()
+logger = get_logger(__name__)
+
+PERFIL_CICLOS = int(os.environ.get("PERFIL_CICLOS", 3))
+PERFIL_ARQUIVO_PEDIDO = os.environ.get("PERFIL_ARQUIVO_PEDIDO") or os.path.join(get_execution_path(), "profile.request")
+PERFIL_DIRETORIO = os.environ.get("PERFIL_DIRETORIO") or os.path.join(get_execution_path(), "logs", "perfil")
+PERFIL_TOP = int(os.environ.get("PERFIL_TOP", 20))
+PERFIL_QUADROS_TRACEMALLOC = int(os.environ.get("PERFIL_QUADROS_TRACEMALLOC", 1))
+
+servico = os.path.splitext(os.path.basename(sys.argv[0]))[0]
+ciclos_padrao = PERFIL_CICLOS
+pedido = None   # ciclos pedidos e ainda não iniciados
+captura = None  # captura em andamento
+thread_ciclos = threading.main_thread().ident  # thread que conta os ciclos (a do instalar)
+trava_captura = threading.Lock()
+trecho_thread = threading.local()  # trecho perfilado da thread atual, se houver
+
+def tirar_snapshot():
+    """Snapshot sem as alocações do próprio tracemalloc e deste módulo"""
+    return tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, os.path.abspath(__file__)),
+    ))
+
+def instalar(nome_servico, ciclos=None):
+    """Registra o SIGUSR1 para pedir um perfil (apenas na thread principal)"""
+    global servico, ciclos_padrao, thread_ciclos
+    servico = nome_servico
+    ciclos_padrao = ciclos or PERFIL_CICLOS
+    thread_ciclos = threading.get_ident()
+    if hasattr(signal, "SIGUSR1") and threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGUSR1, lambda sig, frame: pedir_perfil())
+    logger.info(f"Perfil sob demanda: kill -USR1 {os.getpid()} ou crie {PERFIL_ARQUIVO_PEDIDO}")
+
+def pedir_perfil(ciclos=None):
+    global pedido
+    pedido = ciclos or ciclos_padrao
+
+def verificar_arquivo_pedido():
+    """Consome o arquivo de pedido, se existir; o conteúdo opcional é o número de ciclos"""
+    try:
+        with open(PERFIL_ARQUIVO_PEDIDO, "r", encoding="utf-8") as f:
+            conteudo = f.read().strip()
+        os.remove(PERFIL_ARQUIVO_PEDIDO)
+    except FileNotFoundError:
+        return
+    except OSError as erro:
+        logger.warning(f"Não foi possível ler o pedido de perfil {PERFIL_ARQUIVO_PEDIDO}: {erro}")
+        return
+    pedir_perfil(int(conteudo) if conteudo.isdigit() and int(conteudo) > 0 else None)
+
+def marcar_ciclo():
+    """
+    Fronteira entre ciclos do laço: inicia, conta ou encerra a captura pendente.
+
+    Em outra thread que não a do instalar() apenas fecha o trecho perfilado dela e
+    abre o próximo, sem contar ciclos.
+    """
+    global pedido
+    if threading.get_ident() != thread_ciclos:
+        encerrar_trecho()
+        iniciar_trecho()
+        return
+
+    if captura is not None:
+        captura["restantes"] -= 1
+        if captura["restantes"] > 0:
+            return
+        finalizar_captura()
+
+    verificar_arquivo_pedido()
+    if pedido is None:
+        return
+    ciclos, pedido = pedido, None
+    iniciar_captura(ciclos)
+
+def iniciar_captura(ciclos):
+    global captura
+    iniciou_tracemalloc = not tracemalloc.is_tracing()
+    if iniciou_tracemalloc:
+        tracemalloc.start(PERFIL_QUADROS_TRACEMALLOC)
+    perfil = cProfile.Profile()
+    with trava_captura:
+        captura = {"perfil": perfil, "trechos": [], "ciclos": ciclos, "restantes": ciclos, "inicio": time.time(),
+                   "snapshot": tirar_snapshot(), "iniciou_tracemalloc": iniciou_tracemalloc}
+    logger.info(f"Perfil iniciado para os próximos {ciclos} ciclos de {servico}")
+    perfil.enable()
+
+def iniciar_trecho():
+    """Perfila a thread atual até encerrar_trecho(), se houver captura em andamento"""
+    atual = captura
+    if atual is None:
+        return
+    perfil = cProfile.Profile()
+    trecho_thread.trecho = (atual, perfil)
+    perfil.enable()
+
+def encerrar_trecho():
+    """Desliga o perfil do trecho da thread atual e o soma à captura, se ela ainda estiver em andamento"""
+    trecho = getattr(trecho_thread, "trecho", None)
+    if trecho is None:
+        return
+    trecho_thread.trecho = None
+    atual, perfil = trecho
+    perfil.disable()
+    with trava_captura:
+        if captura is atual:
+            atual["trechos"].append(perfil)
+
+def executar_perfilado(funcao, *argumentos):
+    """Executa `funcao` como um trecho da captura em andamento (usado nas threads do orquestrador)"""
+    # Na thread dos ciclos o perfil da captura já está ligado
+    if captura is None or threading.get_ident() == thread_ciclos:
+        return funcao(*argumentos)
+    iniciar_trecho()
+    try:
+        return funcao(*argumentos)
+    finally:
+        encerrar_trecho()
+
+def finalizar_captura():
+    """Encerra a captura em andamento e grava .pstats e o diff de memória"""
+    global captura
+    with trava_captura:
+        if captura is None:
+            return
+        atual, captura = captura, None
+    atual["perfil"].disable()
+    snapshot = tirar_snapshot()
+    if atual["iniciou_tracemalloc"]:
+        tracemalloc.stop()
+
+    os.makedirs(PERFIL_DIRETORIO, exist_ok=True)
+    base = os.path.join(PERFIL_DIRETORIO, f"{servico}_{time.strftime('%Y%m%d-%H%M%S', time.localtime(atual['inicio']))}")
+    texto = io.StringIO()
+    perfis = []
+    for perfil in (atual["perfil"], *atual["trechos"]):
+        perfil.create_stats()
+        if perfil.stats:  # pstats não aceita perfis vazios
+            perfis.append(perfil)
+    estatisticas = pstats.Stats(*perfis, stream=texto)
+    estatisticas.dump_stats(f"{base}.pstats")
+    estatisticas.sort_stats("cumulative").print_stats(PERFIL_TOP)
+    diferencas = snapshot.compare_to(atual["snapshot"], "lineno")
+    with open(f"{base}_memoria.txt", "w", encoding="utf-8") as f:
+        for diferenca in diferencas[:PERFIL_TOP * 5]:
+            f.write(f"{diferenca}\n")
+
+    duracao = time.time() - atual["inicio"]
+    logger.info(f"Perfil de {atual['ciclos'] - max(atual['restantes'], 0)} ciclos ({duracao:.0f}s, "
+                f"{len(atual['trechos'])} trechos de outras threads) gravado em {base}.pstats")
+    for linha in texto.getvalue().splitlines():
+        if linha.strip():
+            logger.info(f"  {linha}")
+    logger.info(f"Maiores diferenças de alocação (detalhes em {base}_memoria.txt):")
+    for diferenca in diferencas[:PERFIL_TOP // 2]:
+        logger.info(f"  {diferenca}")
+
+# Serviço encerrado no meio de uma captura: grava o que foi coletado
+atexit.register(finalizar_captura)
@@ -0,0 +1,124 @@
+"""
+Spans de tempo por etapa, gravados em JSONL, com resumo de percentis por ciclo.
+
+    with rastreamento.span("atualizar_solicitacao"):
+        ...
+
+    @rastreamento.rastrear("inserir_datas_formulario")
+    def inserir_datas_formulario(...):
+
+Spans abertos dentro de outro herdam seus atributos (solicitação, IE) e apontam
+para ele como pai. Cada span vira uma linha em RASTREAMENTO_ARQUIVO (padrão
+logs/spans_<script>.jsonl, rotacionado ao passar de RASTREAMENTO_TAMANHO_MAXIMO
+bytes; RASTREAMENTO=0 desativa o arquivo). As durações também são acumuladas em
+memória e resumir_ciclo() registra no log p50/p90/p99 por etapa.
+"""
+import os, sys, json, time, uuid, functools, threading, contextvars
+from contextlib import contextmanager
+from datetime import datetime
+from dotenv import load_dotenv
+from loggingConfig import get_logger, get_execution_path
+
+load_dotenv()
+logger = get_logger(__name__)
+
+RASTREAMENTO = os.environ.get("RASTREAMENTO", "1") != "0"
+RASTREAMENTO_ARQUIVO = os.environ.get("RASTREAMENTO_ARQUIVO") or os.path.join(
+    get_execution_path(), "logs", f"spans_{os.path.splitext(os.path.basename(sys.argv[0]))[0]}.jsonl")
+RASTREAMENTO_TAMANHO_MAXIMO = int(os.environ.get("RASTREAMENTO_TAMANHO_MAXIMO", 50 * 1024 * 1024))
+
+# Span corrente da thread/tarefa: (id, rastro, atributos)
+span_atual = contextvars.ContextVar("span_atual", default=None)
+
+trava = threading.Lock()
+arquivo_spans = None
+duracoes = {}  # nome -> [segundos, ...] desde o último resumo
+
+def gravar_span(registro):
+    global arquivo_spans
+    if not RASTREAMENTO:
+        return
+    linha = json.dumps(registro, ensure_ascii=False, default=str) + "\n"
+    with trava:
+        try:
+            if arquivo_spans is None:
+                os.makedirs(os.path.dirname(RASTREAMENTO_ARQUIVO), exist_ok=True)
+                arquivo_spans = open(RASTREAMENTO_ARQUIVO, "a", encoding="utf-8", buffering=1)
+            elif arquivo_spans.tell() > RASTREAMENTO_TAMANHO_MAXIMO:
+                arquivo_spans.close()
+                os.replace(RASTREAMENTO_ARQUIVO, f"{RASTREAMENTO_ARQUIVO}.1")
+                arquivo_spans = open(RASTREAMENTO_ARQUIVO, "a", encoding="utf-8", buffering=1)
+            arquivo_spans.write(linha)
+        except OSError as erro:
+            logger.debug(f"Erro ao gravar span em {RASTREAMENTO_ARQUIVO}: {erro}")
+
+@contextmanager
+def span(nome, **atributos):
+    """Mede o bloco como um span `nome`; atributos são herdados pelos spans internos"""
+    pai = span_atual.get()
+    id_span = uuid.uuid4().hex[:16]
+    rastro = pai[1] if pai else id_span
+    atributos = dict(pai[2], **atributos) if pai else atributos
+    token = span_atual.set((id_span, rastro, atributos))
+    inicio_relogio = time.time()
+    inicio = time.perf_counter()
+    erro = None
+    try:
+        yield
+    except BaseException as excecao:
+        erro = type(excecao).__name__
+        raise
+    finally:
+        duracao = time.perf_counter() - inicio
+        span_atual.reset(token)
+        with trava:
+            duracoes.setdefault(nome, []).append(duracao)
+        registro = {"nome": nome, "inicio": datetime.fromtimestamp(inicio_relogio).isoformat(timespec="milliseconds"),
+                    "duracao_ms": round(duracao * 1000, 3), "span": id_span, "pai": pai[0] if pai else None,
+                    "rastro": rastro, **atributos}
+        if erro:
+            registro["erro"] = erro
+        gravar_span(registro)
+
+def rastrear(nome=None, atributos=None):
+    """
+    Decorador que mede cada chamada como um span. `atributos`, se informado,
+    recebe os mesmos argumentos da função e retorna os atributos do span.
+    """
+    def decorador(funcao):
+        nome_span = nome or funcao.__name__
+
+        @functools.wraps(funcao)
+        def envoltorio(*args, **kwargs):
+            with span(nome_span, **(atributos(*args, **kwargs) if atributos else {})):
+                return funcao(*args, **kwargs)
+        return envoltorio
+    return decorador
+
+def percentil(valores_ordenados, fracao):
+    """Percentil por interpolação linear sobre valores já ordenados"""
+    posicao = (len(valores_ordenados) - 1) * fracao
+    inferior = int(posicao)
+    superior = min(inferior + 1, len(valores_ordenados) - 1)
+    return valores_ordenados[inferior] + (valores_ordenados[superior] - valores_ordenados[inferior]) * (posicao - inferior)
+
+def resumir_ciclo(ciclo):
+    """Registra p50/p90/p99/máx e total por etapa desde o último resumo e zera as medições"""
+    global duracoes
+    with trava:
+        medidas, duracoes = duracoes, {}
+    if not medidas:
+        return {}
+
+    resumo = {}
+    for nome, valores in medidas.items():
+        valores.sort()
+        resumo[nome] = {"quantidade": len(valores), "p50": percentil(valores, 0.5), "p90": percentil(valores, 0.9),
+                        "p99": percentil(valores, 0.99), "max": valores[-1], "total": sum(valores)}
+
+    logger.info(f"Tempos por etapa do ciclo '{ciclo}' (segundos):")
+    for nome, estatisticas in sorted(resumo.items(), key=lambda item: -item[1]["total"]):
+        logger.info(f"  {nome:<28} n={estatisticas['quantidade']:<5} p50={estatisticas['p50']:.2f} "
+                    f"p90={estatisticas['p90']:.2f} p99={estatisticas['p99']:.2f} "
+                    f"max={estatisticas['max']:.2f} total={estatisticas['total']:.1f}")
+    return resumo
@@ -0,0 +1,244 @@
+"""
+Reconciliação de lacunas entre os dias esperados de cada empresa e as notas armazenadas.
+
+Compara empresas ativas × dias do período com o que a ingestão já guardou,
+seja pelos nomes das pastas {data_ini}_{data_fim}_{ie} em DIRETORIO_FINAL (uma
+passada de scandir) ou pelo catálogo nfce.notas. Empresa-dias sem notas e sem
+solicitação recebem uma nova solicitação, inseridas em lote.
+
+Uso:
+    python reconciliarLacunas.py [--inicio DD/MM/AAAA] [--fim DD/MM/AAAA] [--ie IE]
+                                 [--fonte pastas|catalogo] [--simular] [--saida lacunas.json]
+"""
+import os, re, sys, json, argparse
+from datetime import datetime, timedelta
+from psycopg2.extras import execute_values
+from dotenv import load_dotenv
+from loggingConfig import get_logger
+from utils import conectar_postgres
+
+load_dotenv()
+logger = get_logger(__name__)
+
+DIRETORIO_FINAL = os.environ.get("DIRETORIO_FINAL")
+# Mesmo atraso usado pelo startList ao criar as solicitações diárias
+DIAS_ATRASO = int(os.environ.get("DIAS_ATRASO_SOLICITACAO", 5))
+PADRAO_PASTA_JOB = re.compile(r'^(\d{8})_(\d{8})_(\d+)$')
+
+def listar_empresas_ativas(inscricao_estadual=None):
+    """Retorna as inscrições estaduais das empresas ativas"""
+    conexao = conectar_postgres()
+    if not conexao: return None
+    cursor = conexao.cursor()
+    try:
+        if inscricao_estadual:
+            cursor.execute("SELECT inscricao_estadual FROM nfce.empresas WHERE status_empresa = 'A' AND inscricao_estadual = %s", (inscricao_estadual,))
+        else:
+            cursor.execute("SELECT inscricao_estadual FROM nfce.empresas WHERE status_empresa = 'A'")
+        return [ie for (ie,) in cursor.fetchall()]
+    except Exception as erro:
+        logger.error(f"Erro ao listar empresas ativas: {erro}")
+        return None
+    finally:
+        cursor.close()
+        conexao.close()
+
+def dias_cobertos_por_pastas(empresas, inicio, fim):
+    """
+    Percorre DIRETORIO_FINAL/<empresa>/ uma única vez e retorna os (ie, dia)
+    cobertos pelas pastas de jobs no formato {data_ini}_{data_fim}_{ie}.
+    """
+    cobertos = set()
+    with os.scandir(DIRETORIO_FINAL) as pastas_empresa:
+        for pasta_empresa in pastas_empresa:
+            if not pasta_empresa.is_dir() or pasta_empresa.name == "ERROS":
+                continue
+            with os.scandir(pasta_empresa.path) as pastas_job:
+                for pasta_job in pastas_job:
+                    match = PADRAO_PASTA_JOB.match(pasta_job.name)
+                    if not match or match.group(3) not in empresas or not pasta_job.is_dir():
+                        continue
+                    try:
+                        dia = max(datetime.strptime(match.group(1), '%Y%m%d').date(), inicio)
+                        ultimo = min(datetime.strptime(match.group(2), '%Y%m%d').date(), fim)
+                    except ValueError:
+                        continue  # 00000000: job sem data de emissão
+                    while dia <= ultimo:
+                        cobertos.add((match.group(3), dia))
+                        dia += timedelta(days=1)
+    return cobertos
+
+def dias_cobertos_por_catalogo(empresas, inicio, fim):
+    """Retorna os (ie, dia) com ao menos uma nota em nfce.notas"""
+    conexao = conectar_postgres()
+    if not conexao: return None
+    cursor = conexao.cursor()
+    try:
+        # dh_emi guarda o fuso da SEFAZ; o dia da nota é o dia local da emissão
+        cursor.execute("""
+            SELECT DISTINCT inscricao_estadual, (dh_emi AT TIME ZONE 'America/Fortaleza')::date
+            FROM nfce.notas
+            WHERE inscricao_estadual = ANY(%s) AND dh_emi >= %s AND dh_emi < %s
+        """, (list(empresas), inicio, fim + timedelta(days=1)))
+        return set(cursor.fetchall())
+    except Exception as erro:
+        logger.error(f"Erro ao consultar o catálogo de notas: {erro}")
+        return None
+    finally:
+        cursor.close()
+        conexao.close()
+
+def listar_solicitacoes_existentes(empresas, inicio, fim):
+    """Retorna {(ie, dia): finalizado} das solicitações NFCE do período"""
+    conexao = conectar_postgres()
+    if not conexao: return None
+    cursor = conexao.cursor()
+    try:
+        cursor.execute("""
+            SELECT inscricao_estadual, to_date(data_ini, 'DD/MM/YYYY'), bool_or(finalizado)
+            FROM nfce.solicitacoes
+            WHERE tipo = 'NFCE' AND inscricao_estadual = ANY(%s)
+              AND to_date(data_ini, 'DD/MM/YYYY') BETWEEN %s AND %s
+            GROUP BY 1, 2
+        """, (list(empresas), inicio, fim))
+        return {(ie, dia): finalizado for ie, dia, finalizado in cursor.fetchall()}
+    except Exception as erro:
+        logger.error(f"Erro ao listar solicitações existentes: {erro}")
+        return None
+    finally:
+        cursor.close()
+        conexao.close()
+
+def agrupar_intervalos(dias):
+    """Agrupa dias ordenados em intervalos contínuos [(inicio, fim), ...]"""
+    intervalos = []
+    for dia in sorted(dias):
+        if intervalos and dia - intervalos[-1][1] == timedelta(days=1):
+            intervalos[-1][1] = dia
+        else:
+            intervalos.append([dia, dia])
+    return [(ini, fim) for ini, fim in intervalos]
+
+def inserir_solicitacoes(lacunas):
+    """Insere em lote uma solicitação NFCE para cada (ie, dia)"""
+    conexao = conectar_postgres()
+    if not conexao: return 0
+    cursor = conexao.cursor()
+    try:
+        linhas = [(ie, "NFCE", dia.strftime('%d/%m/%Y'), dia.strftime('%d/%m/%Y'), 0, 0, False) for ie, dia in sorted(lacunas)]
+        execute_values(cursor, """
+            INSERT INTO nfce.solicitacoes (inscricao_estadual, tipo, data_ini, data_fim, solicitado, baixado, finalizado)
+            VALUES %s""", linhas, page_size=1000)
+        conexao.commit()
+        return len(linhas)
+    except Exception as erro:
+        conexao.rollback()
+        logger.error(f"Erro ao inserir solicitações de lacunas: {erro}")
+        return 0
+    finally:
+        cursor.close()
+        conexao.close()
+
+def reconciliar_lacunas(inicio, fim, inscricao_estadual=None, fonte="pastas", simular=False):
+    """
+    Calcula as lacunas do período e cria as solicitações que faltam.
+
+    Retorna:
+        dict: Contagens e as lacunas agrupadas por IE em intervalos de dias.
+        None: Em caso de falha ao consultar o banco ou a árvore final.
+    """
+    empresas = listar_empresas_ativas(inscricao_estadual)
+    if empresas is None:
+        return None
+    empresas = set(empresas)
+    logger.info(f"Reconciliando {len(empresas)} empresas de {inicio:%d/%m/%Y} a {fim:%d/%m/%Y} (fonte: {fonte})")
+
+    if fonte == "catalogo":
+        cobertos = dias_cobertos_por_catalogo(empresas, inicio, fim)
+    else:
+        if not DIRETORIO_FINAL or not os.path.isdir(DIRETORIO_FINAL):
+            logger.error(f"DIRETORIO_FINAL inválido: {DIRETORIO_FINAL}")
+            return None
+        cobertos = dias_cobertos_por_pastas(empresas, inicio, fim)
+    solicitacoes = listar_solicitacoes_existentes(empresas, inicio, fim)
+    if cobertos is None or solicitacoes is None:
+        return None
+
+    dias = [inicio + timedelta(days=i) for i in range((fim - inicio).days + 1)]
+    sem_solicitacao = set()
+    finalizadas_sem_notas = set()
+    for ie in empresas:
+        for dia in dias:
+            if (ie, dia) in cobertos:
+                continue
+            finalizado = solicitacoes.get((ie, dia))
+            if finalizado is None:
+                sem_solicitacao.add((ie, dia))
+            elif finalizado:
+                finalizadas_sem_notas.add((ie, dia))
+
+    lacunas = {}
+    for ie, dia in sem_solicitacao:
+        lacunas.setdefault(ie, []).append(dia)
+
+    resultado = {
+        "esperados": len(empresas) * len(dias),
+        "cobertos": len(cobertos),
+        "em_andamento": sum(1 for chave, finalizado in solicitacoes.items() if not finalizado and chave not in cobertos),
+        "finalizadas_sem_notas": len(finalizadas_sem_notas),
+        "lacunas": len(sem_solicitacao),
+        "inseridas": 0,
+        "intervalos": {
+            ie: [f"{ini:%d/%m/%Y}" if ini == fim_intervalo else f"{ini:%d/%m/%Y}-{fim_intervalo:%d/%m/%Y}"
+                 for ini, fim_intervalo in agrupar_intervalos(dias_ie)]
+            for ie, dias_ie in sorted(lacunas.items())
+        }
+    }
+
+    if sem_solicitacao and not simular:
+        resultado["inseridas"] = inserir_solicitacoes(sem_solicitacao)
+
+    logger.info(
+        f"Reconciliação: {resultado['esperados']} empresa-dias esperados, {resultado['cobertos']} com notas, "
+        f"{resultado['em_andamento']} em andamento, {resultado['finalizadas_sem_notas']} finalizados sem notas, "
+        f"{resultado['lacunas']} lacunas, {resultado['inseridas']} solicitações inseridas"
+    )
+    return resultado
+
+def main():
+    hoje = datetime.now().date()
+    argumentos = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    argumentos.add_argument("--inicio", help="data inicial DD/MM/AAAA (padrão: um ano antes da data final)")
+    argumentos.add_argument("--fim", help=f"data final DD/MM/AAAA (padrão: hoje - {DIAS_ATRASO} dias)")
+    argumentos.add_argument("--ie", help="reconciliar apenas esta inscrição estadual")
+    argumentos.add_argument("--fonte", choices=("pastas", "catalogo"), default="pastas", help="origem das notas armazenadas")
+    argumentos.add_argument("--simular", action="store_true", help="apenas calcular as lacunas, sem inserir solicitações")
+    argumentos.add_argument("--saida", help="gravar o resultado em JSON neste arquivo")
+    opcoes = argumentos.parse_args()
+
+    try:
+        fim = datetime.strptime(opcoes.fim, "%d/%m/%Y").date() if opcoes.fim else hoje - timedelta(days=DIAS_ATRASO)
+        inicio = datetime.strptime(opcoes.inicio, "%d/%m/%Y").date() if opcoes.inicio else fim - timedelta(days=365)
+    except ValueError:
+        print("Data inválida! Use o formato DD/MM/AAAA.")
+        sys.exit(2)
+    if inicio > fim:
+        print("A data final deve ser igual ou posterior à data inicial!")
+        sys.exit(2)
+
+    resultado = reconciliar_lacunas(inicio, fim, opcoes.ie, opcoes.fonte, opcoes.simular)
+    if resultado is None:
+        sys.exit(1)
+
+    for ie, intervalos in resultado["intervalos"].items():
+        print(f"{ie}: {', '.join(intervalos)}")
+    print(f"\n{resultado['lacunas']} lacunas em {len(resultado['intervalos'])} empresas; "
+          f"{resultado['inseridas']} solicitações inseridas; "
+          f"{resultado['finalizadas_sem_notas']} dias finalizados sem notas")
+
+    if opcoes.saida:
+        with open(opcoes.saida, 'w', encoding='utf-8') as f:
+            json.dump(resultado, f, ensure_ascii=False, indent=2)
+
+if __name__ == "__main__":
+    main()
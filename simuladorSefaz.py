@@ -0,0 +1,552 @@
+"""
+WebDriver falso em memória e portal ATF da SEFAZ simulado, para medir e exercitar
+as etapas com navegador sem acesso ao portal.
+
+O NavegadorFalso implementa o subconjunto da API do WebDriver usado pelo projeto
+(get, find_element(s), switch_to.frame/default_content, execute_script, click,
+send_keys, clear, text, get_attribute, quit) sobre páginas geradas pelo
+SiteSefazFalso: login, formulário de solicitação (com iframe de pesquisa do
+contribuinte), caixa de downloads e mensagens com ou sem anexo. O clique no
+link de download grava um ZIP no diretório de download da sessão.
+
+Cada comando passa por execute(), onde são aplicadas a latência e a injeção de
+falhas configuradas (o perfilNavegador também o instrumenta normalmente).
+
+Com SELENOID_URL=simulado:// o iniciar_navegador_selenoid usa este simulador;
+nesse caso a configuração vem do ambiente:
+
+    SIMULADOR_LATENCIA        segundos por comando (padrão 0)
+    SIMULADOR_TAXA_FALHA      probabilidade de falha em get() e click() (padrão 0)
+    SIMULADOR_SEMENTE         semente do gerador aleatório (padrão 0)
+    SIMULADOR_TEMPO_DOWNLOAD  segundos com o arquivo em .crdownload (padrão 0)
+
+As XPaths do site simulado estão em XPATHS; configurar_ambiente() as publica nas
+variáveis XPATH_* lidas pelo projeto, junto com as URLs do simulador.
+"""
+import os, re, io, time, random, zipfile, threading
+from datetime import datetime
+from selenium.webdriver.common.by import By
+from selenium.common.exceptions import NoSuchElementException, NoSuchFrameException, WebDriverException
+
+# Referência própria: benchmarks podem trocar time.sleep para eliminar as pausas das etapas
+dormir = time.sleep
+
+URL_BASE = "https://simulador.sefaz.local/atf"
+URL_LOGIN = f"{URL_BASE}/login"
+URL_FORMULARIO = f"{URL_BASE}/fis/solicitacao-xml"
+URL_CAIXA = f"{URL_BASE}/seg/caixa-downloads"
+URL_DOWNLOAD = f"{URL_BASE}/seg/download"
+
+ASSUNTO_NFCE = "FIS_1484 - Arquivos XML de NFC-e"
+
+XPATHS = {
+    "XPATH_CAMPO_LOGIN": "//input[@id='login']",
+    "XPATH_CAMPO_SENHA": "//input[@id='senha']",
+    "XPATH_BOTAO_AVANCAR": "//button[@id='avancar']",
+    "XPATH_DATA_INICIO": "//input[@id='dataInicio']",
+    "XPATH_DATA_FIM": "//input[@id='dataFim']",
+    "XPATH_IFRAME": "//iframe[@id='pesquisaContribuinte']",
+    "XPATH_CAMPO_VALOR": "//input[@id='valor']",
+    "XPATH_BOTAO_PESQUISAR": "//button[@id='pesquisar']",
+    "XPATH_DROPDOWN_XML": "//select[@id='formato']",
+    "XPATH_OPCAO_XML": "//select[@id='formato']/option[@value='XML']",
+    "XPATH_BOTAO_EXECUTAR": "//button[@id='executar']",
+    "XPATH_IMAGEM_ANEXO": "//img[@alt='Anexo']",
+    "XPATH_LINK_DOWNLOAD": "//a[@id='baixarAnexo']",
+    "XPATH_CORPO_MENSAGEM": "//div[@id='corpoMensagem']",
+}
+
+# Corpo das mensagens sem anexo, por resultado (ver localizarLinks.PADROES_RESULTADO)
+TEXTOS_RESULTADO = {
+    "SEM_DADOS": "Não foram encontrados documentos para os parâmetros informados.",
+    "MUITO_GRANDE": "O resultado excedeu o tamanho máximo permitido. Reduza o período da consulta.",
+    "ERRO_PROCESSAMENTO": "Ocorreu um erro no processamento da solicitação. Tente novamente mais tarde.",
+}
+
+# Menu e rodapé das páginas de mensagem: textos fora do corpo que lembram os resultados acima
+MENU_PORTAL = ("Início", "Minhas Mensagens", "Nenhuma nota pendente de ciência", "Sair")
+RODAPE_PORTAL = ("SEFAZ-PB - Em caso de erro ou sistema indisponível, tente novamente mais tarde. "
+                 "Não há registros de manutenção programada.")
+
+def configurar_ambiente():
+    """Aponta URLs, XPaths e Selenoid do projeto para o simulador"""
+    os.environ.update(XPATHS)
+    os.environ.update(SELENOID_URL="simulado://", URL_LOGIN=URL_LOGIN,
+                      LINK_SEFAZ_NFCE=URL_FORMULARIO, URL_CAIXA_DOWNLOADS=URL_CAIXA)
+
+# ============================================
+# DOM SIMPLIFICADO
+# ============================================
+
+PADRAO_PASSO = re.compile(r"(//|/)?([\w*-]+|\.)((?:\[[^\]]+\])*)")
+PADRAO_PREDICADO = re.compile(r"\[([^\]]+)\]")
+PADRAO_ATRIBUTO = re.compile(r"""^@([\w-]+)\s*=\s*['"](.*)['"]$""")
+PADRAO_TEXTO = re.compile(r"""^text\(\)\s*=\s*['"](.*)['"]$""")
+
+class No:
+    """Elemento do DOM simulado"""
+
+    def __init__(self, tag, atributos=None, texto="", filhos=(), ao_clicar=None, documento=None):
+        self.tag = tag
+        self.atributos = dict(atributos or {})
+        self.texto = texto
+        self.filhos = []
+        self.pai = None
+        self.ao_clicar = ao_clicar
+        self.documento = documento  # conteúdo de um iframe
+        for filho in filhos:
+            self.adicionar(filho)
+
+    def adicionar(self, filho):
+        filho.pai = self
+        self.filhos.append(filho)
+        return filho
+
+    def descendentes(self):
+        for filho in self.filhos:
+            yield filho
+            yield from filho.descendentes()
+
+    def texto_visivel(self):
+        partes = [self.texto] + [filho.texto_visivel() for filho in self.filhos]
+        return " ".join(parte for parte in partes if parte).strip()
+
+def aplicar_predicado(nos, predicado):
+    predicado = predicado.strip()
+    if predicado.isdigit():
+        indice = int(predicado) - 1
+        return nos[indice:indice + 1] if 0 <= indice < len(nos) else []
+    atributo = PADRAO_ATRIBUTO.match(predicado)
+    if atributo:
+        nome, valor = atributo.groups()
+        return [no for no in nos if no.atributos.get(nome) == valor]
+    texto = PADRAO_TEXTO.match(predicado)
+    if texto:
+        return [no for no in nos if no.texto == texto.group(1)]
+    raise WebDriverException(f"Predicado XPath não suportado pelo simulador: [{predicado}]")
+
+def avaliar_xpath(contexto, expressao):
+    """
+    Avalia o subconjunto de XPath usado pelo projeto: passos / e //, tag ou *,
+    predicados [n], [@atributo='valor'] e [text()='valor'], relativo (./) ou absoluto.
+    """
+    if expressao.startswith("."):
+        expressao = expressao[1:]
+        atuais = [contexto]
+    else:
+        atuais = [raiz_documento(contexto)]
+    if not expressao.startswith("/"):
+        expressao = "/" + expressao
+
+    posicao = 0
+    while posicao < len(expressao):
+        passo = PADRAO_PASSO.match(expressao, posicao)
+        if not passo or passo.end() == posicao:
+            raise WebDriverException(f"XPath não suportada pelo simulador: {expressao}")
+        posicao = passo.end()
+        eixo, tag, predicados = passo.groups()
+        proximos, vistos = [], set()
+        for no in atuais:
+            candidatos = list(no.descendentes()) if eixo == "//" else no.filhos
+            selecionados = [candidato for candidato in candidatos if tag == "*" or candidato.tag == tag]
+            for predicado in PADRAO_PREDICADO.findall(predicados):
+                selecionados = aplicar_predicado(selecionados, predicado)
+            for selecionado in selecionados:
+                if id(selecionado) not in vistos:
+                    vistos.add(id(selecionado))
+                    proximos.append(selecionado)
+        atuais = proximos
+    return atuais
+
+def raiz_documento(no):
+    while no.pai is not None:
+        no = no.pai
+    return no
+
+def localizar(contexto, por, valor):
+    if por == By.XPATH:
+        return avaliar_xpath(contexto, valor)
+    if por == By.ID:
+        return [no for no in contexto.descendentes() if no.atributos.get("id") == valor]
+    if por == By.NAME:
+        return [no for no in contexto.descendentes() if no.atributos.get("name") == valor]
+    if por == By.TAG_NAME:
+        return [no for no in contexto.descendentes() if no.tag == valor]
+    if por == By.CSS_SELECTOR and valor.startswith("#"):
+        return [no for no in contexto.descendentes() if no.atributos.get("id") == valor[1:]]
+    raise WebDriverException(f"Localizador não suportado pelo simulador: {por}={valor}")
+
+# ============================================
+# WEBDRIVER FALSO
+# ============================================
+
+class ElementoFalso:
+    """WebElement sobre um nó do DOM simulado; toda operação é um comando do navegador"""
+
+    def __init__(self, navegador, no):
+        self.parent = navegador
+        self.no = no
+        self.id = f"elemento-{id(no)}"
+
+    def _executar(self, comando, acao):
+        return self.parent.execute(comando, {"id": self.id, "executar": acao})
+
+    @property
+    def tag_name(self):
+        return self._executar("getElementTagName", lambda: self.no.tag)
+
+    @property
+    def text(self):
+        return self._executar("getElementText", self.no.texto_visivel)
+
+    def get_attribute(self, nome):
+        return self._executar("getElementAttribute", lambda: self.no.atributos.get(nome))
+
+    def is_displayed(self):
+        return self._executar("isElementDisplayed", lambda: self.no.atributos.get("hidden") is None)
+
+    def is_enabled(self):
+        return self._executar("isElementEnabled", lambda: self.no.atributos.get("disabled") is None)
+
+    def clear(self):
+        self._executar("clearElement", lambda: self.no.atributos.__setitem__("value", ""))
+
+    def send_keys(self, *valores):
+        texto = "".join(str(valor) for valor in valores)
+        self._executar("sendKeysToElement",
+                       lambda: self.no.atributos.__setitem__("value", self.no.atributos.get("value", "") + texto))
+
+    def click(self):
+        def clicar():
+            self.parent.site.talvez_falhar(f"clique em <{self.no.tag}>")
+            if self.no.ao_clicar:
+                self.no.ao_clicar(self.parent, self.no)
+        self._executar("clickElement", clicar)
+
+    def find_element(self, por=By.ID, valor=None):
+        return self._executar("findChildElement", lambda: self.parent.primeiro(localizar(self.no, por, valor), valor))
+
+    def find_elements(self, por=By.ID, valor=None):
+        return self._executar("findChildElements", lambda: [ElementoFalso(self.parent, no) for no in localizar(self.no, por, valor)])
+
+class TrocaContexto:
+    """switch_to do navegador falso"""
+
+    def __init__(self, navegador):
+        self.navegador = navegador
+
+    def frame(self, referencia):
+        def trocar():
+            no = referencia.no if isinstance(referencia, ElementoFalso) else None
+            if no is None or no.documento is None:
+                raise NoSuchFrameException(f"Frame não encontrado: {referencia}")
+            self.navegador.documento_atual = no.documento
+        self.navegador.execute("switchToFrame", {"executar": trocar})
+
+    def default_content(self):
+        self.navegador.execute("switchToFrame", {"executar": lambda: setattr(
+            self.navegador, "documento_atual", self.navegador.documento)})
+
+class NavegadorFalso:
+    """Substituto de webdriver.Remote ligado a um SiteSefazFalso"""
+
+    def __init__(self, download_dir=None, site=None):
+        self.site = site or site_padrao()
+        self.download_dir = download_dir
+        self.session_id = f"simulada-{id(self):x}"
+        self.documento = self.documento_atual = No("html")
+        self.current_url = "about:blank"
+        self.autenticado = False
+        self.encerrado = False
+        self.estado_formulario = {}
+        self.switch_to = TrocaContexto(self)
+        self.comandos = 0
+
+    def execute(self, comando, parametros=None):
+        """Aplica latência e falha de sessão encerrada e executa a ação do comando"""
+        if self.encerrado and comando != "quit":
+            raise WebDriverException(f"Sessão {self.session_id} encerrada")
+        self.comandos += 1
+        self.site.comandos += 1
+        if self.site.latencia:
+            dormir(self.site.latencia)
+        acao = (parametros or {}).get("executar")
+        return acao() if acao else None
+
+    def primeiro(self, nos, descricao):
+        if not nos:
+            raise NoSuchElementException(f"Elemento não encontrado: {descricao}")
+        return ElementoFalso(self, nos[0])
+
+    def get(self, url):
+        def carregar():
+            self.site.talvez_falhar(f"carregamento de {url}")
+            self.documento = self.documento_atual = self.site.renderizar(self, url)
+            self.current_url = url
+        self.execute("get", {"url": url, "executar": carregar})
+
+    def find_element(self, por=By.ID, valor=None):
+        return self.execute("findElement", {"executar": lambda: self.primeiro(localizar(self.documento_atual, por, valor), valor)})
+
+    def find_elements(self, por=By.ID, valor=None):
+        return self.execute("findElements", {"executar": lambda: [ElementoFalso(self, no) for no in localizar(self.documento_atual, por, valor)]})
+
+    def execute_script(self, script, *argumentos):
+        def executar():
+            if "click()" in script and argumentos and isinstance(argumentos[0], ElementoFalso):
+                elemento = argumentos[0]
+                if elemento.no.ao_clicar:
+                    elemento.no.ao_clicar(self, elemento.no)
+            return None
+        return self.execute("executeScript", {"executar": executar})
+
+    @property
+    def page_source(self):
+        return self.execute("getPageSource", {"executar": self.documento.texto_visivel})
+
+    @property
+    def title(self):
+        return self.execute("getTitle", {"executar": lambda: self.documento.atributos.get("title", "")})
+
+    def set_page_load_timeout(self, segundos):
+        self.execute("setTimeouts")
+
+    def set_script_timeout(self, segundos):
+        self.execute("setTimeouts")
+
+    def implicitly_wait(self, segundos):
+        self.execute("setTimeouts")
+
+    def refresh(self):
+        self.get(self.current_url)
+
+    def quit(self):
+        self.execute("quit")
+        self.encerrado = True
+
+# ============================================
+# SITE SIMULADO
+# ============================================
+
+class SiteSefazFalso:
+    """
+    Estado do portal simulado, compartilhado pelas sessões.
+
+    Parâmetros:
+        latencia (float): Segundos de espera por comando WebDriver.
+        taxa_falha (float): Probabilidade de falha em get() e click().
+        proporcoes (dict): Peso de cada resultado das solicitações: COM_ANEXO,
+            SEM_DADOS, MUITO_GRANDE e ERRO_PROCESSAMENTO.
+        atraso_resposta (float): Segundos até a mensagem aparecer na caixa.
+        tempo_download (float): Segundos com o download em .crdownload.
+        linhas_ruido (int): Mensagens de outros assuntos na caixa de downloads.
+        gerar_zip (callable): Recebe a mensagem e retorna os bytes do ZIP.
+    """
+
+    def __init__(self, latencia=0.0, taxa_falha=0.0, semente=0, proporcoes=None, atraso_resposta=0.0,
+                 tempo_download=0.0, linhas_ruido=0, gerar_zip=None):
+        self.latencia = latencia
+        self.taxa_falha = taxa_falha
+        self.aleatorio = random.Random(semente)
+        self.proporcoes = proporcoes or {"COM_ANEXO": 80, "SEM_DADOS": 15, "MUITO_GRANDE": 2, "ERRO_PROCESSAMENTO": 3}
+        self.atraso_resposta = atraso_resposta
+        self.tempo_download = tempo_download
+        self.gerar_zip = gerar_zip or zip_padrao
+        self.trava = threading.Lock()
+        self.mensagens = []
+        self.proximo_id = 1000
+        self.ultimo_horario = None
+        self.comandos = 0
+        self.downloads = 0
+        self.falhas_injetadas = 0
+        for indice in range(linhas_ruido):
+            self.mensagens.append({"id": str(self.gerar_id()), "assunto": f"AVISO_{indice:04d} - Comunicado",
+                                   "horario": "01/01/2020 00:00:00", "anexo": False, "resultado": None,
+                                   "visivel_em": 0, "texto": "Comunicado geral."})
+
+    def gerar_id(self):
+        self.proximo_id += 1
+        return self.proximo_id
+
+    def talvez_falhar(self, descricao):
+        if self.taxa_falha and self.aleatorio.random() < self.taxa_falha:
+            self.falhas_injetadas += 1
+            raise WebDriverException(f"Falha simulada: {descricao}")
+
+    def sortear_resultado(self):
+        total = sum(self.proporcoes.values())
+        sorteio = self.aleatorio.uniform(0, total)
+        for resultado, peso in self.proporcoes.items():
+            sorteio -= peso
+            if sorteio <= 0:
+                return resultado
+        return "COM_ANEXO"
+
+    def registrar_solicitacao(self, ie, data_ini, data_fim):
+        """Cria a mensagem de resposta a uma solicitação executada no formulário"""
+        with self.trava:
+            # Como no portal, o horário da mensagem é o da solicitação, com resolução de segundos
+            horario = datetime.now().replace(microsecond=0)
+            if self.ultimo_horario and horario <= self.ultimo_horario:
+                dormir((self.ultimo_horario - horario).total_seconds() + 1 - datetime.now().microsecond / 1e6)
+                horario = datetime.now().replace(microsecond=0)
+            self.ultimo_horario = horario
+            resultado = self.sortear_resultado()
+            mensagem = {"id": str(self.gerar_id()), "assunto": ASSUNTO_NFCE, "horario": horario.strftime("%d/%m/%Y %H:%M:%S"),
+                        "anexo": resultado == "COM_ANEXO", "resultado": resultado, "ie": ie,
+                        "data_ini": data_ini, "data_fim": data_fim, "visivel_em": time.time() + self.atraso_resposta,
+                        "texto": "Segue em anexo o arquivo solicitado." if resultado == "COM_ANEXO" else TEXTOS_RESULTADO[resultado]}
+            self.mensagens.append(mensagem)
+            return mensagem
+
+    def adicionar_mensagem(self, ie, data_ini, data_fim, horario, resultado="COM_ANEXO"):
+        """Insere diretamente na caixa a resposta de uma solicitação feita em `horario` (datetime)"""
+        with self.trava:
+            mensagem = {"id": str(self.gerar_id()), "assunto": ASSUNTO_NFCE, "horario": horario.strftime("%d/%m/%Y %H:%M:%S"),
+                        "anexo": resultado == "COM_ANEXO", "resultado": resultado, "ie": ie,
+                        "data_ini": data_ini, "data_fim": data_fim, "visivel_em": 0,
+                        "texto": "Segue em anexo o arquivo solicitado." if resultado == "COM_ANEXO" else TEXTOS_RESULTADO[resultado]}
+            self.mensagens.append(mensagem)
+            return mensagem
+
+    def url_mensagem(self, mensagem):
+        # Mesmo formato montado por localizarLinks a partir do abrirFilhas
+        return f"https://www4.sefaz.pb.gov.br/atf/seg/SEGf_MinhasMensagens.do?hidsqMensagem={mensagem['id']}"
+
+    def buscar_mensagem(self, id_mensagem):
+        with self.trava:
+            return next((mensagem for mensagem in self.mensagens if mensagem["id"] == id_mensagem), None)
+
+    # ----- páginas -----
+
+    def renderizar(self, navegador, url):
+        if url.startswith(URL_LOGIN):
+            return self.pagina_login()
+        if url.startswith(URL_FORMULARIO):
+            return self.pagina_formulario(navegador)
+        if url.startswith(URL_CAIXA):
+            return self.pagina_caixa()
+        encontrado = re.search(r"hidsqMensagem=(\d+)", url)
+        if encontrado:
+            return self.pagina_mensagem(encontrado.group(1))
+        return No("html", {"title": "Página não encontrada"}, filhos=[No("body", texto="404")])
+
+    def pagina_login(self):
+        def avancar(navegador, no):
+            navegador.autenticado = True
+        return No("html", {"title": "ATF - Login"}, filhos=[No("body", filhos=[
+            No("input", {"id": "login"}), No("input", {"id": "senha", "type": "password"}),
+            No("button", {"id": "avancar"}, "Avançar", ao_clicar=avancar)])])
+
+    def pagina_formulario(self, navegador):
+        def pesquisar(navegador, no):
+            campo = next(item for item in raiz_documento(no).descendentes() if item.atributos.get("id") == "valor")
+            navegador.estado_formulario["ie"] = campo.atributos.get("value", "")
+
+        def selecionar_xml(navegador, no):
+            navegador.estado_formulario["formato"] = "XML"
+
+        def executar(navegador, no):
+            documento = raiz_documento(no)
+            campos = {item.atributos.get("id"): item.atributos.get("value", "") for item in documento.descendentes() if item.tag == "input"}
+            ie = navegador.estado_formulario.get("ie")
+            if not ie or navegador.estado_formulario.get("formato") != "XML" or not campos.get("dataInicio"):
+                raise WebDriverException("Formulário incompleto no simulador")
+            self.registrar_solicitacao(ie, campos["dataInicio"], campos.get("dataFim"))
+            navegador.estado_formulario = {}
+
+        iframe = No("iframe", {"id": "pesquisaContribuinte"}, documento=No("html", filhos=[No("body", filhos=[
+            No("input", {"id": "valor"}), No("button", {"id": "pesquisar"}, "Pesquisar", ao_clicar=pesquisar)])]))
+        return No("html", {"title": "ATF - Solicitação de XML"}, filhos=[No("body", filhos=[
+            No("input", {"id": "dataInicio"}), No("input", {"id": "dataFim"}), iframe,
+            No("select", {"id": "formato"}, filhos=[No("option", {"value": "PDF"}, "PDF"),
+                                                    No("option", {"value": "XML"}, "XML", ao_clicar=selecionar_xml)]),
+            No("button", {"id": "executar"}, "Executar", ao_clicar=executar)])])
+
+    def pagina_caixa(self):
+        agora = time.time()
+        with self.trava:
+            visiveis = [mensagem for mensagem in self.mensagens if mensagem["visivel_em"] <= agora]
+        linhas = []
+        for mensagem in reversed(visiveis):
+            anexo = [No("a", filhos=[No("img", {"alt": "Anexo"})])] if mensagem["anexo"] else []
+            linhas.append(No("tr", filhos=[
+                No("td", texto="SEFAZ"),
+                No("td", texto="Sistema"),
+                No("td", filhos=anexo),
+                No("td", filhos=[No("a", texto=mensagem["assunto"], filhos=[No("i", texto="(1)")])]),
+                No("td", texto="Lida" if mensagem.get("lida") else "Nova"),
+                No("td", filhos=[No("a", {"href": f"javascript:abrirFilhas('{mensagem['id']}',0)"}, mensagem["horario"])]),
+            ]))
+        return No("html", {"title": "ATF - Caixa de downloads"}, filhos=[No("body", filhos=[
+            No("table", filhos=[No("thead", filhos=[No("tr", filhos=[No("th", texto="Assunto")])]), No("tbody", filhos=linhas)])])])
+
+    def pagina_mensagem(self, id_mensagem):
+        mensagem = self.buscar_mensagem(id_mensagem)
+        if mensagem is None:
+            return No("html", filhos=[No("body", texto="Mensagem não encontrada.")])
+        mensagem["lida"] = True
+        conteudo = [No("p", texto=mensagem["texto"])]
+        if mensagem["anexo"]:
+            def baixar(navegador, no):
+                self.entregar_download(navegador, mensagem)
+            conteudo += [No("a", {"id": "abrirAnexo"}, filhos=[No("img", {"alt": "Anexo"})]),
+                         No("a", {"id": "baixarAnexo", "href": f"{URL_DOWNLOAD}/{mensagem['id']}"}, "Baixar arquivo", ao_clicar=baixar)]
+        return No("html", {"title": "ATF - Mensagem"}, filhos=[No("body", filhos=[
+            No("div", {"id": "menu"}, filhos=[No("a", texto=item) for item in MENU_PORTAL]),
+            No("div", {"id": "corpoMensagem"}, filhos=conteudo),
+            No("div", {"id": "rodape"}, texto=RODAPE_PORTAL)])])
+
+    def entregar_download(self, navegador, mensagem):
+        """Grava o ZIP da mensagem no diretório de download da sessão"""
+        if not navegador.download_dir:
+            return
+        os.makedirs(navegador.download_dir, exist_ok=True)
+        destino = os.path.join(navegador.download_dir, f"NFCE_XML_{mensagem['ie']}_{mensagem['id']}.zip")
+        conteudo = self.gerar_zip(mensagem)
+        with self.trava:
+            self.downloads += 1
+
+        def concluir():
+            with open(f"{destino}.crdownload", "wb") as f:
+                f.write(conteudo)
+            if self.tempo_download:
+                dormir(self.tempo_download)
+            os.replace(f"{destino}.crdownload", destino)
+
+        if self.tempo_download:
+            with open(f"{destino}.crdownload", "wb"):
+                pass
+            threading.Thread(target=concluir, daemon=True).start()
+        else:
+            concluir()
+
+def zip_padrao(mensagem):
+    """ZIP com uma NFC-e mínima da IE e do dia da solicitação"""
+    dia = datetime.strptime(mensagem["data_ini"], "%d/%m/%Y")
+    xml = (f'<?xml version="1.0" encoding="UTF-8"?><nfeProc xmlns="http://www.portalfiscal.inf.br/nfe"><NFe><infNFe Id="NFe{mensagem["id"]:0>44}">'
+           f'<ide><dhEmi>{dia:%Y-%m-%d}T12:00:00-03:00</dhEmi></ide><emit><CNPJ>00000000000000</CNPJ><IE>{mensagem["ie"]}</IE></emit>'
+           f'<total><ICMSTot><vNF>10.00</vNF></ICMSTot></total></infNFe></NFe></nfeProc>')
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as arquivo_zip:
+        arquivo_zip.writestr(f"NFCE_{mensagem['id']}.xml", xml)
+    return buffer.getvalue()
+
+site_global = None
+
+def site_padrao():
+    """Site compartilhado pelas sessões criadas via SELENOID_URL=simulado://"""
+    global site_global
+    if site_global is None:
+        site_global = SiteSefazFalso(
+            latencia=float(os.environ.get("SIMULADOR_LATENCIA", 0)),
+            taxa_falha=float(os.environ.get("SIMULADOR_TAXA_FALHA", 0)),
+            semente=int(os.environ.get("SIMULADOR_SEMENTE", 0)),
+            tempo_download=float(os.environ.get("SIMULADOR_TEMPO_DOWNLOAD", 0)),
+        )
+    return site_global
+
+def definir_site(site):
+    """Troca o site usado pelas próximas sessões criadas via SELENOID_URL=simulado://"""
+    global site_global
+    site_global = site
@@ -6,7 +6,15 @@ from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from dotenv import load_dotenv
-from utils import (conectar_postgres, iniciar_navegador_selenoid, autenticar_sefaz, acessar_pagina, espera_para_clicar)
+import disjuntor
+import agendador
+import controleFluxo
+import metricas
+import rastreamento
+import perfilNavegador
+import perfilProcesso
+from utils import (conectar_postgres, iniciar_navegador_selenoid, autenticar_sefaz, acessar_pagina, espera_para_clicar,
+                   calcular_proxima_tentativa, MAX_TENTATIVAS_SOLICITACAO)
 
 load_dotenv()
 logger = get_logger(__name__)
@@ -16,8 +24,16 @@ RUNNING = True
 navegador_global = None
 
 def obter_solicitacoes_pendentes(retry_count=3):
+    """
+    Obtém o próximo lote de solicitações ainda não feitas, na ordem definida pelo agendador.
+    O lote é reduzido (ou zerado) pelo controle de fluxo quando as etapas seguintes acumulam fila.
+    """
     solicitacoes_pendentes = []
 
+    limite = controleFluxo.limite_lote("solicitar", agendador.AGENDADOR_LOTE)
+    if limite == 0:
+        return []
+
     for tentativa in range(retry_count):
         conexao = conectar_postgres()
         if not conexao:
@@ -27,12 +43,11 @@ def obter_solicitacoes_pendentes(retry_count=3):
 
         try:
             with conexao.cursor() as cursor:
-                cursor.execute("""
-                    SELECT id, inscricao_estadual, data_ini, data_fim
-                    FROM nfce.solicitacoes
-                    WHERE solicitado = 0 AND tipo = 'NFCE'
-                    ORDER BY criado_em
-                """)
+                with metricas.cronometrar(metricas.POSTGRES_SEGUNDOS, operacao="obter_solicitacoes_pendentes"):
+                    cursor.execute(
+                        agendador.consulta_priorizada(["id", "inscricao_estadual", "data_ini", "data_fim"], agendador.CONDICAO_SOLICITAR),
+                        agendador.parametros(limite)
+                    )
 
                 for id, inscricao_estadual, data_ini, data_fim in cursor.fetchall():
                     solicitacoes_pendentes.append({
@@ -75,24 +90,33 @@ def atualizar_solicitacao(id_solicitacao, horario=None, sucesso=True, retry_coun
                     horario = datetime.now()
 
                 if sucesso:
-                    # Quando bem-sucedido: incrementa solicitado e salva horário
+                    # Quando bem-sucedido: incrementa solicitado, salva horário e agenda a eventual re-solicitação
                     cursor.execute("""
                         UPDATE nfce.solicitacoes
-                        SET solicitado = solicitado + 1, horario = %s, atualizado_em = CURRENT_TIMESTAMP
+                        SET solicitado = solicitado + 1, tentativas = COALESCE(tentativas, 0) + 1, horario = %s, proxima_tentativa = %s,
+                            historico_tentativas = COALESCE(historico_tentativas, '[]'::jsonb)
+                                || jsonb_build_array(jsonb_build_object('horario', %s::text, 'sucesso', true)),
+                            atualizado_em = CURRENT_TIMESTAMP
                         WHERE id = %s
-                    """, (horario, id_solicitacao))
+                    """, (horario, calcular_proxima_tentativa(1, horario), horario.isoformat(timespec='seconds'), id_solicitacao))
                 else:
-                    # Quando falha: marca como erro sem incrementar o contador de solicitado
+                    # Quando falha: registra a tentativa sem incrementar o contador de solicitado,
+                    # adia a próxima pelo primeiro intervalo da curva e esgota a solicitação no limite
                     cursor.execute("""
                         UPDATE nfce.solicitacoes
-                        SET atualizado_em = CURRENT_TIMESTAMP
+                        SET tentativas = COALESCE(tentativas, 0) + 1, proxima_tentativa = %s,
+                            esgotado = COALESCE(tentativas, 0) + 1 >= %s,
+                            historico_tentativas = COALESCE(historico_tentativas, '[]'::jsonb)
+                                || jsonb_build_array(jsonb_build_object('horario', %s::text, 'sucesso', false)),
+                            atualizado_em = CURRENT_TIMESTAMP
                         WHERE id = %s
-                    """, (id_solicitacao,))
+                    """, (calcular_proxima_tentativa(1, horario), MAX_TENTATIVAS_SOLICITACAO, horario.isoformat(timespec='seconds'), id_solicitacao))
 
                 conexao.commit()
 
             conexao.close()
             status = "sucesso" if sucesso else "falha"
+            metricas.SOLICITACOES_ENVIADAS.incrementar(etapa="solicitar", resultado=status)
             logger.debug(f"Solicitação {id_solicitacao} atualizada com {status}")
             return True
 
@@ -110,6 +134,7 @@ def atualizar_solicitacao(id_solicitacao, horario=None, sucesso=True, retry_coun
 
     return False
 
+@rastreamento.rastrear()
 def inserir_datas_formulario(navegador, data_inicio, data_fim, espera=2):
     try:
         wait = WebDriverWait(navegador, espera)
@@ -124,6 +149,7 @@ def inserir_datas_formulario(navegador, data_inicio, data_fim, espera=2):
         logger.error(f"Erro ao inserir datas no formulário: {e}")
         return False
 
+@rastreamento.rastrear()
 def preencher_campo_iframe(navegador, ie_empresa, espera=2):
     try:
         wait = WebDriverWait(navegador, espera)
@@ -143,6 +169,7 @@ def preencher_campo_iframe(navegador, ie_empresa, espera=2):
             pass
         return False
 
+@rastreamento.rastrear()
 def selecionar_xml_executar(navegador, espera=2):
     try:
         wait = WebDriverWait(navegador, espera)
@@ -158,6 +185,7 @@ def selecionar_xml_executar(navegador, espera=2):
         logger.error(f"Erro ao selecionar XML e executar: {e}")
         return False
 
+@rastreamento.rastrear(atributos=lambda navegador, solicitacao, *args, **kwargs: {"solicitacao": solicitacao["id"], "ie": solicitacao["inscricao_estadual"]})
 def solicitar_nfce(navegador, solicitacao, espera=2, max_tentativas=3):
     logger.info(f"Iniciando solicitação para IE {solicitacao['inscricao_estadual']} (ID: {solicitacao['id']}) - Período: {solicitacao['data_ini']} a {solicitacao['data_fim']}")
 
@@ -168,21 +196,24 @@ def solicitar_nfce(navegador, solicitacao, espera=2, max_tentativas=3):
 
             if not inserir_datas_formulario(navegador, solicitacao["data_ini"], solicitacao["data_fim"], espera):
                 if tentativa < max_tentativas:
-                    time.sleep(2)
+                    with rastreamento.span("pausa_nova_tentativa"):
+                        time.sleep(2)
                     continue
                 else:
                     raise Exception("Falha ao inserir datas no formulário")
 
             if not preencher_campo_iframe(navegador, solicitacao["inscricao_estadual"], espera):
                 if tentativa < max_tentativas:
-                    time.sleep(2)
+                    with rastreamento.span("pausa_nova_tentativa"):
+                        time.sleep(2)
                     continue
                 else:
                     raise Exception("Falha ao preencher campo no iframe")
 
             if not selecionar_xml_executar(navegador, espera):
                 if tentativa < max_tentativas:
-                    time.sleep(2)
+                    with rastreamento.span("pausa_nova_tentativa"):
+                        time.sleep(2)
                     continue
                 else:
                     raise Exception("Falha ao selecionar XML e executar")
@@ -191,9 +222,11 @@ def solicitar_nfce(navegador, solicitacao, espera=2, max_tentativas=3):
             # Agora atualiza o banco de dados
             horario = datetime.now()
             try:
-                atualizar_solicitacao(solicitacao["id"], horario, True)
+                with rastreamento.span("atualizar_solicitacao"):
+                    atualizar_solicitacao(solicitacao["id"], horario, True)
                 logger.info(f"Solicitação para IE {solicitacao['inscricao_estadual']} (ID: {solicitacao['id']}) CONCLUÍDA COM SUCESSO")
-                time.sleep(10)
+                with rastreamento.span("pausa_pos_solicitacao"):
+                    time.sleep(10)
                 return True
             except Exception as e:
                 logger.error(f"Erro ao atualizar banco após solicitação bem-sucedida: {e}")
@@ -203,7 +236,8 @@ def solicitar_nfce(navegador, solicitacao, espera=2, max_tentativas=3):
         except Exception as e:
             logger.error(f"Erro ao solicitar NFCE para IE {solicitacao['inscricao_estadual']} (tentativa {tentativa}/{max_tentativas}): {e}")
             if tentativa < max_tentativas:
-                time.sleep(5)
+                with rastreamento.span("pausa_apos_erro"):
+                    time.sleep(5)
             else:
                 try:
                     # Apenas marca como falha no banco sem incrementar contador
@@ -317,7 +351,8 @@ def processar_solicitacoes():
                         break
                     acessar_pagina(navegador, link)
             else:
-                acessar_pagina(navegador, link)
+                with rastreamento.span("recarregar_formulario"):
+                    acessar_pagina(navegador, link)
 
         logger.info(f"Processamento concluído: {solicitacoes_processadas} de {len(solicitacoes)} solicitações processadas com sucesso")
         return solicitacoes_processadas
@@ -326,6 +361,9 @@ def processar_solicitacoes():
         logger.error(f"Erro durante o processamento de solicitações: {e}")
         fechar_navegador()
         return solicitacoes_processadas
+    finally:
+        rastreamento.resumir_ciclo("solicitar")
+        perfilNavegador.relatorio_ciclo("solicitar")
 
 def configurar_tratamento_sinais():
     def handler_signal(signum, frame):
@@ -356,6 +394,8 @@ def monitorar_solicitacoes_continuamente():
     logger.info(f"=" * 50)
 
     configurar_tratamento_sinais()
+    metricas.iniciar_servidor_metricas("solicitarXmls")
+    perfilProcesso.instalar("solicitarXmls")
 
     intervalo_verificacao = int(os.environ.get("INTERVALO_VERIFICACAO", 60))
     tempo_inatividade_fechar_navegador = int(os.environ.get("TEMPO_INATIVIDADE_NAVEGADOR", 300))
@@ -365,6 +405,7 @@ def monitorar_solicitacoes_continuamente():
     intervalo_min_log_sem_solicitacoes = 300  # 5 minutos
 
     while RUNNING:
+        perfilProcesso.marcar_ciclo()
         try:
             # Verifica se há solicitações pendentes antes de iniciar o navegador
             solicitacoes = obter_solicitacoes_pendentes()
@@ -385,6 +426,11 @@ def monitorar_solicitacoes_continuamente():
                 time.sleep(intervalo_verificacao)
                 continue
 
+            # SEFAZ fora do ar: fecha o navegador e aguarda o disjuntor fechar
+            if not disjuntor.aguardar_liberacao():
+                fechar_navegador()
+                continue
+
             # Se há solicitações, processa
             qtd_processada = processar_solicitacoes()
 
@@ -6,7 +6,15 @@ from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from dotenv import load_dotenv
-from utils import (conectar_postgres, iniciar_navegador_selenoid, autenticar_sefaz, acessar_pagina, espera_para_clicar)
+import disjuntor
+import agendador
+import controleFluxo
+import metricas
+import rastreamento
+import perfilNavegador
+import perfilProcesso
+from utils import (conectar_postgres, iniciar_navegador_selenoid, autenticar_sefaz, acessar_pagina, espera_para_clicar,
+                   calcular_proxima_tentativa, MAX_TENTATIVAS_SOLICITACAO)
 
 load_dotenv()
 logger = get_logger(__name__)
@@ -15,14 +23,32 @@ logger = get_logger(__name__)
 RUNNING = True
 navegador_global = None
 
+# Solicitações já feitas que aguardam nova tentativa: falharam com resultado passível de
+# nova tentativa (inclusive arquivo inválido em todos os downloads, ZIP_INVALIDO)
+# ou ficaram sem resposta da SEFAZ por mais de 1 dia.
+# SEM_DADOS já chega finalizado e MUITO_GRANDE falharia novamente para o mesmo período.
+CONDICAO_RESOLICITACAO = """
+    tipo = 'NFCE' AND NOT finalizado AND NOT esgotado AND solicitado > 0
+    AND proxima_tentativa <= CURRENT_TIMESTAMP
+    AND (
+        (anexo = false AND (resultado IS NULL OR resultado IN ('ERRO_PROCESSAMENTO', 'DESCONHECIDO', 'ZIP_INVALIDO')))
+        OR (anexo IS NULL AND horario < (CURRENT_TIMESTAMP - INTERVAL '1 day'))
+    )
+"""
+
 def obter_solicitacoes_para_resolicitacao(retry_count=3):
     """
-    Obtém solicitações que:
-    1. Falharam (anexo=false) e solicitado=1, ou
-    2. Têm anexo=NULL e o horário é mais antigo que 1 dia
+    Obtém as solicitações cuja próxima tentativa já venceu (ver CONDICAO_RESOLICITACAO).
+
+    Antes da consulta, as que já atingiram MAX_TENTATIVAS_SOLICITACAO são marcadas
+    como esgotadas e deixam de ser resolicitadas. O lote é limitado pelo controle de fluxo.
     """
     solicitacoes_para_resolicitacao = []
 
+    limite = controleFluxo.limite_lote("resolicitar", agendador.AGENDADOR_LOTE)
+    if limite == 0:
+        return []
+
     for tentativa in range(retry_count):
         conexao = conectar_postgres()
         if not conexao:
@@ -32,29 +58,32 @@ def obter_solicitacoes_para_resolicitacao(retry_count=3):
 
         try:
             with conexao.cursor() as cursor:
-                # Nova consulta que inclui ambas as condições com UNION
-                cursor.execute("""
-                    SELECT id, inscricao_estadual, data_ini, data_fim
-                    FROM nfce.solicitacoes
-                    WHERE anexo = false AND solicitado = 1 AND tipo = 'NFCE'
-
-                    UNION
+                cursor.execute(f"""
+                    UPDATE nfce.solicitacoes
+                    SET esgotado = TRUE, atualizado_em = CURRENT_TIMESTAMP
+                    WHERE {CONDICAO_RESOLICITACAO} AND tentativas >= %s
+                """, (MAX_TENTATIVAS_SOLICITACAO,))
+                if cursor.rowcount:
+                    logger.warning(f"{cursor.rowcount} solicitações atingiram {MAX_TENTATIVAS_SOLICITACAO} tentativas e foram marcadas como esgotadas")
+                conexao.commit()
 
-                    SELECT id, inscricao_estadual, data_ini, data_fim
+                # Servida pelo índice parcial idx_solicitacoes_proxima_tentativa
+                with metricas.cronometrar(metricas.POSTGRES_SEGUNDOS, operacao="obter_solicitacoes_para_resolicitacao"):
+                    cursor.execute(f"""
+                    SELECT id, inscricao_estadual, data_ini, data_fim, tentativas
                     FROM nfce.solicitacoes
-                    WHERE anexo IS NULL
-                      AND horario < (CURRENT_TIMESTAMP - INTERVAL '1 day')
-                      AND tipo = 'NFCE'
+                    WHERE {CONDICAO_RESOLICITACAO}
+                    ORDER BY proxima_tentativa
+                    LIMIT %s
+                """, (limite,))
 
-                    ORDER BY id
-                """)
-
-                for id, inscricao_estadual, data_ini, data_fim in cursor.fetchall():
+                for id, inscricao_estadual, data_ini, data_fim, tentativas in cursor.fetchall():
                     solicitacoes_para_resolicitacao.append({
                         "id": id,
                         "inscricao_estadual": inscricao_estadual,
                         "data_ini": data_ini,
-                        "data_fim": data_fim
+                        "data_fim": data_fim,
+                        "tentativas": tentativas or 0
                     })
 
             conexao.close()
@@ -75,10 +104,12 @@ def obter_solicitacoes_para_resolicitacao(retry_count=3):
             else:
                 return []
 
-def atualizar_resolicitacao(id_solicitacao, horario=None, sucesso=True, retry_count=3):
+def atualizar_resolicitacao(id_solicitacao, horario=None, sucesso=True, retry_count=3, tentativas=1):
     """
     Atualiza o status da solicitação após a re-solicitação.
-    Incrementa o contador de solicitado, atualiza o horário e define anexo como NULL.
+    Incrementa o contador de solicitado, atualiza o horário, limpa o resultado anterior
+    (guardado no histórico) e agenda a próxima tentativa conforme a curva de backoff.
+    Em caso de falha, a tentativa é adiada pelo primeiro intervalo da curva.
     """
     for tentativa in range(retry_count):
         conexao = conectar_postgres()
@@ -94,24 +125,34 @@ def atualizar_resolicitacao(id_solicitacao, horario=None, sucesso=True, retry_co
                     horario = datetime.now()
 
                 if sucesso:
-                    # Incrementa solicitado, salva o novo horário e define anexo como NULL
+                    # Incrementa solicitado, salva o novo horário e define anexo como NULL.
+                    # O link anterior aponta para a resposta antiga: a nova será localizada pelo horário
                     cursor.execute("""
                         UPDATE nfce.solicitacoes
-                        SET solicitado = solicitado + 1, horario = %s, atualizado_em = CURRENT_TIMESTAMP, anexo = NULL
+                        SET solicitado = solicitado + 1, tentativas = COALESCE(tentativas, 0) + 1, horario = %s, proxima_tentativa = %s,
+                            historico_tentativas = COALESCE(historico_tentativas, '[]'::jsonb)
+                                || jsonb_build_array(jsonb_build_object(
+                                    'horario', %s::text, 'sucesso', true, 'resultado_anterior', resultado, 'link_anterior', link)),
+                            anexo = NULL, resultado = NULL, link = NULL, atualizado_em = CURRENT_TIMESTAMP
                         WHERE id = %s
-                    """, (horario, id_solicitacao))
+                    """, (horario, calcular_proxima_tentativa(tentativas, horario), horario.isoformat(timespec='seconds'), id_solicitacao))
                 else:
-                    # Quando falha: apenas registra a tentativa sem alterar o horário
+                    # Quando falha: registra a tentativa sem alterar o horário, adia a próxima e esgota no limite
                     cursor.execute("""
                         UPDATE nfce.solicitacoes
-                        SET atualizado_em = CURRENT_TIMESTAMP
+                        SET tentativas = COALESCE(tentativas, 0) + 1, proxima_tentativa = %s,
+                            esgotado = COALESCE(tentativas, 0) + 1 >= %s,
+                            historico_tentativas = COALESCE(historico_tentativas, '[]'::jsonb)
+                                || jsonb_build_array(jsonb_build_object('horario', %s::text, 'sucesso', false)),
+                            atualizado_em = CURRENT_TIMESTAMP
                         WHERE id = %s
-                    """, (id_solicitacao,))
+                    """, (calcular_proxima_tentativa(1, horario), MAX_TENTATIVAS_SOLICITACAO, horario.isoformat(timespec='seconds'), id_solicitacao))
 
                 conexao.commit()
 
             conexao.close()
             status = "sucesso" if sucesso else "falha"
+            metricas.SOLICITACOES_ENVIADAS.incrementar(etapa="resolicitar", resultado=status)
             logger.debug(f"Re-solicitação {id_solicitacao} atualizada com {status}")
             return True
 
@@ -129,6 +170,7 @@ def atualizar_resolicitacao(id_solicitacao, horario=None, sucesso=True, retry_co
 
     return False
 
+@rastreamento.rastrear()
 def inserir_datas_formulario(navegador, data_inicio, data_fim, espera=2):
     try:
         wait = WebDriverWait(navegador, espera)
@@ -143,6 +185,7 @@ def inserir_datas_formulario(navegador, data_inicio, data_fim, espera=2):
         logger.error(f"Erro ao inserir datas no formulário: {e}")
         return False
 
+@rastreamento.rastrear()
 def preencher_campo_iframe(navegador, ie_empresa, espera=2):
     try:
         wait = WebDriverWait(navegador, espera)
@@ -162,6 +205,7 @@ def preencher_campo_iframe(navegador, ie_empresa, espera=2):
             pass
         return False
 
+@rastreamento.rastrear()
 def selecionar_xml_executar(navegador, espera=2):
     try:
         wait = WebDriverWait(navegador, espera)
@@ -177,6 +221,7 @@ def selecionar_xml_executar(navegador, espera=2):
         logger.error(f"Erro ao selecionar XML e executar: {e}")
         return False
 
+@rastreamento.rastrear(atributos=lambda navegador, solicitacao, *args, **kwargs: {"solicitacao": solicitacao["id"], "ie": solicitacao["inscricao_estadual"]})
 def resolicitacao_nfce(navegador, solicitacao, espera=2, max_tentativas=3):
     logger.info(f"Iniciando re-solicitação para IE {solicitacao['inscricao_estadual']} (ID: {solicitacao['id']})")
 
@@ -187,21 +232,24 @@ def resolicitacao_nfce(navegador, solicitacao, espera=2, max_tentativas=3):
 
             if not inserir_datas_formulario(navegador, solicitacao["data_ini"], solicitacao["data_fim"], espera):
                 if tentativa < max_tentativas:
-                    time.sleep(2)
+                    with rastreamento.span("pausa_nova_tentativa"):
+                        time.sleep(2)
                     continue
                 else:
                     raise Exception("Falha ao inserir datas no formulário")
 
             if not preencher_campo_iframe(navegador, solicitacao["inscricao_estadual"], espera):
                 if tentativa < max_tentativas:
-                    time.sleep(2)
+                    with rastreamento.span("pausa_nova_tentativa"):
+                        time.sleep(2)
                     continue
                 else:
                     raise Exception("Falha ao preencher campo no iframe")
 
             if not selecionar_xml_executar(navegador, espera):
                 if tentativa < max_tentativas:
-                    time.sleep(2)
+                    with rastreamento.span("pausa_nova_tentativa"):
+                        time.sleep(2)
                     continue
                 else:
                     raise Exception("Falha ao selecionar XML e executar")
@@ -210,9 +258,11 @@ def resolicitacao_nfce(navegador, solicitacao, espera=2, max_tentativas=3):
             # Agora atualiza o banco de dados
             horario = datetime.now()
             try:
-                atualizar_resolicitacao(solicitacao["id"], horario, True)
+                with rastreamento.span("atualizar_resolicitacao"):
+                    atualizar_resolicitacao(solicitacao["id"], horario, True, tentativas=solicitacao["tentativas"] + 1)
                 logger.info(f"Re-solicitação para IE {solicitacao['inscricao_estadual']} (ID: {solicitacao['id']}) CONCLUÍDA COM SUCESSO")
-                time.sleep(10)
+                with rastreamento.span("pausa_pos_solicitacao"):
+                    time.sleep(10)
                 return True
             except Exception as e:
                 logger.error(f"Erro ao atualizar banco após re-solicitação bem-sucedida: {e}")
@@ -222,7 +272,8 @@ def resolicitacao_nfce(navegador, solicitacao, espera=2, max_tentativas=3):
         except Exception as e:
             logger.error(f"Erro ao re-solicitar NFCE para IE {solicitacao['inscricao_estadual']} (tentativa {tentativa}/{max_tentativas}): {e}")
             if tentativa < max_tentativas:
-                time.sleep(5)
+                with rastreamento.span("pausa_apos_erro"):
+                    time.sleep(5)
             else:
                 try:
                     atualizar_resolicitacao(solicitacao["id"], None, False)
@@ -335,7 +386,8 @@ def processar_resolicitacoes():
                         break
                     acessar_pagina(navegador, link)
             else:
-                acessar_pagina(navegador, link)
+                with rastreamento.span("recarregar_formulario"):
+                    acessar_pagina(navegador, link)
 
         logger.info(f"Processamento concluído: {resolicitacoes_processadas} de {len(solicitacoes)} re-solicitações processadas com sucesso")
         return resolicitacoes_processadas
@@ -344,6 +396,9 @@ def processar_resolicitacoes():
         logger.error(f"Erro durante o processamento de re-solicitações: {e}")
         fechar_navegador()
         return resolicitacoes_processadas
+    finally:
+        rastreamento.resumir_ciclo("resolicitar")
+        perfilNavegador.relatorio_ciclo("resolicitar")
 
 def configurar_tratamento_sinais():
     def handler_signal(signum, frame):
@@ -374,6 +429,8 @@ def monitorar_resolicitacoes_continuamente():
     logger.info(f"=" * 50)
 
     configurar_tratamento_sinais()
+    metricas.iniciar_servidor_metricas("solicitarXmlsFalhos")
+    perfilProcesso.instalar("solicitarXmlsFalhos")
 
     intervalo_verificacao = int(os.environ.get("INTERVALO_VERIFICACAO", 180))
     tempo_inatividade_fechar_navegador = int(os.environ.get("TEMPO_INATIVIDADE_NAVEGADOR", 300))
@@ -383,6 +440,7 @@ def monitorar_resolicitacoes_continuamente():
     intervalo_min_log_sem_solicitacoes = 300  # 5 minutos
 
     while RUNNING:
+        perfilProcesso.marcar_ciclo()
         try:
             # Verifica se há solicitações para re-solicitar antes de iniciar o navegador
             solicitacoes = obter_solicitacoes_para_resolicitacao()
@@ -403,6 +461,11 @@ def monitorar_resolicitacoes_continuamente():
                 time.sleep(intervalo_verificacao)
                 continue
 
+            # SEFAZ fora do ar: fecha o navegador e aguarda o disjuntor fechar
+            if not disjuntor.aguardar_liberacao():
+                fechar_navegador()
+                continue
+
             # Se há solicitações, processa
             qtd_processada = processar_resolicitacoes()
 
@@ -17,13 +17,27 @@ def criar_estrutura_banco():
     cursor = conexao.cursor()
     try:
         cursor.execute("CREATE SCHEMA IF NOT EXISTS nfce;")
+        # Catálogo das notas armazenadas no destino final, carregado via COPY pelo gerenciarArquivos
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS nfce.notas (
+                chave CHAR(44) PRIMARY KEY, inscricao_estadual VARCHAR(20), cnpj VARCHAR(14),
+                dh_emi TIMESTAMPTZ, valor_total NUMERIC(15, 2), caminho TEXT NOT NULL, job_id VARCHAR(40),
+                importado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP);""")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_notas_ie_emissao ON nfce.notas(inscricao_estadual, dh_emi);")
+        # Estado do disjuntor compartilhado pelos serviços com navegador (disjuntor.py)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS nfce.disjuntor (
+                nome VARCHAR(30) PRIMARY KEY, estado VARCHAR(12) NOT NULL DEFAULT 'FECHADO',
+                falhas_consecutivas INTEGER NOT NULL DEFAULT 0, aberto_em TIMESTAMPTZ, sonda VARCHAR(150),
+                sonda_em TIMESTAMPTZ, atualizado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP);""")
         cursor.execute("SELECT EXISTS (SELECT FROM information_schema.tables WHERE table_schema = 'nfce' AND table_name = 'empresas');")
         if not cursor.fetchone()[0]:
             logger.info("Criando estrutura do banco de dados...")
             cursor.execute("""
                 CREATE TABLE nfce.empresas (
                     inscricao_estadual VARCHAR(20) PRIMARY KEY, apelido VARCHAR(100), uf VARCHAR(2) DEFAULT 'PB',
-                    status_empresa CHAR(1) DEFAULT 'A', inicio DATE DEFAULT CURRENT_DATE, ultima_atualizacao TIMESTAMP DEFAULT CURRENT_TIMESTAMP);""")
+                    status_empresa CHAR(1) DEFAULT 'A', inicio DATE DEFAULT CURRENT_DATE, ultima_atualizacao TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    prioridade INTEGER DEFAULT 0);""")
             cursor.execute("""
                 CREATE TABLE IF NOT EXISTS nfce.solicitacoes (
                     id SERIAL PRIMARY KEY, inscricao_estadual VARCHAR(20) NOT NULL,
@@ -31,10 +45,16 @@ def criar_estrutura_banco():
                     horario TIMESTAMP, link TEXT, solicitado INTEGER DEFAULT 0, baixado INTEGER DEFAULT 0,
                     finalizado BOOLEAN DEFAULT FALSE, anexo BOOLEAN DEFAULT NULL,
                     criado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP, atualizado_em TIMESTAMP,
-                    mensagens INTEGER DEFAULT NULL,
+                    mensagens INTEGER DEFAULT NULL, arquivo TEXT, tamanho_arquivo BIGINT, hash_arquivo VARCHAR(64),
+                    qtd_notas INTEGER, bytes_notas BIGINT, caminho_final TEXT, resultado VARCHAR(20),
+                    proxima_tentativa TIMESTAMP, historico_tentativas JSONB DEFAULT '[]'::jsonb, esgotado BOOLEAN DEFAULT FALSE,
+                    prioridade INTEGER DEFAULT 0, tentativas INTEGER DEFAULT 0,
                     CONSTRAINT fk_solicitacao_empresa FOREIGN KEY (inscricao_estadual) REFERENCES nfce.empresas (inscricao_estadual));""")
             cursor.execute("CREATE INDEX IF NOT EXISTS idx_solicitacoes_inscricao ON nfce.solicitacoes(inscricao_estadual);")
             cursor.execute("CREATE INDEX IF NOT EXISTS idx_solicitacoes_status ON nfce.solicitacoes(solicitado, baixado);")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_solicitacoes_hash ON nfce.solicitacoes(hash_arquivo) WHERE hash_arquivo IS NOT NULL;")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_solicitacoes_abertas ON nfce.solicitacoes(inscricao_estadual, data_ini) WHERE NOT finalizado;")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_solicitacoes_proxima_tentativa ON nfce.solicitacoes(proxima_tentativa) WHERE NOT finalizado AND NOT esgotado;")
             conexao.commit()
             logger.info("Estrutura do banco criada com sucesso!")
         else:
@@ -42,6 +62,10 @@ def criar_estrutura_banco():
             if not cursor.fetchone():
                 cursor.execute("ALTER TABLE nfce.empresas ADD COLUMN inicio DATE DEFAULT CURRENT_DATE;")
                 logger.info("Coluna 'inicio' adicionada à tabela empresas")
+            cursor.execute("SELECT column_name FROM information_schema.columns WHERE table_schema = 'nfce' AND table_name = 'empresas' AND column_name = 'prioridade';")
+            if not cursor.fetchone():
+                cursor.execute("ALTER TABLE nfce.empresas ADD COLUMN prioridade INTEGER DEFAULT 0;")
+                logger.info("Coluna 'prioridade' adicionada à tabela empresas")
             cursor.execute("SELECT data_type FROM information_schema.columns WHERE table_schema = 'nfce' AND table_name = 'solicitacoes' AND column_name = 'baixado';")
             coluna = cursor.fetchone()
             if coluna and coluna[0] != 'integer':
@@ -61,6 +85,27 @@ def criar_estrutura_banco():
             if not cursor.fetchone():
                 cursor.execute("ALTER TABLE nfce.solicitacoes ADD COLUMN mensagens INTEGER DEFAULT NULL;")
                 logger.info("Coluna 'mensagens' adicionada à tabela solicitacoes")
+            # Colunas de rastreio da resposta da SEFAZ, do arquivo baixado e do resultado da ingestão
+            for coluna, definicao in (("arquivo", "TEXT"), ("tamanho_arquivo", "BIGINT"), ("hash_arquivo", "VARCHAR(64)"),
+                                      ("qtd_notas", "INTEGER"), ("bytes_notas", "BIGINT"), ("caminho_final", "TEXT"),
+                                      ("resultado", "VARCHAR(20)"), ("proxima_tentativa", "TIMESTAMP"),
+                                      ("historico_tentativas", "JSONB DEFAULT '[]'::jsonb"), ("esgotado", "BOOLEAN DEFAULT FALSE"),
+                                      ("prioridade", "INTEGER DEFAULT 0")):
+                cursor.execute("SELECT column_name FROM information_schema.columns WHERE table_schema = 'nfce' AND table_name = 'solicitacoes' AND column_name = %s;", (coluna,))
+                if not cursor.fetchone():
+                    cursor.execute(f"ALTER TABLE nfce.solicitacoes ADD COLUMN {coluna} {definicao};")
+                    logger.info(f"Coluna '{coluna}' adicionada à tabela solicitacoes")
+            # Submissões do formulário com ou sem sucesso; até aqui cada entrada do histórico era uma submissão
+            cursor.execute("SELECT column_name FROM information_schema.columns WHERE table_schema = 'nfce' AND table_name = 'solicitacoes' AND column_name = 'tentativas';")
+            if not cursor.fetchone():
+                cursor.execute("ALTER TABLE nfce.solicitacoes ADD COLUMN tentativas INTEGER DEFAULT 0;")
+                cursor.execute("UPDATE nfce.solicitacoes SET tentativas = GREATEST(jsonb_array_length(COALESCE(historico_tentativas, '[]'::jsonb)), solicitado);")
+                logger.info("Coluna 'tentativas' adicionada à tabela solicitacoes")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_solicitacoes_hash ON nfce.solicitacoes(hash_arquivo) WHERE hash_arquivo IS NOT NULL;")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_solicitacoes_abertas ON nfce.solicitacoes(inscricao_estadual, data_ini) WHERE NOT finalizado;")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_solicitacoes_proxima_tentativa ON nfce.solicitacoes(proxima_tentativa) WHERE NOT finalizado AND NOT esgotado;")
+            # Solicitações feitas antes do agendamento por backoff ficam disponíveis imediatamente
+            cursor.execute("UPDATE nfce.solicitacoes SET proxima_tentativa = COALESCE(horario, CURRENT_TIMESTAMP) WHERE proxima_tentativa IS NULL AND solicitado > 0 AND NOT finalizado;")
             cursor.execute("SELECT EXISTS (SELECT FROM information_schema.tables WHERE table_schema = 'nfce' AND table_name = 'arquivos_xml');")
             if cursor.fetchone()[0]:
                 cursor.execute("DROP TABLE nfce.arquivos_xml CASCADE;")
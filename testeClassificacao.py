@@ -0,0 +1,77 @@
+"""
+Teste da classificação das mensagens sem anexo da caixa de downloads.
+
+Abre, no portal simulado (simuladorSefaz), mensagens cujas páginas trazem menu e
+rodapé com textos parecidos com os resultados ("nenhuma nota", "erro", "tente
+novamente", "não há registros") e confere que localizarLinks lê apenas o corpo da
+mensagem e o classifica corretamente. Também confere que textos que casam mais de
+uma classe ficam DESCONHECIDO, e não SEM_DADOS, que finalizaria a solicitação.
+
+Uso:
+    python testeClassificacao.py
+"""
+import os, sys, shutil, tempfile
+from datetime import datetime
+from selenium.webdriver.common.by import By
+
+def main():
+    base = tempfile.mkdtemp(prefix="classificacao_")
+    os.environ.update({
+        "DIRETORIO_EXECUCAO": base,
+        "DISJUNTOR_BACKEND": "arquivo",
+        "DISJUNTOR_ARQUIVO": os.path.join(base, "disjuntor.json"),
+        "LOG_LEVEL": "ERROR",
+    })
+    try:
+        import simuladorSefaz
+        simuladorSefaz.configurar_ambiente()
+        import localizarLinks
+
+        site = simuladorSefaz.SiteSefazFalso()
+        navegador = simuladorSefaz.NavegadorFalso(site=site)
+        agora = datetime.now()
+
+        def abrir(resultado, texto=None):
+            mensagem = site.adicionar_mensagem("160000000", "01/01/2025", "01/01/2025", agora, resultado)
+            if texto:
+                mensagem["texto"] = texto
+            return site.url_mensagem(mensagem)
+
+        def classificar(url):
+            return localizarLinks.classificar_mensagem(localizarLinks.ler_corpo_mensagem(navegador, url))
+
+        def pagina_inteira(url):
+            navegador.get(url)
+            return navegador.find_element(By.TAG_NAME, "body").text
+
+        cenarios = []
+        for resultado in ("SEM_DADOS", "MUITO_GRANDE", "ERRO_PROCESSAMENTO"):
+            cenarios.append((f"corpo {resultado} com menu e rodapé do portal", classificar(abrir(resultado)), resultado))
+
+        cenarios.append(("corpo que casa SEM_DADOS e ERRO_PROCESSAMENTO",
+                         classificar(abrir("ERRO_PROCESSAMENTO", "Não foram encontrados documentos: erro ao consultar a base. "
+                                                                 "Tente novamente.")), "DESCONHECIDO"))
+        cenarios.append(("corpo sem padrão conhecido",
+                         classificar(abrir("ERRO_PROCESSAMENTO", "Sua solicitação foi recebida.")), "DESCONHECIDO"))
+        cenarios.append(("página inteira (menu e rodapé) de uma mensagem MUITO_GRANDE",
+                         localizarLinks.classificar_mensagem(pagina_inteira(abrir("MUITO_GRANDE"))), "DESCONHECIDO"))
+
+        xpath_corpo = os.environ.pop("XPATH_CORPO_MENSAGEM")
+        cenarios.append(("XPATH_CORPO_MENSAGEM não configurado", classificar(abrir("SEM_DADOS")), "DESCONHECIDO"))
+        os.environ["XPATH_CORPO_MENSAGEM"] = xpath_corpo
+
+        falhas = 0
+        for descricao, obtido, esperado in cenarios:
+            ok = obtido == esperado
+            print(f"[{'OK' if ok else 'FALHA'}] {descricao}")
+            if not ok:
+                print(f"    - classificado como {obtido}, esperado {esperado}")
+            falhas += not ok
+
+        print(f"\n{len(cenarios) - falhas}/{len(cenarios)} mensagens classificadas corretamente")
+        sys.exit(1 if falhas else 0)
+    finally:
+        shutil.rmtree(base, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
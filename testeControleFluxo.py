@@ -0,0 +1,108 @@
+"""
+Teste do controle de fluxo com solicitações esgotadas.
+
+Solicitações que esgotaram as tentativas (esgotado = TRUE) ficam sem link e nunca
+são finalizadas. Este teste confere que elas não entram na fila aguardando_link
+nem na varredura da caixa de downloads, e que portanto não pausam as etapas de
+solicitação. O banco é simulado com SQLite em memória (esquema nfce anexado), sem
+necessidade de PostgreSQL.
+
+Uso:
+    python testeControleFluxo.py
+"""
+import os, sys, shutil, sqlite3, tempfile
+from datetime import datetime
+
+MARCA_ALTA = 200
+
+class ConexaoSqlite:
+    """Conexão no formato usado pelos módulos (cursor/close), mantendo o banco em memória entre consultas"""
+    def __init__(self, banco):
+        self.banco = banco
+
+    def cursor(self):
+        return self.banco.cursor()
+
+    def commit(self):
+        self.banco.commit()
+
+    def rollback(self):
+        self.banco.rollback()
+
+    def close(self):
+        pass
+
+def criar_banco():
+    banco = sqlite3.connect(":memory:", detect_types=sqlite3.PARSE_DECLTYPES)
+    banco.execute("ATTACH DATABASE ':memory:' AS nfce")
+    banco.execute("""
+        CREATE TABLE nfce.solicitacoes (
+            id INTEGER PRIMARY KEY, inscricao_estadual TEXT, horario TIMESTAMP, criado_em TIMESTAMP,
+            tipo TEXT DEFAULT 'NFCE', solicitado INTEGER DEFAULT 0, link TEXT, anexo BOOLEAN,
+            baixado INTEGER DEFAULT 0, mensagens INTEGER, finalizado BOOLEAN DEFAULT FALSE,
+            esgotado BOOLEAN DEFAULT FALSE)
+    """)
+    return banco
+
+def semear(banco, quantidade, esgotado):
+    """Solicitações já enviadas, sem link e não finalizadas"""
+    agora = datetime.now()
+    banco.executemany(
+        "INSERT INTO nfce.solicitacoes (inscricao_estadual, horario, criado_em, solicitado, link, esgotado) "
+        "VALUES (?, ?, ?, 1, '', ?)",
+        [(f"16{i:07d}", agora, agora, esgotado) for i in range(quantidade)])
+
+def executar_cenario(controleFluxo, localizarLinks, esgotadas, ativas):
+    """Retorna (lote liberado para solicitar, fila aguardando_link, solicitações varridas na caixa)"""
+    banco = criar_banco()
+    semear(banco, esgotadas, True)
+    semear(banco, ativas, False)
+    conexao = ConexaoSqlite(banco)
+    controleFluxo.conectar_postgres = localizarLinks.conectar_postgres = lambda: conexao
+    controleFluxo.filas_cache = None
+    controleFluxo.pausas.clear()
+
+    lote = controleFluxo.limite_lote("solicitar", 10)
+    fila = controleFluxo.medir_filas()["aguardando_link"]
+    varridas = len(localizarLinks.obter_solicitacoes_solicitadas())
+    banco.close()
+    return lote, fila, varridas
+
+def main():
+    base = tempfile.mkdtemp(prefix="controle_fluxo_")
+    os.environ.update({
+        "DIRETORIO_EXECUCAO": base,
+        "DIRETORIO_DOWNLOADS": os.path.join(base, "incoming"),
+        "FLUXO_AGUARDANDO_LINK": f"{MARCA_ALTA},{MARCA_ALTA // 2}",
+        "LOG_LEVEL": "ERROR",
+    })
+    try:
+        import controleFluxo, localizarLinks
+
+        cenarios = [
+            # (descrição, esgotadas, ativas, lote esperado, fila esperada)
+            ("esgotadas acima da marca alta não pausam a solicitação", MARCA_ALTA + 50, 5, 10, 5),
+            ("pendentes acima da marca alta pausam a solicitação", 0, MARCA_ALTA + 50, 0, MARCA_ALTA + 50),
+        ]
+        falhas = 0
+        for descricao, esgotadas, ativas, lote_esperado, fila_esperada in cenarios:
+            lote, fila, varridas = executar_cenario(controleFluxo, localizarLinks, esgotadas, ativas)
+            problemas = []
+            if lote != lote_esperado:
+                problemas.append(f"lote de solicitação {lote}, esperado {lote_esperado}")
+            if fila != fila_esperada:
+                problemas.append(f"aguardando_link={fila}, esperado {fila_esperada}")
+            if varridas != ativas:
+                problemas.append(f"{varridas} solicitações na varredura da caixa, esperado {ativas}")
+            print(f"[{'OK' if not problemas else 'FALHA'}] {descricao}")
+            for problema in problemas:
+                print(f"    - {problema}")
+            falhas += bool(problemas)
+
+        print(f"\n{len(cenarios) - falhas}/{len(cenarios)} cenários de controle de fluxo corretos")
+        sys.exit(1 if falhas else 0)
+    finally:
+        shutil.rmtree(base, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+"""
+Teste de recuperação após queda do gerenciador de arquivos.
+
+Para cada transição de estado de um job (antes e depois de gravá-la no journal)
+e para uma interrupção no meio da cópia para o destino final, executa o
+gerenciarArquivos em um processo filho que é encerrado abruptamente (os._exit)
+naquele ponto. Em seguida executa a recuperação em outro processo e confere que
+todas as notas chegaram íntegras ao destino final, sem jobs pendentes.
+
+Uso:
+    python testeRecuperacao.py [--notas 20] [--manter]
+"""
+import os, re, sys, shutil, sqlite3, tempfile, zipfile, subprocess, argparse
+import xml.etree.ElementTree as ET
+
+CODIGO_QUEDA = 137
+IE_TESTE = "160000000"
+ESTADOS_INJECAO = ["INIT", "EXTRACTING", "EXTRACTED", "ANALYZING", "RENAMING", "MOVING", "COMPLETED"]
+PADRAO_CHAVE_ACESSO = re.compile(rb'Id="NFe(\d{44})"')
+
+def montar_ambiente(base):
+    """Variáveis de ambiente que isolam o gerenciador no diretório temporário"""
+    env = dict(os.environ)
+    env.update({
+        "DIRETORIO_EXECUCAO": base,
+        "DIRETORIO_FINAL": os.path.join(base, "final"),
+        "DIRETORIO_DOWNLOADS": os.path.join(base, "NFCE_XML_TEMP", "incoming"),
+        "LOG_LEVEL": "WARNING"
+    })
+    return env
+
+def gerar_xml(chave, data_emissao):
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<nfeProc xmlns="http://www.portalfiscal.inf.br/nfe" versao="4.00"><NFe>'
+        f'<infNFe Id="NFe{chave}" versao="4.00">'
+        f'<ide><dhEmi>{data_emissao}</dhEmi></ide>'
+        f'<emit><IE>{IE_TESTE}</IE></emit>'
+        '</infNFe></NFe></nfeProc>'
+    ).encode('utf-8')
+
+def preparar_cenario(base, quantidade_notas):
+    """Cria a árvore de diretórios e um ZIP de entrada; retorna as chaves esperadas"""
+    incoming = os.path.join(base, "NFCE_XML_TEMP", "incoming")
+    os.makedirs(incoming, exist_ok=True)
+    os.makedirs(os.path.join(base, "final", f"EMPRESA_TESTE_{IE_TESTE}"), exist_ok=True)
+
+    chaves = set()
+    with zipfile.ZipFile(os.path.join(incoming, "NFCE_XML_teste.zip"), 'w', zipfile.ZIP_DEFLATED) as zip_ref:
+        for i in range(quantidade_notas):
+            chave = f"25250112345678000199650010000{i:05d}1{i:09d}"[:44]
+            chaves.add(chave)
+            zip_ref.writestr(f"NFCE_{chave}.xml", gerar_xml(chave, f"2025-01-{1 + i % 2:02d}T10:00:00-03:00"))
+    return chaves
+
+def verificar_resultado(base, chaves_esperadas):
+    """Retorna a lista de problemas encontrados após a recuperação"""
+    problemas = []
+    encontradas = set()
+
+    for raiz, _, arquivos in os.walk(os.path.join(base, "final")):
+        for arquivo in arquivos:
+            if not arquivo.endswith('.xml'):
+                continue
+            caminho = os.path.join(raiz, arquivo)
+            with open(caminho, 'rb') as f:
+                conteudo = f.read()
+            try:
+                ET.fromstring(conteudo)
+            except ET.ParseError:
+                problemas.append(f"XML truncado no destino: {caminho}")
+                continue
+            match = PADRAO_CHAVE_ACESSO.search(conteudo)
+            if match:
+                encontradas.add(match.group(1).decode('ascii'))
+
+    faltantes = chaves_esperadas - encontradas
+    if faltantes:
+        problemas.append(f"{len(faltantes)} notas ausentes no destino final")
+
+    processing = os.path.join(base, "NFCE_XML_TEMP", "processing")
+    if os.path.isdir(processing) and os.listdir(processing):
+        problemas.append(f"Jobs remanescentes em processing: {os.listdir(processing)}")
+
+    incoming = os.path.join(base, "NFCE_XML_TEMP", "incoming")
+    if any(arquivo.endswith('.zip') for arquivo in os.listdir(incoming)):
+        problemas.append("ZIP de entrada não foi consumido")
+
+    journal = os.path.join(base, "NFCE_XML_TEMP", "journal_jobs.db")
+    if os.path.exists(journal):
+        conexao = sqlite3.connect(journal)
+        ativos = conexao.execute("SELECT COUNT(*) FROM jobs WHERE ativo = 1").fetchone()[0]
+        conexao.close()
+        if ativos:
+            problemas.append(f"{ativos} jobs ainda ativos no journal")
+
+    return problemas
+
+def executar_filho(base, *argumentos):
+    return subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--filho", *argumentos],
+        env=montar_ambiente(base), cwd=os.path.dirname(os.path.abspath(__file__))
+    ).returncode
+
+def filho_com_falha(estado_alvo, momento):
+    """Processa a pasta incoming e encerra o processo no ponto de injeção"""
+    import gerenciarArquivos as ga
+
+    atualizar_estado_original = ga.atualizar_estado
+    gravar_arquivo_original = ga.gravar_arquivo_atomico
+    gravacoes = {"finais": 0}
+
+    def atualizar_estado_com_falha(job_dir, estado, dados_adicionais=None):
+        if estado == estado_alvo and momento == "antes":
+            os._exit(CODIGO_QUEDA)
+        atualizar_estado_original(job_dir, estado, dados_adicionais)
+        if estado == estado_alvo and momento == "depois":
+            os._exit(CODIGO_QUEDA)
+
+    def gravar_arquivo_com_falha(caminho, conteudo, sincronizar=True):
+        # Cópias para o destino final usam sincronizar=True; a extração não
+        if sincronizar:
+            gravacoes["finais"] += 1
+            if gravacoes["finais"] > 1:
+                os._exit(CODIGO_QUEDA)
+        gravar_arquivo_original(caminho, conteudo, sincronizar)
+
+    ga.atualizar_estado = atualizar_estado_com_falha
+    if estado_alvo == "COPIA":
+        ga.gravar_arquivo_atomico = gravar_arquivo_com_falha
+
+    ga.configurar_diretorios()
+    ga.processar_arquivos_existentes()
+    # Se chegou aqui a falha não foi injetada
+    sys.exit(3)
+
+def filho_recuperacao():
+    """Executa a recuperação na inicialização, como faz o main do gerenciador"""
+    import gerenciarArquivos as ga
+
+    ga.configurar_diretorios()
+    ga.verificar_processamentos_pendentes()
+    ga.processar_arquivos_existentes()
+    ga.fechar_journal()
+
+def executar_cenario(estado, momento, quantidade_notas, manter):
+    base = tempfile.mkdtemp(prefix=f"recuperacao_{estado.lower()}_{momento}_")
+    try:
+        chaves = preparar_cenario(base, quantidade_notas)
+
+        codigo = executar_filho(base, "falhar", estado, momento)
+        if codigo != CODIGO_QUEDA:
+            return [f"processo não foi interrompido no ponto de injeção (código {codigo})"]
+
+        codigo = executar_filho(base, "recuperar")
+        if codigo != 0:
+            return [f"recuperação terminou com código {codigo}"]
+
+        return verificar_resultado(base, chaves)
+    finally:
+        if manter:
+            print(f"    ambiente mantido em {base}")
+        else:
+            shutil.rmtree(base, ignore_errors=True)
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--filho":
+        if sys.argv[2] == "falhar":
+            filho_com_falha(sys.argv[3], sys.argv[4])
+        else:
+            filho_recuperacao()
+        return
+
+    argumentos = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    argumentos.add_argument("--notas", type=int, default=20, help="quantidade de notas no ZIP de teste")
+    argumentos.add_argument("--manter", action="store_true", help="não apagar os diretórios temporários")
+    opcoes = argumentos.parse_args()
+
+    cenarios = [(estado, momento) for estado in ESTADOS_INJECAO for momento in ("antes", "depois")]
+    cenarios.append(("COPIA", "durante"))
+
+    falhas = 0
+    for estado, momento in cenarios:
+        problemas = executar_cenario(estado, momento, opcoes.notas, opcoes.manter)
+        descricao = "durante a cópia para o destino" if estado == "COPIA" else f"{momento} de {estado}"
+        print(f"[{'OK' if not problemas else 'FALHA'}] queda {descricao}")
+        for problema in problemas:
+            print(f"    - {problema}")
+        falhas += bool(problemas)
+
+    print(f"\n{len(cenarios) - falhas}/{len(cenarios)} cenários recuperados sem perda de dados")
+    sys.exit(1 if falhas else 0)
+
+if __name__ == "__main__":
+    main()
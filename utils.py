@@ -1,7 +1,10 @@
-import os, sys, mysql.connector, psycopg2, xml.etree.ElementTree as ET
+import os, sys, mysql.connector, psycopg2, psycopg2.pool, xml.etree.ElementTree as ET
 from loggingConfig import get_logger
+import metricas
+import rastreamento
+import perfilNavegador
 from mysql.connector import Error
-from datetime import datetime
+from datetime import datetime, timedelta
 from dateutil import parser
 from selenium import webdriver
 from selenium.webdriver.common.by import By
@@ -9,10 +12,15 @@ from selenium.webdriver.chrome.options import Options as ChromeOptions
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from dotenv import load_dotenv
+import disjuntor
 
 load_dotenv()
 logger = get_logger(__name__)
 
+# Atraso em minutos antes de cada nova tentativa de solicitação (o último valor se repete)
+CURVA_BACKOFF_MINUTOS = [int(minutos) for minutos in os.environ.get("CURVA_BACKOFF_MINUTOS", "60,240,720,1440,2880").split(",")]
+MAX_TENTATIVAS_SOLICITACAO = int(os.environ.get("MAX_TENTATIVAS_SOLICITACAO", 6))
+
 def minha_funcao():
     logger.info("Mensagem informativa")
     logger.error("Ocorreu um erro")
@@ -36,24 +44,69 @@ def conectar_mysql():
         logger.error(f"Erro ao conectar ao MySQL: {erro}")
         return None
 
+def parametros_postgres():
+    required_vars = ["POSTGRES_HOST", "POSTGRES_USER", "POSTGRES_PASSWORD"]
+    missing_vars = [var for var in required_vars if not os.environ.get(var)]
+    if missing_vars:
+        logger.error(f"Variáveis de ambiente faltando: {', '.join(missing_vars)}")
+        return None
+    conn_params = {"host": os.environ.get("POSTGRES_HOST"), "user": os.environ.get("POSTGRES_USER"),
+        "password": os.environ.get("POSTGRES_PASSWORD"), "dbname": "analytics", "port": os.environ.get("POSTGRES_PORT", "5432")}
+    for key, value in conn_params.items():
+        if value and isinstance(value, bytes):
+            try: conn_params[key] = value.decode('utf-8')
+            except UnicodeDecodeError:
+                try: conn_params[key] = value.decode('latin-1')
+                except Exception as e:
+                    logger.error(f"Erro ao decodificar valor para {key}: {e}")
+                    return None
+    return conn_params
+
+# Pool compartilhado, ativado pelo orquestrador; nos serviços isolados cada chamada abre uma conexão
+pool_postgres = None
+
+class ConexaoPool:
+    """Conexão emprestada do pool: close() desfaz o que não foi confirmado e a devolve ao pool"""
+    def __init__(self, pool, conexao):
+        self.pool, self.conexao = pool, conexao
+
+    def close(self):
+        if self.conexao is None: return
+        conexao, self.conexao = self.conexao, None
+        try:
+            if not conexao.closed: conexao.rollback()
+        except Exception: pass
+        self.pool.putconn(conexao, close=bool(conexao.closed))
+
+    def __getattr__(self, nome):
+        return getattr(self.conexao, nome)
+
+def ativar_pool_postgres(minimo=1, maximo=10):
+    global pool_postgres
+    conn_params = parametros_postgres()
+    if not conn_params: return False
+    try:
+        pool_postgres = psycopg2.pool.ThreadedConnectionPool(minimo, maximo, **conn_params)
+        logger.info(f"Pool de conexões PostgreSQL ativado ({minimo}-{maximo} conexões)")
+        return True
+    except Exception as erro: logger.error(f"Erro ao criar pool de conexões PostgreSQL: {erro}")
+    return False
+
+def fechar_pool_postgres():
+    global pool_postgres
+    if pool_postgres is not None:
+        pool_postgres.closeall()
+        pool_postgres = None
+
 def conectar_postgres():
     try:
-        required_vars = ["POSTGRES_HOST", "POSTGRES_USER", "POSTGRES_PASSWORD"]
-        missing_vars = [var for var in required_vars if not os.environ.get(var)]
-        if missing_vars:
-            logger.error(f"Variáveis de ambiente faltando: {', '.join(missing_vars)}")
-            return None
-        conn_params = {"host": os.environ.get("POSTGRES_HOST"), "user": os.environ.get("POSTGRES_USER"),
-            "password": os.environ.get("POSTGRES_PASSWORD"), "dbname": "analytics", "port": os.environ.get("POSTGRES_PORT", "5432")}
-        for key, value in conn_params.items():
-            if value and isinstance(value, bytes):
-                try: conn_params[key] = value.decode('utf-8')
-                except UnicodeDecodeError:
-                    try: conn_params[key] = value.decode('latin-1')
-                    except Exception as e:
-                        logger.error(f"Erro ao decodificar valor para {key}: {e}")
-                        return None
-        conexao = psycopg2.connect(**conn_params)
+        if pool_postgres is not None:
+            with metricas.cronometrar(metricas.POSTGRES_SEGUNDOS, operacao="conexao_pool"):
+                return ConexaoPool(pool_postgres, pool_postgres.getconn())
+        conn_params = parametros_postgres()
+        if not conn_params: return None
+        with metricas.cronometrar(metricas.POSTGRES_SEGUNDOS, operacao="conexao"):
+            conexao = psycopg2.connect(**conn_params)
         logger.info("Conexão ao PostgreSQL estabelecida com sucesso")
         return conexao
     except psycopg2.OperationalError as erro: logger.error(f"Erro operacional ao conectar ao PostgreSQL: {erro}")
@@ -110,6 +163,9 @@ def extrair_dado_xml(xml_path, tipo):
     return None
 
 def iniciar_navegador_selenoid(download_dir=None):
+    if not disjuntor.permitir_navegacao():
+        logger.warning("Disjuntor SEFAZ aberto: navegador não será iniciado")
+        return None
     logger.info("Iniciando navegador Chrome com Selenoid")
     options = ChromeOptions()
     container_download_path = "/home/selenium/Downloads"
@@ -131,12 +187,19 @@ def iniciar_navegador_selenoid(download_dir=None):
         selenoid_url = os.environ.get("SELENOID_URL", "http://localhost:4444/wd/hub")
         logger.info(f"Conectando ao Selenoid em: {selenoid_url}")
         for key, value in capabilities.items(): options.set_capability(key, value)
-        navegador = webdriver.Remote(command_executor=selenoid_url, options=options)
+        if selenoid_url.startswith("simulado:"):
+            import simuladorSefaz
+            navegador = perfilNavegador.instrumentar(simuladorSefaz.NavegadorFalso(download_dir))
+        else:
+            navegador = perfilNavegador.instrumentar(webdriver.Remote(command_executor=selenoid_url, options=options))
         navegador.set_page_load_timeout(60)
         navegador.set_script_timeout(60)
         navegador.get(os.environ.get("URL_LOGIN"))
+        metricas.registrar_navegador(navegador)
         return navegador
-    except Exception as e: logger.error(f"Erro ao iniciar o navegador com Selenoid: {str(e)}")
+    except Exception as e:
+        logger.error(f"Erro ao iniciar o navegador com Selenoid: {str(e)}")
+        disjuntor.registrar_falha("inicialização do navegador")
     return None
 
 def autenticar_sefaz(navegador, espera=2):
@@ -154,13 +217,23 @@ def autenticar_sefaz(navegador, espera=2):
         campo_senha.send_keys(senha)
         botao_avancar.click()
         logger.info("Autenticação bem-sucedida")
+        disjuntor.registrar_sucesso()
         return True
-    except Exception as e: logger.error(f"Erro ao realizar login: {e}")
+    except Exception as e:
+        logger.error(f"Erro ao realizar login: {e}")
+        disjuntor.registrar_falha("login")
     return False
 
 def acessar_pagina(navegador, link):
+    if not disjuntor.permitir_navegacao():
+        raise disjuntor.DisjuntorAberto(f"Disjuntor SEFAZ aberto: acesso a {link} bloqueado")
     logger.info(f"Acessando página: {link}")
-    navegador.get(link)
+    try:
+        navegador.get(link)
+    except Exception:
+        disjuntor.registrar_falha(f"acesso a {link}")
+        raise
+    disjuntor.registrar_sucesso()
     return navegador
 
 def verificar_downloads_em_progresso(diretorio_download):
@@ -176,6 +249,12 @@ def verificar_downloads_em_progresso(diretorio_download):
     except Exception as e: logger.error(f"Erro ao verificar downloads em progresso: {str(e)}")
     return False
 
+def calcular_proxima_tentativa(tentativas, horario=None):
+    """Horário da próxima tentativa após a solicitação de número `tentativas` (1, 2, ...)"""
+    indice = min(max(tentativas, 1), len(CURVA_BACKOFF_MINUTOS)) - 1
+    return (horario or datetime.now()) + timedelta(minutes=CURVA_BACKOFF_MINUTOS[indice])
+
+@rastreamento.rastrear()
 def espera_para_clicar():
     import time
     now = time.localtime()